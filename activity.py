@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+
+from database import now_str
+
+logger = logging.getLogger(__name__)
+
+# Буфер сбрасывается раз в FLUSH_INTERVAL секунд или при накоплении FLUSH_ROWS пользователей
+FLUSH_INTERVAL = 0.5
+FLUSH_ROWS = 500
+
+# Повторный /start не трогает дату регистрации и не стирает телефон, компанию и запрос
+UPSERT_USER = '''
+INSERT INTO users
+(user_id, username, first_name, last_name, phone, company, request, registration_date, is_active, last_activity)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    username = excluded.username,
+    first_name = excluded.first_name,
+    last_name = excluded.last_name,
+    phone = COALESCE(excluded.phone, users.phone),
+    company = COALESCE(excluded.company, users.company),
+    request = COALESCE(excluded.request, users.request),
+    is_active = 1,
+    last_activity = excluded.last_activity
+'''
+
+# Написавший боту пользователь снова доступен для рассылок, даже если раньше его блокировал
+TOUCH_USER = 'UPDATE users SET last_activity = ?, is_active = 1 WHERE user_id = ?'
+
+# Заблокировавший бота (my_chat_member со статусом kicked): last_activity не трогаем
+BLOCK_USER = 'UPDATE users SET is_active = 0 WHERE user_id = ?'
+
+USER_FIELDS = ('username', 'first_name', 'last_name', 'phone', 'company', 'request')
+
+# История заявок только дополняется: каждая завершённая анкета — новая строка
+INSERT_LEAD = '''
+INSERT INTO leads (user_id, username, first_name, last_name, phone, company, request, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+# Копит обновления пользователей в памяти и пишет их пачкой в одной транзакции.
+# Несколько обновлений одного пользователя между сбросами схлопываются в одну строку.
+class ActivityTracker:
+    def __init__(self, db, flush_interval=FLUSH_INTERVAL, flush_rows=FLUSH_ROWS):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self._upserts = {}
+        self._touches = {}
+        self._blocked = set()
+        self._leads = []
+        self._task = None
+        self._flushing = None
+        # Метрики
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.max_queue_depth = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._upserts) + len(self._touches) + len(self._blocked) + len(self._leads)
+
+    # Регистрация или обновление анкеты (/start, завершённая заявка)
+    def upsert(self, user_data):
+        user_id = user_data['user_id']
+        now = now_str()
+        row = self._upserts.get(user_id)
+        if row is None:
+            row = self._upserts[user_id] = {'registration_date': now}
+            self._touches.pop(user_id, None)
+        self._blocked.discard(user_id)
+        for field in USER_FIELDS:
+            value = user_data.get(field)
+            if value is not None or field in ('username', 'first_name', 'last_name'):
+                row[field] = value
+        row['last_activity'] = now
+        self._queued()
+
+    # Завершённая заявка. Пишется в той же транзакции после анкеты, на которую ссылается
+    def add_lead(self, user_data):
+        self._leads.append((
+            user_data['user_id'], user_data.get('username'), user_data.get('first_name'),
+            user_data.get('last_name'), user_data.get('phone'), user_data.get('company'),
+            user_data.get('request'), now_str()
+        ))
+        self._queued()
+
+    # Сообщение или нажатие кнопки: обновляем last_activity и снимаем отметку неактивного
+    def touch(self, user_id):
+        now = now_str()
+        row = self._upserts.get(user_id)
+        if row is not None:
+            row['last_activity'] = now
+        else:
+            self._touches[user_id] = now
+        self._blocked.discard(user_id)
+        self._queued()
+
+    # Пользователь заблокировал бота. Пишется после анкет и действий из того же буфера,
+    # а более позднее сообщение пользователя (touch, upsert) отменяет блокировку
+    def block(self, user_id):
+        self._blocked.add(user_id)
+        self._queued()
+
+    def _queued(self):
+        depth = self.queue_depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        if depth >= self.flush_rows and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        if not self._upserts and not self._touches and not self._blocked and not self._leads:
+            return
+        upserts, self._upserts = self._upserts, {}
+        touches, self._touches = self._touches, {}
+        blocked, self._blocked = self._blocked, set()
+        leads, self._leads = self._leads, []
+        upsert_rows = [
+            (user_id, row.get('username'), row.get('first_name'), row.get('last_name'),
+             row.get('phone'), row.get('company'), row.get('request'),
+             row['registration_date'], row['last_activity'])
+            for user_id, row in upserts.items()
+        ]
+        touch_rows = [(last_activity, user_id) for user_id, last_activity in touches.items()]
+        block_rows = [(user_id,) for user_id in blocked]
+
+        def write(conn):
+            with conn:
+                conn.executemany(UPSERT_USER, upsert_rows)
+                conn.executemany(TOUCH_USER, touch_rows)
+                conn.executemany(BLOCK_USER, block_rows)
+                conn.executemany(INSERT_LEAD, leads)
+
+        start = time.perf_counter()
+        try:
+            await self.db.run(write)
+        except Exception:
+            # Не теряем обновления: вернём их в буфер, более свежие данные важнее
+            active_since = self._upserts.keys() | self._touches.keys()
+            for user_id, row in upserts.items():
+                newer = dict(self._upserts.get(user_id, {}))
+                newer.pop('registration_date', None)
+                row.update(newer)
+                self._upserts[user_id] = row
+            for user_id, last_activity in touches.items():
+                self._touches.setdefault(user_id, last_activity)
+            # Пользователь, написавший после неудачного сброса, снова активен
+            self._blocked |= blocked - active_since
+            self._leads[:0] = leads
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.rows_flushed += len(upsert_rows) + len(touch_rows) + len(block_rows) + len(leads)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def metrics(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed,
+            'last_flush_ms': self.last_flush_ms,
+            'avg_flush_ms': self.total_flush_ms / self.flushes if self.flushes else 0.0,
+            'max_flush_ms': self.max_flush_ms,
+        }
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи активности пользователей: {e}")
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._flushing and not self._flushing.done():
+            await asyncio.wait([self._flushing])
+        await self.flush()
+        logger.info(f"Активность пользователей записана: {self.metrics()}")
@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from broadcast import GLOBAL_RATE, SENDER_CONCURRENCY, RateLimiter, run_broadcast, format_progress
+from fake_bot_api import FakeBotAPI
+
+# Бенчмарк рассылки: шлём N сообщений через локальный фейковый Bot API
+# и сравниваем установившуюся скорость с заданным лимитом.
+#
+#   python benchmarks/bench_broadcast.py --recipients 1500 --rate 30 --latency 0.05
+
+
+async def main(args):
+    api = await FakeBotAPI(rate_limit=args.server_limit, latency=args.latency).start()
+    bot = Bot(
+        "123:fake",
+        base_url=api.base_url,
+        request=HTTPXRequest(connection_pool_size=args.concurrency + 4),
+    )
+    limiter = RateLimiter(rate=args.rate)
+
+    async def send(chat_id):
+        await bot.send_message(chat_id=chat_id, text="Бенчмарк рассылки")
+
+    async def on_progress(stats):
+        print(format_progress(stats).replace("\n", " | "))
+
+    try:
+        async with bot:
+            stats = await run_broadcast(
+                range(1, args.recipients + 1), send, limiter,
+                total=args.recipients, concurrency=args.concurrency,
+                on_progress=on_progress, progress_interval=5,
+            )
+    finally:
+        await api.stop()
+
+    sustained = api.sustained_rate()
+    print()
+    print(f"Получателей:            {stats.total}")
+    print(f"Доставлено / ошибок:    {stats.sent} / {stats.failed}")
+    print(f"Время:                  {stats.elapsed:.1f} с")
+    print(f"Средняя скорость:       {stats.rate:.1f} сообщ/с")
+    print(f"Установившаяся скорость: {sustained:.1f} сообщ/с (лимит {args.rate}, {sustained / args.rate:.0%})")
+    print(f"Ответов 429:            {api.flood_errors}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', type=int, default=1500)
+    parser.add_argument('--rate', type=float, default=GLOBAL_RATE)
+    parser.add_argument('--server-limit', type=int, default=GLOBAL_RATE,
+                        help="лимит фейкового API в сообщениях за секунду (0 — без лимита)")
+    parser.add_argument('--concurrency', type=int, default=SENDER_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=0.05, help="задержка ответа API, сек")
+    asyncio.run(main(parser.parse_args()))
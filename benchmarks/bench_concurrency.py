@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import importlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI
+from bench_webhook import STEPS, UpdateFactory, percentile
+from payload import text_payload
+
+# Задержка ответа клиентам во время рассылки: сначала клиенты проходят диалог
+# заявки на холостом боте, затем то же самое, пока идёт рассылка по всей базе
+# и админ выгружает базу. Обновления кладутся прямо в update_queue, как при polling.
+# Часть клиентов шлёт все шаги сразу, не дожидаясь ответов, — их анкеты
+# в конце проверяются на порядок обработки.
+#
+#   python benchmarks/bench_concurrency.py --users 50000 --duration 10 --arrivals 20
+
+ADMIN_ID = 10 ** 9
+CLIENT_BASE = 2 * 10 ** 9
+
+
+def callback_update(factory, user_id, data):
+    factory.update_id += 1
+    return {
+        'update_id': factory.update_id,
+        'callback_query': {
+            'id': str(factory.update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Админ'},
+            'chat_instance': '1',
+            'data': data,
+            'message': {
+                'message_id': factory.update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'Админ-панель:',
+            },
+        },
+    }
+
+
+async def run_phase(application, factory, replies, first_id, args):
+    from telegram import Update
+
+    latencies = defaultdict(list)
+    errors = 0
+    bursts = []
+
+    async def put(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    async def client(user_id):
+        nonlocal errors
+        for step, text in STEPS:
+            start = time.perf_counter()
+            await put(factory.message(user_id, text))
+            try:
+                reply_at = await asyncio.wait_for(replies[user_id].get(), args.timeout)
+            except asyncio.TimeoutError:
+                errors += 1
+                return
+            latencies[step].append((reply_at - start) * 1000)
+
+    # Все шаги подряд, без ожидания ответа: проверка порядка внутри пользователя
+    async def burst(user_id):
+        bursts.append(user_id)
+        for step, text in STEPS:
+            await put(factory.message(user_id, f'{text} {user_id}' if step != '/start' else text))
+
+    tasks = []
+    user_id = first_id
+    deadline = time.perf_counter() + args.duration
+    while time.perf_counter() < deadline:
+        flow = burst if (user_id - first_id) % args.burst_every == 0 else client
+        tasks.append(asyncio.create_task(flow(user_id)))
+        user_id += 1
+        await asyncio.sleep(1 / args.arrivals)
+    await asyncio.gather(*tasks)
+    return latencies, errors, bursts, user_id
+
+
+def report(title, latencies, errors):
+    everything = [value for values in latencies.values() for value in values]
+    print(f"\n{title}: ответов {len(everything)}, ошибок {errors}")
+    print(f"{'шаг':<10} {'p50, мс':>9} {'p90, мс':>9} {'p99, мс':>9}")
+    for step, _ in STEPS:
+        values = latencies[step]
+        print(f"{step:<10} {percentile(values, 50):9.1f} {percentile(values, 90):9.1f} {percentile(values, 99):9.1f}")
+    print(f"{'всего':<10} {percentile(everything, 50):9.1f} {percentile(everything, 90):9.1f} "
+          f"{percentile(everything, 99):9.1f}")
+    return percentile(everything, 50), percentile(everything, 99)
+
+
+async def main(args):
+    # База бота создаётся в текущей папке — работаем во временной
+    os.chdir(tempfile.mkdtemp(prefix='bench_concurrency_'))
+    bot = importlib.import_module('bot')
+
+    replies = defaultdict(asyncio.Queue)
+    broadcast_sent = 0
+
+    def on_send(chat_id, method):
+        nonlocal broadcast_sent
+        if chat_id >= CLIENT_BASE:
+            replies[chat_id].put_nowait(time.perf_counter())
+        elif chat_id < ADMIN_ID:
+            broadcast_sent += 1
+
+    api = await FakeBotAPI(rate_limit=0, latency=args.latency, on_send=on_send).start()
+
+    print(f"Генерация базы на {args.users} пользователей...")
+    await bot.db.executemany(
+        'INSERT INTO users (user_id, username, first_name, phone, company, request, registration_date, '
+        'is_active, last_activity) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)',
+        [(user_id, f'user{user_id}', 'Иван', '+79990000000', 'ООО Ромашка', 'Консультация',
+          '2024-01-01 00:00:00', '2024-01-01 00:00:00') for user_id in range(1, args.users + 1)]
+    )
+    await bot.db.execute('INSERT INTO admins (admin_id, is_superadmin) VALUES (?, 1)', (ADMIN_ID,))
+
+    application = bot.build_application(token='123:fake', base_url=api.base_url)
+    await application.initialize()
+    await application.start()
+    await application.post_init(application)
+
+    factory = UpdateFactory()
+    idle, idle_errors, idle_bursts, next_id = await run_phase(application, factory, replies, CLIENT_BASE, args)
+
+    # Нагрузка: рассылка по всей базе и выгрузка через админ-панель
+    broadcast_id = await bot.broadcast_queue.create(ADMIN_ID, {}, text_payload('Бенчмарк рассылки'))
+    total = (await bot.broadcast_queue.get(broadcast_id))['total']
+    broadcast = bot.broadcast_tasks.start(application, bot.run_broadcast_job(application.bot, broadcast_id))
+    await application.update_queue.put(bot.Update.de_json(factory.message(ADMIN_ID, '/admin'), application.bot))
+    for _ in range(args.exports):
+        await application.update_queue.put(
+            bot.Update.de_json(callback_update(factory, ADMIN_ID, 'export_xlsx'), application.bot))
+    print(f"Рассылка #{broadcast_id} на {total} получателей и выгрузок: {args.exports}")
+
+    loaded, loaded_errors, loaded_bursts, _ = await run_phase(application, factory, replies, next_id, args)
+    print(f"За время замера разослано {broadcast_sent} сообщений, "
+          f"выгрузок выполняется {bot.export_tasks.running}, ждут {bot.export_tasks.waiting}")
+
+    broadcast.cancel()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+
+    # Анкеты «залповых» клиентов: каждое поле должно попасть на своё место
+    ordered = 0
+    bursts = idle_bursts + loaded_bursts
+    conn = sqlite3.connect(bot.DB_PATH)
+    for user_id in bursts:
+        row = conn.execute('SELECT phone, company, request FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if row == tuple(f'{text} {user_id}' for _, text in STEPS[2:]):
+            ordered += 1
+    conn.close()
+
+    idle_p50, idle_p99 = report("Без нагрузки", idle, idle_errors)
+    loaded_p50, loaded_p99 = report("Во время рассылки и выгрузки", loaded, loaded_errors)
+    print(f"\np50: {idle_p50:.1f} → {loaded_p50:.1f} мс, p99: {idle_p99:.1f} → {loaded_p99:.1f} мс")
+    print(f"Порядок шагов сохранён у {ordered} из {len(bursts)} клиентов, отправивших всё сразу")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50000, help="пользователей в базе (получатели рассылки)")
+    parser.add_argument('--duration', type=float, default=10, help="длительность каждого замера, сек")
+    parser.add_argument('--arrivals', type=float, default=20, help="новых клиентов в секунду")
+    parser.add_argument('--burst-every', type=int, default=5, help="каждый N-й клиент шлёт все шаги сразу")
+    parser.add_argument('--exports', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка ответа Bot API, сек")
+    parser.add_argument('--timeout', type=float, default=30)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from activity import ActivityTracker
+from database import Database
+
+# Бенчмарк работы /start с базой: сколько обновлений в секунду выдерживает
+# старый вариант (новое соединение на каждый вызов прямо в event loop)
+# и новый (одно соединение в WAL-режиме в отдельном потоке).
+#
+#   python benchmarks/bench_db.py --updates 3000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    phone TEXT,
+    company TEXT,
+    request TEXT,
+    registration_date TEXT,
+    is_active INTEGER DEFAULT 1,
+    last_activity TEXT
+)
+'''
+
+UPSERT = '''
+INSERT OR REPLACE INTO users
+(user_id, username, first_name, last_name, phone, company, request, registration_date, is_active, last_activity)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+'''
+
+
+def user_row(user_id):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return (user_id, f'user{user_id}', 'Имя', 'Фамилия', None, None, None, now, now)
+
+
+# Старая реализация add_user из bot.py
+def legacy_add_user(path, user_id):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute(UPSERT, user_row(user_id))
+    conn.commit()
+    conn.close()
+
+
+# Следим из отдельного потока, насколько event loop «залипает» во время работы с базой:
+# ставим в loop пустой колбэк и меряем, через сколько он выполнится
+def loop_lag_monitor(loop, samples, stop, interval=0.005):
+    while not stop.is_set():
+        done = threading.Event()
+        start = time.perf_counter()
+        loop.call_soon_threadsafe(done.set)
+        done.wait()
+        samples.append(time.perf_counter() - start)
+        time.sleep(interval)
+
+
+async def measure(name, handler, updates, concurrency, finish=None):
+    lags = []
+    stop = threading.Event()
+    monitor = threading.Thread(target=loop_lag_monitor, args=(asyncio.get_running_loop(), lags, stop))
+    monitor.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id):
+        async with semaphore:
+            await handler(user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(user_id) for user_id in range(updates)))
+    if finish:
+        await finish()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.to_thread(monitor.join)
+
+    lags.sort()
+    max_lag = lags[-1] * 1000 if lags else 0.0
+    print(f"{name:<28} {updates / elapsed:>10.0f} обновл/с   макс. задержка loop {max_lag:>7.1f} мс")
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        conn = sqlite3.connect(legacy_path)
+        conn.execute(SCHEMA)
+        conn.close()
+
+        async def legacy(user_id):
+            legacy_add_user(legacy_path, user_id)
+
+        db = Database(os.path.join(tmp, 'pooled.db'))
+        db.call(lambda conn: conn.execute(SCHEMA))
+
+        async def pooled(user_id):
+            await db.execute(UPSERT, user_row(user_id))
+
+        buffered_db = Database(os.path.join(tmp, 'buffered.db'))
+        buffered_db.call(lambda conn: conn.execute(SCHEMA))
+        activity = ActivityTracker(buffered_db)
+
+        async def buffered(user_id):
+            activity.upsert({'user_id': user_id, 'username': f'user{user_id}',
+                             'first_name': 'Имя', 'last_name': 'Фамилия'})
+
+        print(f"/start: {args.updates} обновлений, параллельно {args.concurrency}")
+        await measure("до: connect на вызов", legacy, args.updates, args.concurrency)
+        await measure("после: WAL + поток базы", pooled, args.updates, args.concurrency)
+        activity.start()
+        await measure("после: буфер активности", buffered, args.updates, args.concurrency, activity.stop)
+        print(f"буфер активности: {activity.metrics()}")
+        db.close()
+        buffered_db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
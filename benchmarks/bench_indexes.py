@@ -0,0 +1,116 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+from segments import compile_segment
+
+# Бенчмарк индексов: синтетическая база на N пользователей, запросы выборки
+# получателей и статистики до миграции с индексами и после неё.
+#
+#   python benchmarks/bench_indexes.py --users 1000000
+
+NOW = datetime.now()
+WEEK_AGO = (NOW - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+TODAY = NOW.strftime('%Y-%m-%d')
+TOMORROW = (NOW + timedelta(days=1)).strftime('%Y-%m-%d')
+ACTIVE_30, ACTIVE_30_PARAMS = compile_segment({'active_days': 30}, NOW)
+COMPANY, COMPANY_PARAMS = compile_segment({'company': 'ООО Компания 7'}, NOW)
+
+QUERIES = [
+    ("получатели: все активные",
+     'SELECT user_id FROM users WHERE is_active = 1', ()),
+    ("получатели: новые за неделю",
+     'SELECT user_id FROM users WHERE is_active = 1 AND registration_date >= ?', (WEEK_AGO,)),
+    ("статистика: неактивные",
+     'SELECT COUNT(*) FROM users WHERE is_active = 0', ()),
+    ("статистика: сегодня, date()",
+     'SELECT COUNT(*) FROM users WHERE date(registration_date) = ?', (TODAY,)),
+    ("статистика: сегодня, диапазон",
+     'SELECT COUNT(*) FROM users WHERE registration_date >= ? AND registration_date < ?', (TODAY, TOMORROW)),
+    ("сегмент: активны за 30 дней",
+     f'SELECT COUNT(*) FROM users WHERE {ACTIVE_30}', ACTIVE_30_PARAMS),
+    ("сегмент: компания",
+     f'SELECT COUNT(*) FROM users WHERE {COMPANY}', COMPANY_PARAMS),
+    ("менеджеры",
+     'SELECT admin_id FROM admins WHERE is_superadmin = 0', ()),
+]
+
+
+def generate_users(count):
+    random.seed(1)
+    start = NOW - timedelta(days=730)
+    for user_id in range(1, count + 1):
+        registered = start + timedelta(seconds=random.randrange(730 * 86400))
+        stamp = registered.strftime('%Y-%m-%d %H:%M:%S')
+        yield (
+            user_id, f'user{user_id}', 'Имя', 'Фамилия', '+79990000000',
+            f'ООО Компания {user_id % 1000}', None, stamp, int(random.random() < 0.85), stamp
+        )
+
+
+def build(path, users):
+    conn = sqlite3.connect(path)
+    migrate(conn, target=1)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    # Триггеры статистики для генерации не нужны
+    triggers = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")]
+    for trigger in triggers:
+        conn.execute(f'DROP TRIGGER {trigger}')
+    with conn:
+        conn.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', generate_users(users))
+        conn.executemany('INSERT INTO admins (admin_id, is_superadmin) VALUES (?, ?)',
+                         [(i, int(i == 1)) for i in range(1, 11)])
+    return conn
+
+
+def run_queries(conn, repeat):
+    results = {}
+    for name, sql, params in QUERIES:
+        plan = ' / '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = (best * 1000, plan)
+    return results
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        print(f"Генерация базы на {args.users} пользователей...")
+        start = time.perf_counter()
+        conn = build(path, args.users)
+        print(f"готово за {time.perf_counter() - start:.1f} с\n")
+
+        before = run_queries(conn, args.repeat)
+        start = time.perf_counter()
+        migrate(conn)
+        print(f"Миграция с индексами: {time.perf_counter() - start:.1f} с\n")
+        after = run_queries(conn, args.repeat)
+        conn.close()
+
+    for name, _, _ in QUERIES:
+        before_ms, before_plan = before[name]
+        after_ms, after_plan = after[name]
+        print(f"{name}")
+        print(f"  до:    {before_ms:9.1f} мс  {before_plan}")
+        print(f"  после: {after_ms:9.1f} мс  {after_plan}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI
+from bench_webhook import STEPS, UpdateFactory, percentile
+from bench_concurrency import callback_update
+from payload import text_payload
+
+# Нагрузочный тест всего бота без Telegram. Фейковый Bot API отвечает с задержкой
+# и случайным хвостом, иногда возвращает 429, часть получателей рассылок
+# заблокировала бота. Тысячи клиентов проходят диалог /start → ... → заявка,
+# одновременно идут рассылки по всей базе и выгрузки из админ-панели.
+# Метрики бота включены: по ним считается ожидание потока базы (конкуренция за базу).
+#
+#   python benchmarks/bench_load.py --clients 2000 --concurrency 200 --broadcasts 2 --exports 2
+
+ADMIN_ID = 10 ** 9
+MANAGER_BASE = 10 ** 9 + 1
+CLIENT_BASE = 2 * 10 ** 9
+
+
+async def seed(bot, args):
+    companies = [f'ООО Компания {index}' for index in range(100)]
+    await bot.db.executemany(
+        'INSERT INTO users (user_id, username, first_name, phone, company, request, registration_date, '
+        'is_active, last_activity) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)',
+        [(user_id, f'user{user_id}', 'Иван', '+79990000000', companies[user_id % len(companies)], 'Консультация',
+          '2024-01-01 00:00:00', '2024-01-01 00:00:00') for user_id in range(1, args.users + 1)]
+    )
+    # Суперадмин запускает рассылки и выгрузки, менеджеры получают уведомления о заявках
+    await bot.db.executemany(
+        'INSERT INTO admins (admin_id, is_superadmin) VALUES (?, ?)',
+        [(ADMIN_ID, 1)] + [(MANAGER_BASE + index, 0) for index in range(args.managers)]
+    )
+
+
+async def run_clients(application, factory, replies, args):
+    from telegram import Update
+
+    latencies = defaultdict(list)
+    lost = 0
+    completed = 0
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def client(user_id):
+        nonlocal lost, completed
+        async with slots:
+            for step, text in STEPS:
+                start = time.perf_counter()
+                await application.update_queue.put(Update.de_json(factory.message(user_id, text), application.bot))
+                try:
+                    reply_at = await asyncio.wait_for(replies[user_id].get(), args.timeout)
+                except asyncio.TimeoutError:
+                    # Ответ потерян (например, 429 на ответе клиенту) — клиент уходит
+                    lost += 1
+                    return
+                latencies[step].append((reply_at - start) * 1000)
+            completed += 1
+
+    await asyncio.gather(*(client(CLIENT_BASE + index) for index in range(args.clients)))
+    return latencies, lost, completed
+
+
+# Пик очереди обновлений: ждут в update_queue и в очередях пользователей
+async def sample_backlog(application, peaks):
+    while True:
+        peaks.append(application.update_queue.qsize() + application.queued_updates)
+        await asyncio.sleep(0.1)
+
+
+def report_clients(latencies, lost, completed, elapsed):
+    everything = [value for values in latencies.values() for value in values]
+    print(f"\nКлиенты: заявок {completed}, потеряно ответов {lost}, за {elapsed:.1f} с")
+    print(f"Пропускная способность: {len(everything) / elapsed:.1f} обновлений/с, "
+          f"{completed / elapsed:.1f} заявок/с")
+    print(f"{'шаг':<10} {'p50, мс':>9} {'p90, мс':>9} {'p99, мс':>9}")
+    for step, _ in STEPS:
+        values = latencies[step]
+        print(f"{step:<10} {percentile(values, 50):9.1f} {percentile(values, 90):9.1f} {percentile(values, 99):9.1f}")
+    print(f"{'всего':<10} {percentile(everything, 50):9.1f} {percentile(everything, 90):9.1f} "
+          f"{percentile(everything, 99):9.1f}")
+
+
+def report_db(metrics):
+    ms = 1000
+    wait, queries = metrics.db_wait_seconds, metrics.db_seconds
+    print(f"\nБаза: {queries.count()} запросов, ожидание потока базы p50 {wait.quantile(0.5) * ms:.1f} мс, "
+          f"p99 {wait.quantile(0.99) * ms:.1f} мс (оценка по корзинам)")
+    busiest = sorted(queries.series.items(), key=lambda item: item[1][1], reverse=True)[:5]
+    print(f"{'операция':<24} {'запросов':>9} {'всего, мс':>10} {'p99, мс':>9}")
+    for (operation,), (counts, total) in busiest:
+        print(f"{operation:<24} {sum(counts):9} {total * ms:10.0f} "
+              f"{queries.quantile(0.99, operation=operation) * ms:9.1f}")
+
+
+async def main(args):
+    # База бота создаётся в текущей папке — работаем во временной
+    os.chdir(tempfile.mkdtemp(prefix='bench_load_'))
+    os.environ['METRICS_ENABLED'] = '1'
+    os.environ['METRICS_PORT'] = '0'
+    bot = importlib.import_module('bot')
+    if not args.verbose:
+        # Ошибки отправки заблокированным пользователям не засоряют вывод
+        logging.disable(logging.ERROR)
+
+    replies = defaultdict(asyncio.Queue)
+
+    def on_send(chat_id, method):
+        if chat_id >= CLIENT_BASE:
+            replies[chat_id].put_nowait(time.perf_counter())
+
+    rng = random.Random(args.seed)
+    blocked = rng.sample(range(1, args.users + 1), int(args.users * args.blocked))
+    api = await FakeBotAPI(
+        rate_limit=0, latency=args.latency, jitter=args.jitter, flood_chance=args.flood_chance,
+        blocked=blocked, seed=args.seed, on_send=on_send
+    ).start()
+
+    print(f"Генерация базы на {args.users} пользователей...")
+    await seed(bot, args)
+    # Генерация базы не входит в замер
+    bot.metrics.db_seconds.series.clear()
+    bot.metrics.db_wait_seconds.series.clear()
+
+    application = bot.build_application(token='123:fake', base_url=api.base_url)
+    await application.initialize()
+    await application.start()
+    await application.post_init(application)
+
+    factory = UpdateFactory()
+    peaks = []
+    sampler = asyncio.create_task(sample_backlog(application, peaks))
+    start = time.perf_counter()
+
+    for index in range(args.broadcasts):
+        broadcast_id = await bot.broadcast_queue.create(ADMIN_ID, {}, text_payload(f'Нагрузочная рассылка {index}'))
+        bot.broadcast_tasks.start(application, bot.run_broadcast_job(application.bot, broadcast_id))
+    await application.update_queue.put(bot.Update.de_json(factory.message(ADMIN_ID, '/admin'), application.bot))
+    for _ in range(args.exports):
+        await application.update_queue.put(
+            bot.Update.de_json(callback_update(factory, ADMIN_ID, 'export_xlsx'), application.bot))
+    print(f"Рассылок: {args.broadcasts} по {args.users} получателей, выгрузок: {args.exports}, "
+          f"клиентов: {args.clients} (одновременно {args.concurrency})")
+
+    latencies, lost, completed = await run_clients(application, factory, replies, args)
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+
+    metrics = bot.metrics
+    messages = metrics.broadcast_messages
+    exports_done = metrics.api_seconds.count(method='sendDocument')
+    report_clients(latencies, lost, completed, elapsed)
+    print(f"\nРассылки: доставлено {messages.total(result='sent')}, заблокировали бота "
+          f"{messages.total(result='blocked')}, ошибок {messages.total(result='failed')}, "
+          f"{messages.total() / elapsed:.1f} сообщ/с")
+    print(f"Bot API: 429 — {api.flood_errors}, 403 — {api.blocked_errors}, "
+          f"выгрузок отправлено {exports_done} из {args.exports}")
+    print(f"Очередь обновлений: пик {max(peaks, default=0)}, ошибок в обработчиках "
+          f"{metrics.handler_seconds.count(outcome='error')}")
+    report_db(metrics)
+
+    # Незавершённые рассылки прерываются остановкой и продолжились бы после перезапуска
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+
+    # Сверка с базой: каждая завершённая анкета сохранена
+    conn = sqlite3.connect(bot.DB_PATH)
+    saved = conn.execute('SELECT COUNT(*) FROM users WHERE user_id >= ? AND request IS NOT NULL',
+                         (CLIENT_BASE,)).fetchone()[0]
+    conn.close()
+    print(f"\nВ базе заявок от клиентов: {saved} из {completed} завершённых")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000, help="пользователей в базе (получатели рассылок)")
+    parser.add_argument('--clients', type=int, default=2000, help="клиентов, проходящих диалог заявки")
+    parser.add_argument('--concurrency', type=int, default=200, help="клиентов в диалоге одновременно")
+    parser.add_argument('--broadcasts', type=int, default=2)
+    parser.add_argument('--exports', type=int, default=2)
+    parser.add_argument('--managers', type=int, default=0,
+                        help="менеджеров, получающих уведомления о заявках (не больше 1 сообщения в секунду каждому)")
+    parser.add_argument('--latency', type=float, default=0.02, help="минимальная задержка ответа Bot API, сек")
+    parser.add_argument('--jitter', type=float, default=0.01, help="средний случайный хвост задержки, сек")
+    parser.add_argument('--flood-chance', type=float, default=0.001, help="доля отправок со случайным 429")
+    parser.add_argument('--blocked', type=float, default=0.05, help="доля получателей, заблокировавших бота")
+    parser.add_argument('--timeout', type=float, default=10, help="сколько клиент ждёт ответа, сек")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="не скрывать ошибки из логов бота")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from migrations import migrate
+from retention import Retention, format_report
+
+# Архивация и incremental_vacuum на базе, которая копилась годами: часть пользователей
+# давно заблокировала бота, у старых рассылок накопились результаты доставки.
+# База создаётся без auto_vacuum, как у уже работающего бота, поэтому первый прогон —
+# ручной запуск с --full-vacuum при остановленном боте; второй прогон через сутки
+# показывает обычное ежедневное обслуживание ботом (только incremental_vacuum).
+#
+#   python benchmarks/bench_retention.py --users 300000 --broadcasts 6
+
+
+def stamp(days_ago):
+    return (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def seed(path, users, broadcasts, inactive_share):
+    random.seed(1)
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    rows = []
+    leads = []
+    for user_id in range(1, users + 1):
+        inactive = random.random() < inactive_share
+        last_activity = stamp(random.randint(200, 700) if inactive else random.randint(0, 150))
+        request = f'Заявка клиента {user_id}: нужна консультация по продажам' if user_id % 3 == 0 else None
+        rows.append((user_id, f'user{user_id}', 'Иван', 'Петров', f'+7 999 {user_id:07d}', 'ООО Ромашка',
+                     request, stamp(800), 0 if inactive else 1, last_activity))
+        if request:
+            leads.append((user_id, 'Иван', request, last_activity))
+    with conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name, last_name, phone, company, request, '
+            'registration_date, is_active, last_activity) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+        conn.executemany('INSERT INTO leads (user_id, first_name, request, created_at) VALUES (?, ?, ?, ?)', leads)
+        # Старые рассылки по всей базе и одна свежая
+        for number in range(broadcasts):
+            age = 20 if number == broadcasts - 1 else 90 + number * 30
+            broadcast_id = conn.execute(
+                'INSERT INTO broadcasts (admin_chat_id, audience, text, status, created_at, finished_at, total, sent) '
+                'VALUES (1, ?, ?, ?, ?, ?, ?, ?)',
+                ('{}', 'Рассылка', 'done', stamp(age), stamp(age), users, users)
+            ).lastrowid
+            conn.execute(
+                'INSERT INTO broadcast_deliveries (broadcast_id, user_id, status, updated_at) '
+                'SELECT ?, user_id, ?, ? FROM users',
+                (broadcast_id, 'sent', stamp(age))
+            )
+    conn.close()
+
+
+async def main(args):
+    tmp = tempfile.mkdtemp(prefix='bench_retention_')
+    path = os.path.join(tmp, 'bench.db')
+    archive = os.path.join(tmp, 'archive.db')
+    print(f"Генерация базы: {args.users} пользователей, {args.broadcasts} рассылок...")
+    started = time.perf_counter()
+    seed(path, args.users, args.broadcasts, args.inactive)
+    print(f"готово за {time.perf_counter() - started:.1f} с\n")
+
+    db = Database(path)
+    print("Первый прогон (retention.py --full-vacuum):")
+    print(format_report(await Retention(db, archive, full_vacuum=True).run()))
+
+    # Сутки спустя: ещё немного заблокировавших и без новых старых рассылок
+    await db.execute(
+        'UPDATE users SET is_active = 0, last_activity = ? WHERE user_id IN '
+        '(SELECT user_id FROM users WHERE is_active = 1 ORDER BY user_id LIMIT ?)',
+        (stamp(181), args.users // 100)
+    )
+    print("\nСледующий прогон (задание бота, только incremental_vacuum):")
+    print(format_report(await Retention(db, archive).run()))
+    db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=300000)
+    parser.add_argument('--broadcasts', type=int, default=6)
+    parser.add_argument('--inactive', type=float, default=0.4, help="доля давно заблокировавших бота")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,116 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+from search import search_leads
+
+# Бенчмарк поиска заявок: синтетическая база на N пользователей с разными именами,
+# компаниями, телефонами и запросами. Сравнивается поиск по индексу FTS5
+# (первая страница и дальние страницы) с прежним вариантом — LIKE по всей таблице.
+#
+#   python benchmarks/bench_search.py --users 1000000
+
+FIRST_NAMES = ['Иван', 'Пётр', 'Анна', 'Мария', 'Сергей', 'Ольга', 'Дмитрий', 'Елена', 'Алексей', 'Наталья']
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов']
+COMPANY_WORDS = ['Ромашка', 'Вектор', 'Альфа', 'Горизонт', 'Техносфера', 'Стройинвест', 'Агрохолдинг', 'Меридиан']
+REQUESTS = [
+    'Нужна консультация по продажам', 'Хотим выстроить отдел маркетинга', 'Помогите с упаковкой франшизы',
+    'Интересует стратегия выхода на маркетплейсы', 'Падает выручка, нужен аудит', 'Масштабирование бизнеса',
+]
+PHONE_FORMATS = ['+7 ({0}) {1}-{2}-{3}', '8{0}{1}{2}{3}', '+7{0}{1}{2}{3}', '8 {0} {1} {2} {3}']
+
+QUERIES = [
+    ("имя и фамилия", 'Иван Петров'),
+    ("компания", 'Техносфера 77'),
+    ("префикс слова", 'маркетпл'),
+    ("телефон полностью", '+7 (912) 345-67-89'),
+    ("телефон без кода", '912 345 67 89'),
+    ("начало номера", '8 912 345'),
+    ("редкое сочетание", 'Анна аудит Меридиан'),
+]
+
+
+def generate_users(count):
+    random.seed(1)
+    for user_id in range(1, count + 1):
+        code, number = 900 + user_id % 100, 10_000_000 + user_id * 7 % 9_000_000
+        digits = f'{number:08d}'[-7:]
+        phone = random.choice(PHONE_FORMATS).format(code, digits[:3], digits[3:5], digits[5:])
+        yield (
+            user_id, f'user{user_id}', random.choice(FIRST_NAMES), random.choice(LAST_NAMES), phone,
+            f'ООО {random.choice(COMPANY_WORDS)} {user_id % 1000}', random.choice(REQUESTS),
+            '2024-01-01 00:00:00', 1, '2024-01-01 00:00:00'
+        )
+
+
+def build(path, users):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    migrate(conn, target=1)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    triggers = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")]
+    for trigger in triggers:
+        conn.execute(f'DROP TRIGGER {trigger}')
+    with conn:
+        conn.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', generate_users(users))
+    # Известный номер для поиска по телефону
+    with conn:
+        conn.execute("UPDATE users SET phone = '8-912-345-67-89' WHERE user_id = ?", (users // 2,))
+    return conn
+
+
+# Прежний способ найти заявку — LIKE по всем полям, полный проход по таблице
+def like_search(conn, text):
+    pattern = f'%{text}%'
+    return conn.execute(
+        'SELECT user_id FROM users WHERE first_name LIKE ? OR last_name LIKE ? OR company LIKE ? '
+        'OR request LIKE ? OR phone LIKE ? LIMIT 10', (pattern,) * 5
+    ).fetchall()
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, result
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        print(f"Генерация базы на {args.users} пользователей...")
+        start = time.perf_counter()
+        conn = build(path, args.users)
+        size = os.path.getsize(path)
+        print(f"готово за {time.perf_counter() - start:.1f} с, {size / 2 ** 20:.0f} МБ")
+
+        start = time.perf_counter()
+        migrate(conn)
+        print(f"Миграции с индексом поиска: {time.perf_counter() - start:.1f} с, "
+              f"база выросла на {(os.path.getsize(path) - size) / 2 ** 20:.0f} МБ\n")
+
+        print(f"{'запрос':<20} {'LIKE, мс':>10} {'FTS5, мс':>10} {'стр. 10, мс':>12} {'найдено':>8}")
+        for name, text in QUERIES:
+            like_ms, _ = best_of(args.repeat, lambda: like_search(conn, text))
+            fts_ms, (rows, _, _) = best_of(args.repeat, lambda: search_leads(conn, text))
+            page_ms, _ = best_of(args.repeat, lambda: search_leads(conn, text, offset=90))
+            print(f"{name:<20} {like_ms:10.1f} {fts_ms:10.1f} {page_ms:12.1f} {len(rows):8}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    main(parser.parse_args())
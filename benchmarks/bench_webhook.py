@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import aiohttp
+
+from fake_bot_api import FakeBotAPI
+
+# Нагрузочный тест вебхука без Telegram: шлём на локальный вебхук синтетические
+# обновления диалога /start → имя → телефон → компания → запрос и меряем время
+# от POST до ответа бота, пришедшего в фейковый Bot API.
+#
+#   python benchmarks/bench_webhook.py --users 300 --concurrency 50
+
+SECRET = 'bench-secret'
+MANAGERS = (10 ** 9 + 1, 10 ** 9 + 2)
+STEPS = [
+    ('/start', '/start'),
+    ('имя', 'Иван'),
+    ('телефон', '+79990000000'),
+    ('компания', 'ООО Ромашка'),
+    ('запрос', 'Нужна консультация по продажам'),
+]
+
+
+class UpdateFactory:
+    def __init__(self):
+        self.update_id = 0
+
+    def message(self, user_id, text):
+        self.update_id += 1
+        message = {
+            'message_id': self.update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Иван', 'username': f'user{user_id}'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return {'update_id': self.update_id, 'message': message}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def main(args):
+    # База бота создаётся в текущей папке — работаем во временной
+    os.chdir(tempfile.mkdtemp(prefix='bench_webhook_'))
+    bot = importlib.import_module('bot')
+    from webhook import WebhookServer
+
+    replies = defaultdict(asyncio.Queue)
+    api = await FakeBotAPI(
+        rate_limit=0, latency=args.latency,
+        on_send=lambda chat_id, method: replies[chat_id].put_nowait(time.perf_counter())
+    ).start()
+
+    await bot.db.executemany('INSERT INTO admins (admin_id, is_superadmin) VALUES (?, 0)',
+                             [(manager,) for manager in MANAGERS])
+
+    application = bot.build_application(token='123:fake', base_url=api.base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    server = WebhookServer(application, port=0, secret_token=SECRET)
+    await server.start()
+    url = f'http://127.0.0.1:{server.port}{server.path}'
+
+    factory = UpdateFactory()
+    latencies = defaultdict(list)
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    connector = aiohttp.TCPConnector(limit=args.max_connections)
+
+    async with aiohttp.ClientSession(connector=connector, headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as session:
+        async def user_flow(user_id):
+            nonlocal errors
+            async with semaphore:
+                for step, text in STEPS:
+                    start = time.perf_counter()
+                    async with session.post(url, json=factory.message(user_id, text)) as response:
+                        if response.status != 200:
+                            errors += 1
+                            return
+                    try:
+                        reply_at = await asyncio.wait_for(replies[user_id].get(), args.timeout)
+                    except asyncio.TimeoutError:
+                        errors += 1
+                        return
+                    latencies[step].append((reply_at - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user_flow(user_id) for user_id in range(1, args.users + 1)))
+        elapsed = time.perf_counter() - start
+
+    await server.stop()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"\nПользователей: {args.users}, параллельно {args.concurrency}, "
+          f"соединений к вебхуку {args.max_connections}, задержка API {args.latency * 1000:.0f} мс")
+    print(f"Обновлений: {total} за {elapsed:.1f} с — {total / elapsed:.0f} обновл/с, ошибок: {errors}\n")
+    print(f"{'шаг':<10} {'p50, мс':>9} {'p90, мс':>9} {'p99, мс':>9}")
+    everything = []
+    for step, _ in STEPS:
+        values = latencies[step]
+        everything += values
+        print(f"{step:<10} {percentile(values, 50):9.1f} {percentile(values, 90):9.1f} {percentile(values, 99):9.1f}")
+    print(f"{'всего':<10} {percentile(everything, 50):9.1f} {percentile(everything, 90):9.1f} "
+          f"{percentile(everything, 99):9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=50, help="одновременно проходящих диалог")
+    parser.add_argument('--max-connections', type=int, default=40, help="как max_connections у setWebhook")
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка ответа Bot API, сек")
+    parser.add_argument('--timeout', type=float, default=30)
+    asyncio.run(main(parser.parse_args()))
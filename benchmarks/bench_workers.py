@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI
+from broadcast_queue import BroadcastQueue
+from database import Database
+from migrations import migrate
+from payload import text_payload
+
+# Масштабирование рассылки воркерами: одна и та же рассылка по всей базе отправляется
+# 1, 2, 4 ... процессами broadcast_worker.py через фейковый Bot API. Скорость на воркер
+# не ограничена (--rate), так что упираемся в процессор и задержку API.
+# В конце — проверка аренды: один из воркеров убивается посреди рассылки (SIGKILL),
+# его порцию после истечения аренды доделывают остальные.
+#
+#   python benchmarks/bench_workers.py --users 20000 --workers 1 2 4
+
+ADMIN_ID = 10 ** 9
+WORKER = os.path.join(ROOT, 'broadcast_worker.py')
+
+
+def seed(path, users):
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    with conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name, registration_date, is_active, last_activity) '
+            'VALUES (?, ?, ?, ?, 1, ?)',
+            [(user_id, f'user{user_id}', 'Иван', '2024-01-01 00:00:00', '2024-01-01 00:00:00')
+             for user_id in range(1, users + 1)]
+        )
+    conn.close()
+
+
+async def spawn(count, path, api, args, lease):
+    return [
+        await asyncio.create_subprocess_exec(
+            sys.executable, WORKER, '--db', path, '--token', '123:fake', '--base-url', api.base_url,
+            '--rate', str(args.rate), '--concurrency', str(args.concurrency),
+            '--chunk-size', str(args.chunk_size), '--lease', str(lease),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        for _ in range(count)
+    ]
+
+
+async def stop(workers):
+    for worker in workers:
+        if worker.returncode is None:
+            worker.send_signal(signal.SIGTERM)
+    await asyncio.gather(*(worker.wait() for worker in workers))
+
+
+async def wait_done(db, broadcast_id, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await db.fetchval('SELECT status FROM broadcasts WHERE broadcast_id = ?', (broadcast_id,)) == 'done':
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+async def run(count, db, queue, api, received, args, lease=None, kill_after=None):
+    received.clear()
+    api.sent.clear()
+    broadcast_id = await queue.create(ADMIN_ID, {}, text_payload(f'Рассылка на {count} воркеров'))
+    workers = await spawn(count, db.path, api, args, lease or args.lease)
+    if kill_after:
+        await asyncio.sleep(kill_after)
+        workers[0].kill()
+    done = await wait_done(db, broadcast_id, args.timeout)
+    await stop(workers)
+
+    times = [sent_at for sent_at, chat_id, _ in api.sent if chat_id != ADMIN_ID]
+    elapsed = times[-1] - times[0] if len(times) > 1 else 0.0
+    delivered = sum(1 for chat_id in received if chat_id != ADMIN_ID)
+    duplicates = sum(n - 1 for chat_id, n in received.items() if chat_id != ADMIN_ID and n > 1)
+    return done, delivered, duplicates, elapsed
+
+
+async def main(args):
+    tmp = tempfile.mkdtemp(prefix='bench_workers_')
+    path = os.path.join(tmp, 'bench.db')
+    print(f"Генерация базы на {args.users} пользователей...")
+    seed(path, args.users)
+
+    received = Counter()
+    api = await FakeBotAPI(rate_limit=0, latency=args.latency,
+                           on_send=lambda chat_id, method: received.update((chat_id,))).start()
+    db = Database(path)
+    queue = BroadcastQueue(db)
+
+    print(f"\n{'воркеров':>8} {'доставлено':>11} {'повторов':>9} {'время, с':>9} {'сообщ/с':>9} {'ускорение':>10}")
+    base = None
+    for count in args.workers:
+        done, delivered, duplicates, elapsed = await run(count, db, queue, api, received, args)
+        rate = delivered / elapsed if elapsed else 0.0
+        base = base or rate
+        mark = '' if done else '  (не завершена)'
+        print(f"{count:8} {delivered:11} {duplicates:9} {elapsed:9.1f} {rate:9.0f} {rate / base:9.2f}x{mark}")
+
+    count = max(2, max(args.workers))
+    done, delivered, duplicates, elapsed = await run(
+        count, db, queue, api, received, args, lease=args.crash_lease, kill_after=args.kill_after
+    )
+    print(f"\nВоркеров {count}, один убит через {args.kill_after} с (аренда {args.crash_lease} с): "
+          f"рассылка {'завершена' if done else 'НЕ завершена'}, доставлено {delivered} из {args.users}, "
+          f"повторов {duplicates}, {elapsed:.1f} с")
+
+    db.close()
+    await api.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--rate', type=float, default=100000, help="лимит сообщений в секунду на воркер")
+    parser.add_argument('--concurrency', type=int, default=50, help="одновременных отправок в воркере")
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--lease', type=float, default=30)
+    parser.add_argument('--latency', type=float, default=0.05, help="задержка ответа Bot API, сек")
+    parser.add_argument('--kill-after', type=float, default=2, help="через сколько секунд убить воркер")
+    parser.add_argument('--crash-lease', type=float, default=3, help="срок аренды в проверке падения, сек")
+    parser.add_argument('--timeout', type=float, default=600)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+
+from aiohttp import web
+
+# Локальная имитация Telegram Bot API для бенчмарков.
+# Принимает запросы вида POST /bot<token>/<method>, отвечает как настоящий API
+# и возвращает 429, если отправки превышают заданный лимит в секунду.
+# Для нагрузочных тестов умеет изображать сеть и пользователей:
+#   jitter       — к задержке latency добавляется случайный хвост (в среднем jitter секунд)
+#   flood_chance — доля отправок, получающих случайный 429
+#   blocked      — чаты, заблокировавшие бота (ответ 403)
+
+SEND_METHODS = ('sendMessage', 'sendPhoto', 'sendDocument', 'sendVideo', 'sendAnimation', 'sendMediaGroup')
+
+
+class FakeBotAPI:
+    # on_send(chat_id, method) вызывается для каждого принятого сообщения
+    def __init__(self, rate_limit=30, latency=0.0, on_send=None, jitter=0.0, flood_chance=0.0, blocked=(),
+                 seed=None):
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.on_send = on_send
+        self.jitter = jitter
+        self.flood_chance = flood_chance
+        self.blocked = set(blocked)
+        self._random = random.Random(seed)
+        self.sent = []
+        self.flood_errors = 0
+        self.blocked_errors = 0
+        self._window = deque()
+        self._message_id = 0
+        self._runner = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def _message(self, chat_id, **extra):
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+        }
+        message.update(extra)
+        return message
+
+    def _over_limit(self):
+        now = time.monotonic()
+        while self._window and now - self._window[0] > 1:
+            self._window.popleft()
+        if self.rate_limit and len(self._window) >= self.rate_limit:
+            return True
+        self._window.append(now)
+        return False
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = dict(await request.post())
+        delay = self.latency + (self._random.expovariate(1 / self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method == 'getMe':
+            return self._ok({'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'})
+
+        chat_id = params.get('chat_id', 0)
+        if method in SEND_METHODS:
+            if self._over_limit() or (self.flood_chance and self._random.random() < self.flood_chance):
+                self.flood_errors += 1
+                return self._error(429, 'Too Many Requests: retry after 1', {'retry_after': 1})
+            if int(chat_id) in self.blocked:
+                self.blocked_errors += 1
+                return self._error(403, 'Forbidden: bot was blocked by the user')
+            self.sent.append((time.monotonic(), int(chat_id), method))
+            if self.on_send:
+                self.on_send(int(chat_id), method)
+
+        if method == 'sendMediaGroup':
+            media = json.loads(params.get('media', '[]'))
+            return self._ok([self._message(chat_id, photo=[{'file_id': item['media'], 'file_unique_id': 'u',
+                                                            'width': 1, 'height': 1}])
+                             for item in media])
+        if method in ('sendVideo', 'sendAnimation'):
+            return self._ok(self._message(chat_id, caption=params.get('caption')))
+        if method == 'sendPhoto':
+            photo = {'file_id': params.get('photo', 'photo'), 'file_unique_id': 'u', 'width': 1, 'height': 1}
+            return self._ok(self._message(chat_id, photo=[photo], caption=params.get('caption')))
+        if method == 'sendDocument':
+            document = {'file_id': 'document', 'file_unique_id': 'u'}
+            return self._ok(self._message(chat_id, document=document, caption=params.get('caption')))
+        if method in ('sendMessage', 'editMessageText'):
+            return self._ok(self._message(chat_id, text=params.get('text')))
+        return self._ok(True)
+
+    def _ok(self, result):
+        return web.json_response({'ok': True, 'result': result})
+
+    def _error(self, code, description, parameters=None):
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.Response(status=code, text=json.dumps(body), content_type='application/json')
+
+    def sustained_rate(self, skip=1.0):
+        # Скорость по принятым сообщениям без учёта первых skip секунд (разгон)
+        if len(self.sent) < 2:
+            return 0.0
+        start = self.sent[0][0] + skip
+        tail = [t for t, _, _ in self.sent if t >= start]
+        if len(tail) < 2:
+            return 0.0
+        return (len(tail) - 1) / (tail[-1] - tail[0])
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -1,5 +1,7 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ChatMember
+from telegram.constants import ChatType
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
@@ -7,14 +9,40 @@ from telegram.ext import (
     MessageHandler,
     filters,
     ConversationHandler,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    TypeHandler
 )
-from datetime import datetime, timedelta
-import sqlite3
-import openpyxl
-from openpyxl import Workbook
+from datetime import datetime
+import asyncio
+import os
+import time
 import pytz
 
+from broadcast import RateLimiter, run_broadcast, format_progress, format_duration, classify_error, UNREACHABLE
+from database import Database, now_str
+from roles import RoleCache
+from activity import ActivityTracker
+from export import (
+    export_users_in_process, EXPORT_FORMATS, DELTA_QUERY, load_export_mark, save_export_mark,
+    set_daily_export, daily_export_admins, parse_date_range, format_date_range
+)
+from notifications import ManagerNotifier
+from webhook import run_webhook
+from stats import load_dashboard, format_dashboard
+from migrations import migrate
+from persistence import SQLitePersistence
+from updates import OrderedUpdateApplication, BoundedTaskGroup
+from metrics import Metrics, MetricsServer
+from payload import (
+    PayloadError, CompiledPayload, compile_message, compile_album, album_part, load as load_payload,
+    BROADCAST_MARKUP
+)
+from segments import cycle_segment, set_segment_company, describe_segment, segment_buttons
+from search import search_leads, format_leads, PAGE_SIZE as SEARCH_PAGE_SIZE
+from leads import page_leads, format_lead_history
+from retention import Retention, format_report as format_retention_report, USERS_DAYS, DELIVERIES_DAYS
+from broadcast_queue import BroadcastQueue, SENT, FAILED, BLOCKED, JOB_RUNNING, JOB_DONE
+
 # Настройка логов
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -24,82 +52,104 @@ logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler
 NAME, PHONE, COMPANY, REQUEST = range(4)
-ADMIN_MENU, SEND_MESSAGE, SELECT_RECIPIENTS, SCHEDULE, CONFIRM_SEND = range(4, 9)
-
-# Настройка базы данных
-def init_db():
-    conn = sqlite3.connect('consultations.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        first_name TEXT,
-        last_name TEXT,
-        phone TEXT,
-        company TEXT,
-        request TEXT,
-        registration_date TEXT,
-        is_active INTEGER DEFAULT 1,
-        last_activity TEXT
-    )
-    ''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS admins (
-        admin_id INTEGER PRIMARY KEY,
-        username TEXT,
-        full_name TEXT,
-        is_superadmin INTEGER DEFAULT 0
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+ADMIN_MENU, SEND_MESSAGE, SELECT_RECIPIENTS, SCHEDULE, CONFIRM_SEND, SEARCH, EXPORT_RANGE = range(4, 11)
+
+DB_PATH = 'consultations.db'
+
+# Настройки запуска
+BOT_TOKEN = os.environ.get('BOT_TOKEN', "7729706158:AAFgUHY62JHT65caVu1vZWlTjG69t69C8Wo")
+# polling или webhook
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+# Публичный адрес, на который Telegram будет слать обновления (https://example.com)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8080))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+# Секретный токен вебхука (A-Z, a-z, 0-9, _ и -). Если не задан, генерируется при каждом запуске
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+# Сколько одновременных соединений Telegram открывает к вебхуку (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40))
+# Сколько обновлений разных пользователей обрабатывается параллельно
+UPDATE_CONCURRENCY = int(os.environ.get('UPDATE_CONCURRENCY', 64))
+# Сколько рассылок и выгрузок выполняется одновременно
+BROADCAST_TASKS_LIMIT = int(os.environ.get('BROADCAST_TASKS_LIMIT', 4))
+EXPORT_TASKS_LIMIT = int(os.environ.get('EXPORT_TASKS_LIMIT', 1))
+# Во сколько (МСК) присылать ежедневную выгрузку изменений подписавшимся админам
+EXPORT_DAILY_AT = os.environ.get('EXPORT_DAILY_AT', '09:00')
+# Ежедневный перенос старых данных в архивную базу и incremental_vacuum (retention.py), 1 — включить
+RETENTION_ENABLED = os.environ.get('RETENTION_ENABLED', '1') == '1'
+RETENTION_AT = os.environ.get('RETENTION_AT', '04:00')
+ARCHIVE_PATH = os.environ.get('ARCHIVE_PATH', 'consultations_archive.db')
+RETENTION_USERS_DAYS = int(os.environ.get('RETENTION_USERS_DAYS', USERS_DAYS))
+RETENTION_DELIVERIES_DAYS = int(os.environ.get('RETENTION_DELIVERIES_DAYS', DELIVERIES_DAYS))
+# inline — рассылки отправляет сам бот, workers — бот только ставит их в очередь,
+# отправляют отдельные процессы broadcast_worker.py
+BROADCAST_MODE = os.environ.get('BROADCAST_MODE', 'inline')
+# Метрики в формате Prometheus на локальном адресе (1 — включить)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+METRICS_LISTEN = os.environ.get('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9101))
+
+# Время в интерфейсе — московское
+MSK = pytz.timezone('Europe/Moscow')
+
+# Сколько ждать остальные части альбома после первой, секунд
+ALBUM_WAIT = 1.5
+
+# Общий ограничитель скорости отправки сообщений
+rate_limiter = RateLimiter()
+
+# Одно соединение с базой на весь процесс
+db = Database(DB_PATH)
+
+# Настройка базы данных: доводим схему до последней версии
+db.call(migrate)
+
+broadcast_queue = BroadcastQueue(db)
+roles = RoleCache(db)
+activity = ActivityTracker(db)
+notifier = ManagerNotifier(db, rate_limiter)
+retention = Retention(db, ARCHIVE_PATH, RETENTION_USERS_DAYS, RETENTION_DELIVERIES_DAYS)
 
-init_db()
+# Рассылки и выгрузки выполняются в фоне, отдельно от обработки обновлений.
+# Выгрузка нагружает процессор, поэтому по умолчанию идёт только одна за раз
+broadcast_tasks = BoundedTaskGroup('Рассылки', BROADCAST_TASKS_LIMIT, resumable=True)
+export_tasks = BoundedTaskGroup('Выгрузки', EXPORT_TASKS_LIMIT)
+
+# Метрики: время обработчиков, запросов к базе и к Bot API.
+# Выключенные ничего не оборачивают и не замедляют бота
+metrics = Metrics(METRICS_ENABLED)
+metrics.instrument_db(db)
+metrics.gauge('bot_activity', 'Буфер активности пользователей', activity.metrics, 'stat')
+metrics.gauge('bot_background_tasks_running', 'Выполняется фоновых задач',
+              lambda: {group.name: group.running for group in (broadcast_tasks, export_tasks)}, 'group')
+metrics.gauge('bot_background_tasks_waiting', 'Ждут запуска фоновых задач',
+              lambda: {group.name: group.waiting for group in (broadcast_tasks, export_tasks)}, 'group')
+metrics_server = MetricsServer(metrics, METRICS_LISTEN, METRICS_PORT)
 
 # Проверка админа
 def is_admin(user_id):
-    conn = sqlite3.connect('consultations.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM admins WHERE admin_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    return roles.is_admin(user_id)
 
 def is_superadmin(user_id):
-    conn = sqlite3.connect('consultations.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT is_superadmin FROM admins WHERE admin_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result and result[0] == 1
-
-# Добавление пользователя в базу
+    return roles.is_superadmin(user_id)
+
+# Добавление пользователя в базу: запись уходит в буфер и сохраняется пачкой
 def add_user(user_data):
-    conn = sqlite3.connect('consultations.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT OR REPLACE INTO users 
-    (user_id, username, first_name, last_name, phone, company, request, registration_date, is_active, last_activity)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
-    ''', (
-        user_data['user_id'],
-        user_data.get('username'),
-        user_data.get('first_name'),
-        user_data.get('last_name'),
-        user_data.get('phone'),
-        user_data.get('company'),
-        user_data.get('request'),
-        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    ))
-    
-    conn.commit()
-    conn.close()
+    activity.upsert(user_data)
+
+# Активность пользователя: сообщение или нажатие кнопки обновляют last_activity и снова
+# делают его доступным для рассылок. Блокировка бота (my_chat_member со статусом kicked)
+# отмечает пользователя неактивным; остальные служебные обновления не считаются активностью
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.effective_user:
+        return
+    member = update.my_chat_member
+    if member:
+        if member.chat.type == ChatType.PRIVATE and member.new_chat_member.status == ChatMember.BANNED:
+            activity.block(update.effective_user.id)
+    elif update.message or update.callback_query:
+        activity.touch(update.effective_user.id)
 
 # Стартовое сообщение
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -167,6 +217,8 @@ async def get_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'request': context.user_data['request']
     }
     add_user(user_data)
+    # Заявка попадает в историю, прежние заявки клиента сохраняются
+    activity.add_lead(user_data)
     
     # Отправляем менеджерам
     await notify_managers(context, user_data)
@@ -182,13 +234,10 @@ async def get_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return ConversationHandler.END
 
-# Уведомление менеджеров
+# Уведомление менеджеров: заявка сохраняется в очередь, отправка идёт в фоне,
+# поэтому ответ клиенту не ждёт менеджеров
 async def notify_managers(context, user_data):
-    conn = sqlite3.connect('consultations.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT admin_id FROM admins WHERE is_superadmin = 0')
-    managers = cursor.fetchall()
-    conn.close()
+    managers = roles.managers()
     
     message_text = (
         "📌 Новая заявка на консультацию:\n\n"
@@ -199,17 +248,15 @@ async def notify_managers(context, user_data):
         f"🆔 ID пользователя: {user_data['user_id']}"
     )
     
-    for manager in managers:
-        try:
-            await context.bot.send_message(
-                chat_id=manager[0],
-                text=message_text,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Написать клиенту", url=f"tg://user?id={user_data['user_id']}")]
-                ])
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления менеджеру {manager[0]}: {e}")
+    notification_ids = await notifier.enqueue(
+        managers,
+        message_text,
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("Написать клиенту", url=f"tg://user?id={user_data['user_id']}")]
+        ])
+    )
+    # Остановка бота не ждёт повторов: неотправленные подхватит notifier.resume после перезапуска
+    context.application.create_cancellable_task(notifier.dispatch(context.bot, notification_ids))
 
 # Админ-панель
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -221,10 +268,14 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("📊 Статистика", callback_data="stats")],
         [InlineKeyboardButton("📤 Выгрузить базу", callback_data="export")],
         [InlineKeyboardButton("📩 Сделать рассылку", callback_data="broadcast")],
+        [InlineKeyboardButton("🔎 Найти заявку", callback_data="find")],
+        [InlineKeyboardButton("🗂 История заявок", callback_data="leads")],
     ]
     
     if is_superadmin(update.effective_user.id):
         keyboard.append([InlineKeyboardButton("👨‍💼 Добавить админа", callback_data="add_admin")])
+    if metrics.enabled:
+        keyboard.append([InlineKeyboardButton("📈 Метрики", callback_data="metrics")])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Админ-панель:", reply_markup=reply_markup)
@@ -238,45 +289,40 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if query.data == "stats":
         await show_stats(update, context)
     elif query.data == "export":
-        await export_to_excel(update, context)
+        await show_export_menu(update, context)
+    elif query.data in ("export_all", "export_delta", "export_daily"):
+        context.user_data['export_scope'] = query.data[len("export_"):]
+        await choose_export_format(update, context)
+    elif query.data == "export_range":
+        return await ask_export_range(update, context)
+    elif query.data == "export_daily_off":
+        await disable_daily_export(update, context)
+    elif query.data.startswith("export_"):
+        await start_export(update, context, query.data[len("export_"):])
     elif query.data == "broadcast":
-        await start_broadcast(update, context)
+        return await start_broadcast(update, context)
     elif query.data == "add_admin":
         await add_admin(update, context)
+    elif query.data == "metrics":
+        await show_metrics(update, context)
+    elif query.data == "find":
+        return await ask_search_query(update, context)
+    elif query.data.startswith("find_page_"):
+        await show_search_results(update, context, int(query.data[len("find_page_"):]), edit=True)
+    elif query.data == "leads":
+        await show_leads(update, context)
+    elif query.data.startswith("leads_older_"):
+        await show_leads(update, context, older_than=int(query.data[len("leads_older_"):]))
+    elif query.data.startswith("leads_newer_"):
+        await show_leads(update, context, newer_than=int(query.data[len("leads_newer_"):]))
     
     return ADMIN_MENU
 
 # Показать статистику
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = sqlite3.connect('consultations.db')
-    cursor = conn.cursor()
-    
-    # Общее количество
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    # За сегодня
-    today = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute('SELECT COUNT(*) FROM users WHERE date(registration_date) = ?', (today,))
-    today_users = cursor.fetchone()[0]
-    
-    # Активные
-    cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 1')
-    active_users = cursor.fetchone()[0]
-    
-    # Неактивные
-    cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 0')
-    inactive_users = cursor.fetchone()[0]
-    
-    conn.close()
-    
-    stats_text = (
-        "📊 Статистика пользователей:\n\n"
-        f"👥 Всего пользователей: {total_users}\n"
-        f"🆕 Сегодня: {today_users}\n"
-        f"✅ Активные: {active_users}\n"
-        f"❌ Неактивные: {inactive_users}"
-    )
+    # Недавние регистрации из буфера должны попасть в счётчики
+    await activity.flush()
+    stats_text = format_dashboard(await db.run(load_dashboard))
     
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -286,56 +332,328 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ])
     )
 
-# Выгрузка в Excel
-async def export_to_excel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = sqlite3.connect('consultations.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users')
-    users = cursor.fetchall()
-    conn.close()
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Пользователи"
-    
-    # Заголовки
-    headers = [
-        "ID", "Username", "Имя", "Фамилия", "Телефон", 
-        "Компания", "Запрос", "Дата регистрации", "Активен", "Последняя активность"
-    ]
-    ws.append(headers)
-    
-    # Данные
-    for user in users:
-        ws.append(user)
+# Сводка метрик для админа; полные данные — на /metrics
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=metrics.summary(activity),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+        ])
+    )
+
+# Поиск заявки по имени, компании, запросу или телефону: /find <запрос> или кнопка в админ-панели
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return ConversationHandler.END
     
-    # Сохраняем файл
-    filename = f"users_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    wb.save(filename)
+    if not context.args:
+        return await ask_search_query(update, context)
     
-    # Отправляем файл
-    await context.bot.send_document(
+    context.user_data['search_query'] = ' '.join(context.args)
+    await show_search_results(update, context)
+    return ADMIN_MENU
+
+async def ask_search_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        document=open(filename, 'rb'),
-        caption="Экспорт базы пользователей",
+        text="Введите имя, компанию, слова из запроса или номер телефона:",
         reply_markup=InlineKeyboardMarkup([
             [InlineKeyboardButton("🔙 Назад", callback_data="back")]
         ])
     )
+    return SEARCH
 
-# Начало рассылки
-async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def find_leads(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['search_query'] = update.message.text
+    await show_search_results(update, context)
+    return ADMIN_MENU
+
+# Страница результатов: поиск по индексу FTS5, листание кнопками
+async def show_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE, offset=0, edit=False):
+    text = context.user_data.get('search_query', '')
+    # Свежие заявки из буфера должны находиться сразу
+    await activity.flush()
+    start = time.perf_counter()
+    rows, has_more, capped = await db.run(search_leads, text, offset)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    pages = []
+    if offset > 0:
+        pages.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"find_page_{max(0, offset - SEARCH_PAGE_SIZE)}"))
+    if has_more:
+        pages.append(InlineKeyboardButton("Дальше ➡️", callback_data=f"find_page_{offset + SEARCH_PAGE_SIZE}"))
+    keyboard = [pages] if pages else []
+    keyboard.append([InlineKeyboardButton("🔎 Новый поиск", callback_data="find")])
+    keyboard.append([InlineKeyboardButton("🔙 В админ-панель", callback_data="back")])
+    
+    message = format_leads(text, rows, offset, elapsed_ms, capped)
+    if edit:
+        await update.callback_query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=message,
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+# История заявок: страницы листаются по lead_id, первая открывается новым сообщением
+async def show_leads(update: Update, context: ContextTypes.DEFAULT_TYPE, older_than=None, newer_than=None):
+    # Только что завершённые заявки ещё в буфере
+    await activity.flush()
+    rows, has_newer, has_older = await db.run(page_leads, older_than, newer_than)
+    
+    pages = []
+    if rows and has_newer:
+        pages.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"leads_newer_{rows[0]['lead_id']}"))
+    if rows and has_older:
+        pages.append(InlineKeyboardButton("Старее ➡️", callback_data=f"leads_older_{rows[-1]['lead_id']}"))
+    keyboard = [pages] if pages else []
+    keyboard.append([InlineKeyboardButton("🔙 В админ-панель", callback_data="back")])
+    
+    text = format_lead_history(rows)
+    if older_than is None and newer_than is None:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    else:
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+# Что выгрузить: всю базу, изменения с прошлой выгрузки этого админа или период
+async def show_export_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    mark = await db.run(load_export_mark, update.effective_user.id)
+    since = mark['exported_until'] if mark else None
+    daily = mark['daily_format'] if mark else None
+    
     keyboard = [
-        [InlineKeyboardButton("Всем пользователям", callback_data="broadcast_all")],
-        [InlineKeyboardButton("Новым (за неделю)", callback_data="broadcast_new")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+        [InlineKeyboardButton("📦 Вся база", callback_data="export_all")],
+        [InlineKeyboardButton("🆕 Новые и изменённые", callback_data="export_delta")],
+        [InlineKeyboardButton("📅 За период", callback_data="export_range")],
     ]
+    if daily:
+        keyboard.append([InlineKeyboardButton("⏰ Отключить ежедневную выгрузку", callback_data="export_daily_off")])
+    else:
+        keyboard.append([InlineKeyboardButton("⏰ Присылать новые ежедневно", callback_data="export_daily")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
     
+    text = "Что выгрузить?\n\n"
+    text += f"Прошлая выгрузка новых: {since}" if since else "Выгрузок новых ещё не было — первая будет полной."
+    if daily:
+        text += f"\nЕжедневная выгрузка ({daily}) приходит в {EXPORT_DAILY_AT} МСК."
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="Выберите получателей рассылки:",
+        text=text,
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
+
+async def ask_export_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="Введите период в формате ДД.ММ.ГГГГ - ДД.ММ.ГГГГ или одну дату ДД.ММ.ГГГГ.\n"
+             "В выгрузку попадут пользователи, активные в эти дни.",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+        ])
+    )
+    return EXPORT_RANGE
+
+async def get_export_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        context.user_data['export_range'] = parse_date_range(update.message.text)
+    except ValueError:
+        await update.message.reply_text("Неверный формат периода. Попробуйте снова.")
+        return EXPORT_RANGE
+    context.user_data['export_scope'] = 'range'
+    await choose_export_format(update, context)
+    return ADMIN_MENU
+
+async def disable_daily_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await db.run(set_daily_export, update.effective_user.id, None)
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="Ежедневная выгрузка отключена.",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+        ])
+    )
+
+# Выбор формата выгрузки
+async def choose_export_format(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.user_data.get('export_scope') == 'daily':
+        text = "В каком формате присылать ежедневную выгрузку?"
+    else:
+        text = "В каком формате выгрузить базу?"
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=text,
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("Excel (.xlsx)", callback_data="export_xlsx")],
+            [InlineKeyboardButton("CSV", callback_data="export_csv"),
+             InlineKeyboardButton("CSV.gz", callback_data="export_csv.gz")],
+            [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+        ])
+    )
+
+# Формат выбран: запускаем выгрузку в фоне или включаем ежедневную
+async def start_export(update: Update, context: ContextTypes.DEFAULT_TYPE, fmt):
+    scope = context.user_data.get('export_scope', 'all')
+    if scope == 'daily':
+        await db.run(set_daily_export, update.effective_user.id, fmt)
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"Ежедневная выгрузка включена: новые и изменённые записи будут приходить в {EXPORT_DAILY_AT} МСК.",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+            ])
+        )
+    elif scope == 'delta':
+        export_tasks.start(
+            context.application,
+            export_delta(context.bot, update.effective_user.id, update.effective_chat.id, fmt),
+            update=update
+        )
+    else:
+        export_tasks.start(
+            context.application,
+            export_to_excel(update, context, fmt, context.user_data.get('export_range') if scope == 'range' else None),
+            update=update
+        )
+
+# Выгрузка базы или периода: файл собирается потоково в отдельном процессе и удаляется после отправки
+async def export_to_excel(update: Update, context: ContextTypes.DEFAULT_TYPE, fmt='xlsx', date_range=None):
+    # Свежие данные из буфера должны попасть в выгрузку
+    await activity.flush()
+    if date_range:
+        path, count = await export_users_in_process(db.path, fmt, DELTA_QUERY, date_range)
+        caption = f"Пользователи, активные {format_date_range(*date_range)}: {count} записей"
+    else:
+        path, count = await export_users_in_process(db.path, fmt)
+        caption = f"Экспорт базы пользователей: {count} записей"
+    await send_export(context.bot, update.effective_chat.id, path, fmt, caption)
+
+# Выгрузка новых и изменённых с прошлой выгрузки этого админа.
+# Отметка сдвигается только после отправки: если файл не дошёл, записи придут в следующий раз
+async def export_delta(bot, admin_id, chat_id, fmt, daily=False):
+    # Граница берётся до сброса буфера: всё, что случилось раньше, уже будет в базе,
+    # а изменения в ту же секунду попадут в следующую выгрузку
+    until = now_str()
+    await activity.flush()
+    mark = await db.run(load_export_mark, admin_id)
+    since = mark['exported_until'] if mark else None
+    if since:
+        path, count = await export_users_in_process(db.path, fmt, DELTA_QUERY, (since, until))
+        caption = f"Новые и изменённые с {since}: {count} записей"
+    else:
+        path, count = await export_users_in_process(db.path, fmt)
+        caption = f"Первая выгрузка новых — вся база: {count} записей"
+    if daily:
+        caption = f"Ежедневная выгрузка. {caption}"
+    
+    if count:
+        await send_export(bot, chat_id, path, fmt, caption)
+    else:
+        os.remove(path)
+        # Пустую ежедневную выгрузку не присылаем
+        if not daily:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"С {since} новых и изменённых записей нет." if since else "В базе пока нет записей.",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+                ])
+            )
+    await db.run(save_export_mark, admin_id, until)
+
+async def send_export(bot, chat_id, path, fmt, caption):
+    try:
+        filename = f"users_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}{EXPORT_FORMATS[fmt]}"
+        with open(path, 'rb') as document:
+            await bot.send_document(
+                chat_id=chat_id,
+                document=document,
+                filename=filename,
+                caption=caption,
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+                ])
+            )
+    finally:
+        os.remove(path)
+
+# Ежедневная выгрузка изменений: каждому подписавшемуся админу — от его собственной отметки
+async def send_daily_exports(context: ContextTypes.DEFAULT_TYPE):
+    for row in await db.run(daily_export_admins):
+        if is_admin(row['admin_id']):
+            export_tasks.start(
+                context.application,
+                export_delta(context.bot, row['admin_id'], row['admin_id'], row['daily_format'], daily=True)
+            )
+
+# Время «ЧЧ:ММ» по Москве для job_queue.run_daily.
+# localize, а не tzinfo=MSK: у pytz без localize смещение было бы историческим (LMT)
+def msk_time(text):
+    hour, minute = map(int, text.split(':'))
+    return MSK.localize(datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)).timetz()
+
+# Обслуживание базы: архивация, incremental_vacuum и отчёт суперадминам
+async def run_retention(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        report = await retention.run()
+    except Exception as e:
+        logger.error(f"Ошибка обслуживания базы: {e}")
+        return
+    for admin_id in roles.superadmins():
+        try:
+            await context.bot.send_message(chat_id=admin_id, text=format_retention_report(report))
+        except Exception as e:
+            logger.error(f"Не удалось отправить отчёт об обслуживании базы {admin_id}: {e}")
+
+def schedule_daily_jobs(job_queue):
+    job_queue.run_daily(send_daily_exports, time=msk_time(EXPORT_DAILY_AT), name='daily_exports')
+    if RETENTION_ENABLED:
+        job_queue.run_daily(run_retention, time=msk_time(RETENTION_AT), name='retention')
+
+# Начало рассылки: конструктор сегмента получателей
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['broadcast_segment'] = {}
+    await show_segment_builder(update, context)
+    return SELECT_RECIPIENTS
+
+# Конструктор сегмента: условия переключаются кнопками, число получателей
+# пересчитывается одним COUNT по индексам после каждого изменения
+async def show_segment_builder(update: Update, context: ContextTypes.DEFAULT_TYPE, edit=False):
+    segment = context.user_data.get('broadcast_segment', {})
+    count = await broadcast_queue.count_recipients(segment)
+    labels = segment_buttons(segment)
+    
+    keyboard = [[InlineKeyboardButton(label, callback_data=f"segment_{group}")] for group, label in labels.items()]
+    keyboard.append([InlineKeyboardButton(f"✅ Далее — получателей: {count}", callback_data="segment_done")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
+    
+    text = (
+        "Выберите получателей рассылки:\n\n"
+        f"🔹 {describe_segment(segment)}\n"
+        f"👥 Получателей: {count}\n\n"
+        "Чтобы отобрать по компании, отправьте её название сообщением («-» — сбросить)."
+    )
+    if edit:
+        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+# Фильтр по компании в конструкторе сегмента
+async def set_broadcast_company(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['broadcast_segment'] = set_segment_company(
+        context.user_data.get('broadcast_segment', {}), update.message.text
+    )
+    await show_segment_builder(update, context)
     return SELECT_RECIPIENTS
 
 # Обработка выбора получателей
@@ -343,30 +661,77 @@ async def select_recipients(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    if query.data == "broadcast_all":
-        context.user_data['broadcast_type'] = 'all'
-    elif query.data == "broadcast_new":
-        context.user_data['broadcast_type'] = 'new'
-    elif query.data == "back":
+    if query.data == "back":
         await admin_panel(update, context)
         return ADMIN_MENU
+    elif query.data.startswith("segment_") and query.data != "segment_done":
+        context.user_data['broadcast_segment'] = cycle_segment(
+            context.user_data.get('broadcast_segment', {}), query.data[len("segment_"):]
+        )
+        await show_segment_builder(update, context, edit=True)
+        return SELECT_RECIPIENTS
+    
+    if not await broadcast_queue.count_recipients(context.user_data.get('broadcast_segment', {})):
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="В сегменте нет получателей, измените условия."
+        )
+        return SELECT_RECIPIENTS
     
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="Введите сообщение для рассылки (можно с фото):",
+        text=(
+            "Введите сообщение для рассылки. Можно прикрепить фото, видео, документ "
+            "или отправить альбом — форматирование текста сохранится:"
+        ),
         reply_markup=InlineKeyboardMarkup([
             [InlineKeyboardButton("🔙 Назад", callback_data="back")]
         ])
     )
     return SEND_MESSAGE
 
-# Обработка сообщения для рассылки
+# Обработка сообщения для рассылки: собираем его один раз и дальше отправляем готовым
 async def get_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.photo:
-        context.user_data['broadcast_photo'] = update.message.photo[-1].file_id
-        context.user_data['broadcast_text'] = update.message.caption or ""
-    else:
-        context.user_data['broadcast_text'] = update.message.text
+    message = update.message
+    
+    if message.media_group_id:
+        # Альбом приходит несколькими сообщениями: копим части и собираем, когда придут все
+        album = context.user_data.get('broadcast_album')
+        if album is None or album['id'] != message.media_group_id:
+            album = context.user_data['broadcast_album'] = {'id': message.media_group_id, 'parts': []}
+            context.job_queue.run_once(
+                finish_broadcast_album, ALBUM_WAIT,
+                data=message.media_group_id, chat_id=update.effective_chat.id, user_id=update.effective_user.id
+            )
+        album['parts'].append(album_part(message))
+        return SEND_MESSAGE
+    
+    context.user_data.pop('broadcast_album', None)
+    try:
+        payload = compile_message(message)
+    except PayloadError as e:
+        await message.reply_text(f"{e}. Отправьте другое сообщение.")
+        return SEND_MESSAGE
+    
+    await ask_broadcast_time(context, update.effective_chat.id, payload)
+    return SCHEDULE
+
+# Все части альбома получены
+async def finish_broadcast_album(context: ContextTypes.DEFAULT_TYPE):
+    album = context.user_data.get('broadcast_album')
+    if album is None or album['id'] != context.job.data:
+        return
+    del context.user_data['broadcast_album']
+    try:
+        payload = compile_album(album['parts'])
+    except PayloadError as e:
+        await context.bot.send_message(chat_id=context.job.chat_id, text=f"{e}. Отправьте другое сообщение.")
+        return
+    await ask_broadcast_time(context, context.job.chat_id, payload)
+
+# Сохраняем собранное сообщение и спрашиваем время отправки
+async def ask_broadcast_time(context, chat_id, payload):
+    context.user_data['broadcast_payload'] = payload
     
     keyboard = [
         [InlineKeyboardButton("Моментально", callback_data="schedule_now")],
@@ -374,11 +739,11 @@ async def get_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TY
         [InlineKeyboardButton("🔙 Назад", callback_data="back")]
     ]
     
-    await update.message.reply_text(
-        "Когда сделать рассылку?",
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text="Когда сделать рассылку?",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
-    return SCHEDULE
 
 # Обработка времени рассылки
 async def schedule_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -387,9 +752,9 @@ async def schedule_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     if query.data == "schedule_now":
         context.user_data['schedule_time'] = 'now'
-        await confirm_broadcast(update, context)
-        return CONFIRM_SEND
+        return await confirm_broadcast(update, context)
     elif query.data == "schedule_later":
+        context.user_data['schedule_time'] = 'later'
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Введите дату и время рассылки в формате ДД.ММ.ГГГГ ЧЧ:ММ (МСК):"
@@ -404,41 +769,42 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get('schedule_time') == 'later':
         try:
             date_str = update.message.text
-            date_obj = datetime.strptime(date_str, '%d.%m.%Y %H:%M')
-            context.user_data['schedule_time'] = date_obj
+            date_obj = MSK.localize(datetime.strptime(date_str, '%d.%m.%Y %H:%M'))
         except ValueError:
             await update.message.reply_text("Неверный формат даты. Попробуйте снова.")
             return SCHEDULE
+        if date_obj <= datetime.now(MSK):
+            await update.message.reply_text("Это время уже прошло. Введите дату в будущем.")
+            return SCHEDULE
+        context.user_data['schedule_time'] = date_obj
     
-    broadcast_type = "всем пользователям" if context.user_data['broadcast_type'] == 'all' else "новым пользователям (за неделю)"
+    segment = context.user_data['broadcast_segment']
+    broadcast_type = f"{describe_segment(segment)} ({await broadcast_queue.count_recipients(segment)})"
     schedule_time = "моментально" if context.user_data['schedule_time'] == 'now' else f"запланировано на {context.user_data['schedule_time'].strftime('%d.%m.%Y %H:%M')}"
     
-    confirm_text = (
-        "Подтвердите рассылку:\n\n"
-        f"🔹 Получатели: {broadcast_type}\n"
-        f"⏰ Время: {schedule_time}\n\n"
-        "Сообщение:"
-    )
-    
-    if 'broadcast_photo' in context.user_data:
-        await context.bot.send_photo(
-            chat_id=update.effective_chat.id,
-            photo=context.user_data['broadcast_photo'],
-            caption=f"{confirm_text}\n{context.user_data['broadcast_text']}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_send")],
-                [InlineKeyboardButton("❌ Отменить", callback_data="cancel_send")]
-            ])
-        )
-    else:
+    # Предпросмотр — ровно то сообщение, которое получат пользователи
+    try:
+        preview = CompiledPayload(context.user_data['broadcast_payload'], context.bot, BROADCAST_MARKUP)
+        await preview.send(update.effective_chat.id)
+    except BadRequest as e:
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text=f"{confirm_text}\n{context.user_data['broadcast_text']}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_send")],
-                [InlineKeyboardButton("❌ Отменить", callback_data="cancel_send")]
-            ])
+            text=f"Telegram не принял сообщение: {e.message}. Отправьте другое сообщение."
         )
+        return SEND_MESSAGE
+    
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=(
+            "Подтвердите рассылку сообщения выше:\n\n"
+            f"🔹 Получатели: {broadcast_type}\n"
+            f"⏰ Время: {schedule_time}"
+        ),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_send")],
+            [InlineKeyboardButton("❌ Отменить", callback_data="cancel_send")]
+        ])
+    )
     return CONFIRM_SEND
 
 # Запуск рассылки
@@ -446,59 +812,47 @@ async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    if query.data == "confirm_send":
-        conn = sqlite3.connect('consultations.db')
-        cursor = conn.cursor()
-        
-        if context.user_data['broadcast_type'] == 'all':
-            cursor.execute('SELECT user_id FROM users WHERE is_active = 1')
-        else:
-            week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute('SELECT user_id FROM users WHERE is_active = 1 AND registration_date >= ?', (week_ago,))
-        
-        users = cursor.fetchall()
-        conn.close()
-        
-        success = 0
-        failed = 0
-        
-        for user in users:
-            try:
-                if 'broadcast_photo' in context.user_data:
-                    await context.bot.send_photo(
-                        chat_id=user[0],
-                        photo=context.user_data['broadcast_photo'],
-                        caption=context.user_data['broadcast_text'],
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("Написать Александру", url="https://t.me/username")]
-                        ])
-                    )
-                else:
-                    await context.bot.send_message(
-                        chat_id=user[0],
-                        text=context.user_data['broadcast_text'],
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("Написать Александру", url="https://t.me/username")]
-                        ])
-                    )
-                success += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки сообщения пользователю {user[0]}: {e}")
-                failed += 1
-                # Помечаем пользователя как неактивного
-                conn = sqlite3.connect('consultations.db')
-                cursor = conn.cursor()
-                cursor.execute('UPDATE users SET is_active = 0 WHERE user_id = ?', (user[0],))
-                conn.commit()
-                conn.close()
+    if query.data == "confirm_send" and context.user_data['schedule_time'] != 'now':
+        # Отложенная рассылка: сохраняем задание и ставим таймер
+        scheduled_at = context.user_data['schedule_time']
+        broadcast_id = await broadcast_queue.create(
+            update.effective_chat.id,
+            context.user_data['broadcast_segment'],
+            context.user_data['broadcast_payload'],
+            scheduled_at=scheduled_at.astimezone(pytz.utc)
+        )
+        schedule_broadcast_job(context.job_queue, broadcast_id, scheduled_at)
         
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text=f"Рассылка завершена:\n\n✅ Успешно: {success}\n❌ Не доставлено: {failed}",
+            text=f"Рассылка #{broadcast_id} запланирована на {scheduled_at.strftime('%d.%m.%Y %H:%M')} (МСК)",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("🔙 В админ-панель", callback_data="back")]
             ])
         )
+    elif query.data == "confirm_send":
+        # Задание и список получателей сохраняются в базе, чтобы пережить перезапуск
+        broadcast_id = await broadcast_queue.create(
+            update.effective_chat.id,
+            context.user_data['broadcast_segment'],
+            context.user_data['broadcast_payload']
+        )
+        
+        if BROADCAST_MODE == 'workers':
+            job = await broadcast_queue.get(broadcast_id)
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=(
+                    f"Рассылка #{broadcast_id} поставлена в очередь: {job['total']} получателей.\n"
+                    "Её отправят воркеры рассылок, отчёт придёт по завершении."
+                ),
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🔙 В админ-панель", callback_data="back")]
+                ])
+            )
+        else:
+            # Рассылка идёт в фоне, чтобы не блокировать обработку остальных обновлений
+            broadcast_tasks.start(context.application, run_broadcast_job(context.bot, broadcast_id))
     else:
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -510,6 +864,110 @@ async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return ADMIN_MENU
 
+# Отправка рассылки с ограничением скорости и отчётом о прогрессе
+async def run_broadcast_job(bot, broadcast_id, resumed=False):
+    job = await broadcast_queue.get(broadcast_id)
+    remaining = await broadcast_queue.count_pending(broadcast_id)
+    await broadcast_queue.set_status(broadcast_id, JOB_RUNNING)
+    
+    status_message = await bot.send_message(
+        chat_id=job['admin_chat_id'],
+        text=(
+            f"Рассылка #{broadcast_id} возобновлена: осталось {remaining} из {job['total']} получателей"
+            if resumed else
+            f"Рассылка #{broadcast_id} запущена: {remaining} получателей"
+        )
+    )
+    
+    # Сообщение собирается один раз, для каждого получателя подставляется только chat_id
+    message = CompiledPayload(load_payload(job), bot, BROADCAST_MARKUP)
+    
+    async def on_progress(stats):
+        await status_message.edit_text(f"Рассылка #{broadcast_id} идёт...\n\n{format_progress(stats)}")
+    
+    async with broadcast_queue.recorder(broadcast_id) as recorder:
+        async def on_sent(chat_id):
+            metrics.broadcast_messages.inc(SENT)
+            await recorder.record(chat_id, SENT)
+        
+        async def on_failure(chat_id, error):
+            logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {error}")
+            status = BLOCKED if classify_error(error) == UNREACHABLE else FAILED
+            metrics.broadcast_messages.inc(status)
+            await recorder.record(chat_id, status, str(error))
+        
+        stats = await run_broadcast(
+            broadcast_queue.pending_recipients(broadcast_id), message.send, rate_limiter, total=remaining,
+            on_sent=on_sent, on_failure=on_failure, on_progress=on_progress
+        )
+    
+    await broadcast_queue.set_status(broadcast_id, JOB_DONE)
+    job = await broadcast_queue.get(broadcast_id)
+    
+    await bot.send_message(
+        chat_id=job['admin_chat_id'],
+        text=(
+            f"Рассылка #{broadcast_id} завершена за {format_duration(stats.elapsed)}:\n\n"
+            f"✅ Успешно: {job['sent']}\n❌ Не доставлено: {job['failed'] + job['blocked']}\n"
+            f"⚡ Средняя скорость: {stats.rate:.1f} сообщ/с"
+        ),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 В админ-панель", callback_data="back")]
+        ])
+    )
+
+# Подхватываем рассылки, прерванные перезапуском
+async def resume_broadcasts(application):
+    for job in await broadcast_queue.unfinished():
+        logger.info(f"Возобновляем рассылку #{job['broadcast_id']}")
+        broadcast_tasks.start(application, run_broadcast_job(application.bot, job['broadcast_id'], resumed=True))
+
+# Таймер отложенной рассылки. JobQueue будит бота только к ближайшему сроку,
+# пропущенные за время простоя рассылки запускаются сразу.
+# Таймеры восстанавливаются в post_init, до запуска планировщика: без misfire_grace_time=None
+# APScheduler счёл бы просроченным срок, прошедший больше секунды назад, и пропустил рассылку.
+# Повторного запуска не будет: materialize срабатывает для задания один раз
+def schedule_broadcast_job(job_queue, broadcast_id, scheduled_at):
+    job_queue.run_once(
+        fire_scheduled_broadcast,
+        when=max(scheduled_at, datetime.now(pytz.utc)),
+        data=broadcast_id,
+        name=f"broadcast_{broadcast_id}",
+        job_kwargs={'misfire_grace_time': None, 'coalesce': True}
+    )
+
+async def fire_scheduled_broadcast(context: ContextTypes.DEFAULT_TYPE):
+    broadcast_id = context.job.data
+    if not await broadcast_queue.materialize(broadcast_id) or BROADCAST_MODE == 'workers':
+        return
+    broadcast_tasks.start(context.application, run_broadcast_job(context.bot, broadcast_id))
+
+# Восстанавливаем таймеры из сохранённого расписания
+async def restore_scheduled_broadcasts(application):
+    schedules = await broadcast_queue.scheduled()
+    for job in schedules:
+        scheduled_at = pytz.utc.localize(datetime.strptime(job['scheduled_at'], '%Y-%m-%d %H:%M:%S'))
+        schedule_broadcast_job(application.job_queue, job['broadcast_id'], scheduled_at)
+    if schedules:
+        logger.info(f"Восстановлено отложенных рассылок: {len(schedules)}")
+
+async def post_init(application):
+    await roles.load()
+    activity.start()
+    # В режиме workers прерванные рассылки доделывают воркеры
+    if BROADCAST_MODE != 'workers':
+        await resume_broadcasts(application)
+    application.create_cancellable_task(notifier.resume(application.bot))
+    await restore_scheduled_broadcasts(application)
+    schedule_daily_jobs(application.job_queue)
+    if metrics.enabled:
+        await metrics_server.start()
+
+async def post_shutdown(application):
+    await metrics_server.stop()
+    await activity.stop()
+    db.close()
+
 # Добавление админа (только для суперадмина)
 async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_superadmin(update.effective_user.id):
@@ -525,20 +983,22 @@ async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ADMIN_MENU
 
-# Обработка пересланного сообщения для добавления админа
+# Обработка пересланного сообщения для добавления админа (только для суперадмина).
+# Пересылки от остальных пользователей молча игнорируются
 async def process_new_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_superadmin(update.effective_user.id):
+        return
+    
     if not update.message.forward_from:
         await update.message.reply_text("Пожалуйста, перешлите сообщение от пользователя.")
         return ADMIN_MENU
     
     new_admin = update.message.forward_from
     
-    conn = sqlite3.connect('consultations.db')
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR REPLACE INTO admins (admin_id, username, full_name) VALUES (?, ?, ?)', 
-                  (new_admin.id, new_admin.username, f"{new_admin.first_name} {new_admin.last_name}"))
-    conn.commit()
-    conn.close()
+    if not await roles.add_admin(new_admin.id, new_admin.username, f"{new_admin.first_name} {new_admin.last_name}",
+                                 update.effective_user.id):
+        await update.message.reply_text("У вас нет прав для этой операции.")
+        return ADMIN_MENU
     
     await update.message.reply_text(
         f"Пользователь @{new_admin.username} добавлен как администратор.",
@@ -553,9 +1013,22 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Действие отменено.")
     return ConversationHandler.END
 
-# Основная функция
-def main():
-    application = ApplicationBuilder().token("7729706158:AAFgUHY62JHT65caVu1vZWlTjG69t69C8Wo").build()
+# Сборка приложения со всеми обработчиками. base_url позволяет направить бота
+# на другой сервер Bot API (например, фейковый в бенчмарках)
+def build_application(token=BOT_TOKEN, base_url=None):
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .application_class(OrderedUpdateApplication, {'update_concurrency': UPDATE_CONCURRENCY})
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(SQLitePersistence(db))
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if metrics.enabled:
+        builder = builder.request(metrics.request())
+    application = builder.build()
     
     # Обработчик для сбора заявок
     conv_handler = ConversationHandler(
@@ -567,31 +1040,80 @@ def main():
             REQUEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_request)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='intake',
+        persistent=True,
     )
     
     # Обработчик для админ-панели
     admin_handler = ConversationHandler(
-        entry_points=[CommandHandler('admin', admin_panel)],
+        entry_points=[CommandHandler('admin', admin_panel), CommandHandler('find', find_command)],
         states={
             ADMIN_MENU: [CallbackQueryHandler(button_handler)],
-            SELECT_RECIPIENTS: [CallbackQueryHandler(select_recipients)],
-            SEND_MESSAGE: [MessageHandler(filters.TEXT | filters.PHOTO, get_broadcast_message)],
+            SELECT_RECIPIENTS: [
+                CallbackQueryHandler(select_recipients),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, set_broadcast_company)
+            ],
+            SEND_MESSAGE: [
+                MessageHandler(
+                    (filters.TEXT & ~filters.COMMAND) | filters.PHOTO | filters.VIDEO
+                    | filters.ANIMATION | filters.Document.ALL,
+                    get_broadcast_message
+                ),
+                # Кнопки выбора времени после того, как собран альбом
+                CallbackQueryHandler(schedule_broadcast)
+            ],
             SCHEDULE: [
                 CallbackQueryHandler(schedule_broadcast),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, schedule_broadcast)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_broadcast)
             ],
             CONFIRM_SEND: [CallbackQueryHandler(send_broadcast)],
+            SEARCH: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, find_leads),
+                CallbackQueryHandler(button_handler)
+            ],
+            EXPORT_RANGE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, get_export_range),
+                CallbackQueryHandler(button_handler)
+            ],
         },
-        fallbacks=[CommandHandler('cancel', cancel)],
+        fallbacks=[CommandHandler('cancel', cancel), CommandHandler('find', find_command)],
+        name='admin',
+        persistent=True,
     )
     
     # Добавляем обработчики
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
     application.add_handler(conv_handler)
     application.add_handler(admin_handler)
-    application.add_handler(MessageHandler(filters.FORWARD & filters.USER, process_new_admin))
+    application.add_handler(MessageHandler(filters.FORWARDED & filters.USER, process_new_admin))
+    
+    metrics.instrument_handlers(application)
+    metrics.gauge('bot_updates_queued', 'Обновления, ожидающие обработки',
+                  lambda: application.update_queue.qsize() + application.queued_updates)
+    
+    return application
+
+# Основная функция
+def main():
+    # Без адреса вебхука бот не запустится: проверяем до сборки приложения, а не падаем при старте вебхука
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        logger.error("BOT_MODE=webhook, но WEBHOOK_URL не задан. Укажите публичный адрес, например https://example.com")
+        raise SystemExit(1)
+    application = build_application()
     
     # Запускаем бота
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(
+            application,
+            url=WEBHOOK_URL,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        ))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
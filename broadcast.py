@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 сообщение в секунду в один чат
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+# Количество одновременно работающих отправителей
+SENDER_CONCURRENCY = 20
+# Сколько раз повторяем отправку после 429 или сетевой ошибки
+MAX_RETRIES = 3
+# Пауза перед повтором после сетевой ошибки: 1, 2, 4 ... секунд
+RETRY_BACKOFF = 1
+# Как часто показываем админу прогресс рассылки (сек)
+PROGRESS_INTERVAL = 3
+
+# Классы ошибок отправки:
+#   UNREACHABLE — пользователь заблокировал бота, удалил аккаунт или чат не существует;
+#                 писать ему бесполезно, пока он сам не вернётся в бота
+#   TRANSIENT   — флуд-контроль, таймауты и сбои сети; отправку стоит повторить
+#   REJECTED    — Telegram отклонил само сообщение; пользователь тут ни при чём
+UNREACHABLE, TRANSIENT, REJECTED = 'unreachable', 'transient', 'rejected'
+
+UNREACHABLE_MESSAGES = (
+    'chat not found',
+    'user not found',
+    'user is deactivated',
+    'bot was blocked',
+    'peer_id_invalid',
+    "bot can't initiate conversation",
+)
+
+
+def classify_error(error):
+    if isinstance(error, Forbidden):
+        return UNREACHABLE
+    if isinstance(error, BadRequest):
+        message = error.message.lower()
+        if any(text in message for text in UNREACHABLE_MESSAGES):
+            return UNREACHABLE
+        return REJECTED
+    # BadRequest — тоже NetworkError, поэтому проверяется выше
+    if isinstance(error, (RetryAfter, TimedOut, NetworkError)):
+        return TRANSIENT
+    return REJECTED
+
+
+# Token bucket: rate токенов в секунду, не больше capacity в запасе
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def is_full(self):
+        self._refill()
+        return self._tokens >= self.capacity
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Общий ограничитель: глобальный лимит + лимит на чат, адаптивный к 429
+class RateLimiter:
+    # Минимальная скорость, до которой можем опуститься после 429
+    MIN_RATE = 1
+    # Во сколько раз снижаем скорость после 429 и насколько поднимаем после успеха
+    DECREASE_FACTOR = 0.7
+    INCREASE_STEP = 0.05
+    # После скольких корзин чистим неиспользуемые
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, rate=GLOBAL_RATE, per_chat_rate=PER_CHAT_RATE, burst=1):
+        self.max_rate = rate
+        self.per_chat_rate = per_chat_rate
+        self._global = TokenBucket(rate, burst)
+        self._per_chat = {}
+        self._paused_until = 0.0
+
+    @property
+    def rate(self):
+        return self._global.rate
+
+    async def acquire(self, chat_id):
+        await self._wait_pause()
+        bucket = self._per_chat.get(chat_id)
+        if bucket is None:
+            if len(self._per_chat) >= self.MAX_CHAT_BUCKETS:
+                self._prune()
+            bucket = self._per_chat[chat_id] = TokenBucket(self.per_chat_rate)
+        await bucket.acquire()
+        await self._global.acquire()
+        # Пауза могла начаться, пока ждали токен
+        await self._wait_pause()
+
+    async def _wait_pause(self):
+        delay = self._paused_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._paused_until - time.monotonic()
+
+    def _prune(self):
+        # Полная корзина ничем не отличается от новой — её можно выбросить
+        for chat_id in [c for c, b in self._per_chat.items() if b.is_full]:
+            del self._per_chat[chat_id]
+
+    def on_retry_after(self, retry_after):
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        self._global.rate = max(self.MIN_RATE, self._global.rate * self.DECREASE_FACTOR)
+        logger.warning(f"Flood control: пауза {retry_after} с, скорость снижена до {self._global.rate:.1f} сообщ/с")
+
+    def on_success(self):
+        if self._global.rate < self.max_rate:
+            self._global.rate = min(self.max_rate, self._global.rate + self.INCREASE_STEP)
+
+
+@dataclass
+class BroadcastStats:
+    total: int
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float = None
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self):
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        if not self.rate:
+            return None
+        return max(0, self.total - self.done) / self.rate
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+
+
+def format_progress(stats):
+    eta = "—" if stats.eta is None else format_duration(stats.eta)
+    return (
+        f"📤 Отправлено: {stats.done}/{stats.total}\n"
+        f"✅ Успешно: {stats.sent}\n"
+        f"❌ Не доставлено: {stats.failed}\n"
+        f"⚡ Скорость: {stats.rate:.1f} сообщ/с\n"
+        f"⏳ Осталось: {eta}"
+    )
+
+
+async def _aiter(chat_ids):
+    if hasattr(chat_ids, '__aiter__'):
+        async for chat_id in chat_ids:
+            yield chat_id
+    else:
+        for chat_id in chat_ids:
+            yield chat_id
+
+
+# Рассылка пулом отправителей через общий ограничитель скорости.
+# send(chat_id) — корутина отправки одному получателю,
+# on_sent/on_failure — колбэки результата, on_progress(stats) — периодический отчёт.
+async def run_broadcast(chat_ids, send, limiter, total=None, concurrency=SENDER_CONCURRENCY,
+                        on_sent=None, on_failure=None, on_progress=None,
+                        progress_interval=PROGRESS_INTERVAL):
+    if total is None:
+        total = len(chat_ids)
+    stats = BroadcastStats(total=total)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def stop_senders():
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    # При отмене рассылки отправители отменяются вместе с производителем, и ждать
+    # места в полной очереди для маркеров остановки нельзя — отмена зависла бы
+    async def producer():
+        try:
+            async for chat_id in _aiter(chat_ids):
+                await queue.put(chat_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await stop_senders()
+            raise
+        await stop_senders()
+
+    async def deliver(chat_id):
+        for attempt in range(MAX_RETRIES + 1):
+            await limiter.acquire(chat_id)
+            try:
+                await send(chat_id)
+            except RetryAfter as e:
+                limiter.on_retry_after(e.retry_after)
+                stats.retries += 1
+                error = e
+                continue
+            except Exception as e:
+                error = e
+                if classify_error(e) != TRANSIENT or attempt == MAX_RETRIES:
+                    break
+                stats.retries += 1
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+            limiter.on_success()
+            stats.sent += 1
+            if on_sent:
+                await on_sent(chat_id)
+            return
+        stats.failed += 1
+        if on_failure:
+            await on_failure(chat_id, error)
+
+    async def sender():
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            try:
+                await deliver(chat_id)
+            except Exception as e:
+                logger.exception(f"Ошибка в отправителе рассылки для {chat_id}: {e}")
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(progress_interval)
+            try:
+                await on_progress(stats)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
+
+    progress_task = asyncio.create_task(reporter()) if on_progress else None
+    try:
+        await asyncio.gather(producer(), *(sender() for _ in range(concurrency)))
+    finally:
+        stats.finished_at = time.monotonic()
+        if progress_task:
+            progress_task.cancel()
+    return stats
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+
+from database import now_str
+from segments import load_segment, dump_segment, compile_segment, count_segment
+from payload import dumps
+
+logger = logging.getLogger(__name__)
+
+# Статусы доставки одному получателю. BLOCKED — недоступен навсегда (broadcast.classify_error)
+PENDING, SENT, FAILED, BLOCKED = 'pending', 'sent', 'failed', 'blocked'
+# Статусы задания рассылки
+JOB_SCHEDULED, JOB_PENDING, JOB_RUNNING, JOB_DONE = 'scheduled', 'pending', 'running', 'done'
+
+# Результаты доставки пишем пачками: по FLUSH_SIZE строк или раз в FLUSH_INTERVAL секунд
+FLUSH_SIZE = 500
+FLUSH_INTERVAL = 2
+
+# Получатели читаются из базы порциями по FETCH_SIZE
+FETCH_SIZE = 1000
+
+
+class BroadcastQueue:
+    def __init__(self, db):
+        self.db = db
+
+    # Создаёт задание с собранным содержимым (payload.py) для сегмента (segments.py).
+    # Для немедленной рассылки сразу фиксирует список получателей,
+    # для запланированной (scheduled_at — время в UTC) список собирается в момент запуска
+    async def create(self, admin_chat_id, segment, payload, scheduled_at=None):
+        audience = dump_segment(segment)
+
+        def create(conn):
+            with conn:
+                cursor = conn.execute(
+                    'INSERT INTO broadcasts (admin_chat_id, audience, text, payload, status, created_at, scheduled_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        admin_chat_id, audience, payload['text'], dumps(payload),
+                        JOB_SCHEDULED if scheduled_at else JOB_PENDING,
+                        now_str(),
+                        scheduled_at.strftime('%Y-%m-%d %H:%M:%S') if scheduled_at else None
+                    )
+                )
+                broadcast_id = cursor.lastrowid
+                if not scheduled_at:
+                    self._add_recipients(conn, broadcast_id, audience)
+            return broadcast_id
+        return await self.db.run(create)
+
+    # Список получателей одним INSERT ... SELECT
+    def _add_recipients(self, conn, broadcast_id, audience):
+        where, params = compile_segment(load_segment(audience))
+        cursor = conn.execute(
+            f'INSERT INTO broadcast_deliveries (broadcast_id, user_id, status) '
+            f'SELECT ?, user_id, ? FROM users WHERE {where}',
+            (broadcast_id, PENDING) + params
+        )
+        conn.execute('UPDATE broadcasts SET total = ? WHERE broadcast_id = ?',
+                     (cursor.rowcount, broadcast_id))
+
+    # Переводит запланированное задание в очередь на отправку.
+    # Возвращает False, если задание уже запущено (например, повторное срабатывание таймера)
+    async def materialize(self, broadcast_id):
+        def materialize(conn):
+            with conn:
+                rows = conn.execute(
+                    'UPDATE broadcasts SET status = ? WHERE broadcast_id = ? AND status = ? RETURNING audience',
+                    (JOB_PENDING, broadcast_id, JOB_SCHEDULED)
+                ).fetchall()
+                if not rows:
+                    return False
+                self._add_recipients(conn, broadcast_id, rows[0]['audience'])
+            return True
+        return await self.db.run(materialize)
+
+    # Запланированные задания по возрастанию времени (по индексу status, scheduled_at)
+    async def scheduled(self):
+        return await self.db.fetchall(
+            'SELECT broadcast_id, scheduled_at FROM broadcasts WHERE status = ? ORDER BY scheduled_at',
+            (JOB_SCHEDULED,)
+        )
+
+    async def get(self, broadcast_id):
+        return await self.db.fetchone('SELECT * FROM broadcasts WHERE broadcast_id = ?', (broadcast_id,))
+
+    # Незавершённые задания, которые нужно подхватить после перезапуска
+    async def unfinished(self):
+        return await self.db.fetchall(
+            'SELECT * FROM broadcasts WHERE status IN (?, ?) ORDER BY broadcast_id',
+            (JOB_PENDING, JOB_RUNNING)
+        )
+
+    # Число получателей сегмента для предпросмотра
+    async def count_recipients(self, segment):
+        return await self.db.run(count_segment, segment)
+
+    async def count_pending(self, broadcast_id):
+        return await self.db.fetchval(
+            'SELECT COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? AND status = ?',
+            (broadcast_id, PENDING)
+        )
+
+    # Получатели, которым ещё не отправлено, порциями по индексу (broadcast_id, status, user_id):
+    # список не держится в памяти целиком, а строки, обновлённые во время рассылки, не повторяются.
+    # first_user_id / last_user_id ограничивают диапазон (порция воркера, chunks.py)
+    async def pending_recipients(self, broadcast_id, fetch_size=FETCH_SIZE, first_user_id=None, last_user_id=None):
+        last_seen = 0 if first_user_id is None else first_user_id - 1
+        until = '' if last_user_id is None else ' AND user_id <= ?'
+        bound = () if last_user_id is None else (last_user_id,)
+        while True:
+            rows = await self.db.fetchall(
+                'SELECT user_id FROM broadcast_deliveries '
+                f'WHERE broadcast_id = ? AND status = ? AND user_id > ?{until} ORDER BY user_id LIMIT ?',
+                (broadcast_id, PENDING, last_seen) + bound + (fetch_size,)
+            )
+            for row in rows:
+                yield row[0]
+            if len(rows) < fetch_size:
+                return
+            last_seen = rows[-1][0]
+
+    async def set_status(self, broadcast_id, status):
+        await self.db.execute(
+            'UPDATE broadcasts SET status = ?, finished_at = ? WHERE broadcast_id = ?',
+            (status, now_str() if status == JOB_DONE else None, broadcast_id)
+        )
+
+    def recorder(self, broadcast_id):
+        return DeliveryRecorder(self.db, broadcast_id)
+
+
+# Буфер результатов доставки: один коммит на пачку, а не на каждое сообщение
+class DeliveryRecorder:
+    def __init__(self, db, broadcast_id, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.db = db
+        self.broadcast_id = broadcast_id
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._task = None
+
+    async def record(self, user_id, status, error=None):
+        self._buffer.append((status, error, now_str(), self.broadcast_id, user_id))
+        if len(self._buffer) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await self.db.run(self._write, batch)
+        except Exception:
+            # Вернём пачку в буфер, чтобы записать её при следующей попытке
+            self._buffer = batch + self._buffer
+            raise
+
+    def _write(self, conn, batch):
+        counts = {SENT: 0, FAILED: 0, BLOCKED: 0}
+        for row in batch:
+            counts[row[0]] += 1
+        with conn:
+            conn.executemany(
+                'UPDATE broadcast_deliveries SET status = ?, error = ?, updated_at = ? '
+                'WHERE broadcast_id = ? AND user_id = ?',
+                batch
+            )
+            # Завершённое задание не возвращается в running: запоздалая пачка воркера,
+            # потерявшего аренду порции (chunks.py), только дописывает счётчики
+            conn.execute(
+                'UPDATE broadcasts SET status = CASE WHEN status = ? THEN status ELSE ? END, '
+                'sent = sent + ?, failed = failed + ?, blocked = blocked + ? '
+                'WHERE broadcast_id = ?',
+                (JOB_DONE, JOB_RUNNING, counts[SENT], counts[FAILED], counts[BLOCKED], self.broadcast_id)
+            )
+            # Неактивными помечаем только недоступных навсегда (BLOCKED) — в той же транзакции.
+            # После сбоя сети или флуд-контроля пользователь остаётся активным.
+            # Вернувшийся в бота пользователь снова становится активным (activity.py)
+            conn.executemany(
+                'UPDATE users SET is_active = 0 WHERE user_id = ?',
+                [(row[4],) for row in batch if row[0] == BLOCKED]
+            )
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи результатов рассылки {self.broadcast_id}: {e}")
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+        await self.flush()
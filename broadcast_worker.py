@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from datetime import datetime
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.request import HTTPXRequest
+
+from broadcast import RateLimiter, run_broadcast, format_duration, classify_error, UNREACHABLE, GLOBAL_RATE, SENDER_CONCURRENCY
+from broadcast_queue import BroadcastQueue, SENT, FAILED, BLOCKED
+from chunks import SQLiteChunkQueue, worker_name, CHUNK_SIZE, LEASE_SECONDS
+from database import Database
+from migrations import migrate
+from payload import CompiledPayload, BROADCAST_MARKUP, load as load_payload
+
+logger = logging.getLogger(__name__)
+
+# Воркер рассылок — отдельный процесс. Бот в режиме BROADCAST_MODE=workers только
+# ставит задания в очередь, а воркеры (сколько угодно копий, в том числе на разных
+# машинах с общей базой) разбирают их порциями через chunks.py.
+# Скорость задаётся на воркер: сумма по всем воркерам не должна превышать лимит
+# бота в Telegram (около 30 сообщ/с, с платными рассылками — больше).
+#
+#   BOT_TOKEN=... python broadcast_worker.py --rate 30
+
+# Как часто воркер без работы проверяет очередь, сек
+POLL_INTERVAL = 1
+
+
+class BroadcastWorker:
+    def __init__(self, db, bot, chunks, limiter, concurrency=SENDER_CONCURRENCY, name=None,
+                 poll_interval=POLL_INTERVAL):
+        self.db = db
+        self.bot = bot
+        self.chunks = chunks
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.name = name or worker_name()
+        self.poll_interval = poll_interval
+        self.queue = BroadcastQueue(db)
+        self._messages = {}
+        self._stopping = asyncio.Event()
+        # Метрики
+        self.chunks_done = 0
+        self.sent = 0
+        self.failed = 0
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        logger.info(f"Воркер рассылок {self.name} запущен")
+        while not self._stopping.is_set():
+            chunk = await self.chunks.claim(self.name)
+            if chunk is None and await self.chunks.split_jobs():
+                chunk = await self.chunks.claim(self.name)
+            if chunk is not None:
+                await self.process(chunk)
+            await self.report(await self.chunks.finish_jobs())
+            if chunk is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        logger.info(f"Воркер рассылок {self.name} остановлен: порций {self.chunks_done}, "
+                    f"отправлено {self.sent}, не доставлено {self.failed}")
+
+    # Сообщение собирается один раз на задание и переиспользуется для всех его порций
+    async def message(self, broadcast_id):
+        message = self._messages.get(broadcast_id)
+        if message is None:
+            job = await self.queue.get(broadcast_id)
+            message = self._messages[broadcast_id] = CompiledPayload(load_payload(job), self.bot, BROADCAST_MARKUP)
+        return message
+
+    async def process(self, chunk):
+        chunk_id, broadcast_id = chunk['chunk_id'], chunk['broadcast_id']
+        logger.info(f"Рассылка #{broadcast_id}: порция {chunk_id} ({chunk['size']} получателей, "
+                    f"попытка {chunk['attempts']})")
+        message = await self.message(broadcast_id)
+        sending = asyncio.create_task(self._send_chunk(chunk, message))
+        heartbeat = asyncio.create_task(self._heartbeat(chunk_id, sending))
+        stopping = asyncio.create_task(self._stopping.wait())
+        try:
+            await asyncio.wait((sending, stopping), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            heartbeat.cancel()
+            stopping.cancel()
+
+        if not sending.done():
+            # Остановка посреди порции: отдаём её другим воркерам сразу, не дожидаясь конца аренды
+            sending.cancel()
+            await asyncio.gather(sending, return_exceptions=True)
+            await self.chunks.release(chunk_id, self.name)
+            return
+        if sending.cancelled():
+            logger.warning(f"Рассылка #{broadcast_id}: аренда порции {chunk_id} потеряна, её доделает другой воркер")
+            return
+        if sending.exception():
+            logger.error(f"Рассылка #{broadcast_id}: ошибка в порции {chunk_id}: {sending.exception()}")
+            await self.chunks.release(chunk_id, self.name)
+            return
+        if await self.chunks.complete(chunk_id, self.name):
+            self.chunks_done += 1
+
+    async def _send_chunk(self, chunk, message):
+        broadcast_id = chunk['broadcast_id']
+        async with self.queue.recorder(broadcast_id) as recorder:
+            async def on_sent(chat_id):
+                self.sent += 1
+                await recorder.record(chat_id, SENT)
+
+            async def on_failure(chat_id, error):
+                logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {error}")
+                self.failed += 1
+                await recorder.record(chat_id, BLOCKED if classify_error(error) == UNREACHABLE else FAILED, str(error))
+
+            recipients = self.queue.pending_recipients(
+                broadcast_id, first_user_id=chunk['first_user_id'], last_user_id=chunk['last_user_id']
+            )
+            await run_broadcast(
+                recipients, message.send, self.limiter, total=chunk['size'], concurrency=self.concurrency,
+                on_sent=on_sent, on_failure=on_failure
+            )
+
+    # Продлевает аренду втрое чаще её срока; потерянная аренда останавливает отправку
+    async def _heartbeat(self, chunk_id, sending):
+        while True:
+            await asyncio.sleep(self.chunks.lease_seconds / 3)
+            try:
+                if not await self.chunks.heartbeat(chunk_id, self.name):
+                    sending.cancel()
+                    return
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду порции {chunk_id}: {e}")
+
+    # Отчёт админу о завершённых заданиях
+    async def report(self, jobs):
+        for job in jobs:
+            self._messages.pop(job['broadcast_id'], None)
+            started = datetime.strptime(job['created_at'], '%Y-%m-%d %H:%M:%S')
+            finished = datetime.strptime(job['finished_at'], '%Y-%m-%d %H:%M:%S')
+            try:
+                await self.bot.send_message(
+                    chat_id=job['admin_chat_id'],
+                    text=(
+                        f"Рассылка #{job['broadcast_id']} завершена за "
+                        f"{format_duration((finished - started).total_seconds())}:\n\n"
+                        f"✅ Успешно: {job['sent']}\n❌ Не доставлено: {job['failed'] + job['blocked']}"
+                    ),
+                    reply_markup=InlineKeyboardMarkup([
+                        [InlineKeyboardButton("🔙 В админ-панель", callback_data="back")]
+                    ])
+                )
+            except Exception as e:
+                logger.error(f"Не удалось отправить отчёт о рассылке #{job['broadcast_id']}: {e}")
+
+
+async def main(args):
+    db = Database(args.db)
+    db.call(migrate)
+    chunks = SQLiteChunkQueue(db, chunk_size=args.chunk_size, lease_seconds=args.lease)
+    limiter = RateLimiter(rate=args.rate)
+    # У Bot по умолчанию одно соединение — отправки шли бы строго по одной
+    request = HTTPXRequest(connection_pool_size=args.concurrency + 1)
+    if args.base_url:
+        bot = Bot(args.token, base_url=args.base_url, request=request)
+    else:
+        bot = Bot(args.token, request=request)
+    worker = BroadcastWorker(db, bot, chunks, limiter, concurrency=args.concurrency)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        async with bot:
+            await worker.run()
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', 'consultations.db'))
+    parser.add_argument('--token', default=os.environ.get('BOT_TOKEN'))
+    parser.add_argument('--base-url', default=os.environ.get('BOT_API_URL'),
+                        help="другой сервер Bot API (например, локальный или фейковый)")
+    parser.add_argument('--rate', type=float, default=float(os.environ.get('BROADCAST_RATE', GLOBAL_RATE)),
+                        help="сообщений в секунду на этот воркер")
+    parser.add_argument('--concurrency', type=int, default=SENDER_CONCURRENCY)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--lease', type=float, default=LEASE_SECONDS, help="срок аренды порции, сек")
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("укажите токен бота: BOT_TOKEN или --token")
+    asyncio.run(main(args))
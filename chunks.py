@@ -0,0 +1,124 @@
+import os
+import socket
+import time
+
+from broadcast_queue import PENDING, JOB_PENDING, JOB_RUNNING, JOB_DONE
+from database import now_str
+
+# Рассылка несколькими процессами (broadcast_worker.py). Получатели задания делятся
+# на порции по диапазонам user_id. Воркер берёт порцию в аренду на LEASE_SECONDS
+# и продлевает аренду, пока отправляет. Если воркер упал или завис, аренда истекает
+# и порцию забирает другой воркер. Уже обработанные получатели (status != pending)
+# при этом пропускаются, остальным сообщение дойдёт.
+# Доставка «хотя бы один раз»: воркер, потерявший аренду посреди порции, мог отправить
+# несколько сообщений, которые не успел записать, и их отправят повторно.
+#
+# Очередь порций — отдельный класс с методами split_jobs, claim, heartbeat,
+# complete, release и finish_jobs. SQLiteChunkQueue хранит порции в общей базе бота;
+# для другого хранилища (Redis, Postgres) достаточно реализовать те же методы.
+
+CHUNK_SIZE = 1000
+LEASE_SECONDS = 30
+
+CHUNK_OPEN, CHUNK_LEASED, CHUNK_DONE = 'open', 'leased', 'done'
+
+# Все ожидающие получатели задания, ещё не разбитого на порции, нумеруются по user_id
+# и группируются по CHUNK_SIZE. Один оператор — два воркера не разобьют задание дважды
+SPLIT_JOBS = '''
+INSERT INTO broadcast_chunks (broadcast_id, first_user_id, last_user_id, size, status)
+SELECT broadcast_id, MIN(user_id), MAX(user_id), COUNT(*), ?
+FROM (
+    SELECT d.broadcast_id, d.user_id,
+           (ROW_NUMBER() OVER (PARTITION BY d.broadcast_id ORDER BY d.user_id) - 1) / ? AS chunk
+    FROM broadcasts b
+    JOIN broadcast_deliveries d ON d.broadcast_id = b.broadcast_id AND d.status = ?
+    WHERE b.status IN (?, ?)
+      AND NOT EXISTS (SELECT 1 FROM broadcast_chunks c WHERE c.broadcast_id = b.broadcast_id)
+)
+GROUP BY broadcast_id, chunk
+'''
+
+# Свободная порция или порция с истёкшей арендой, сначала старые задания
+CLAIM = '''
+UPDATE broadcast_chunks
+SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1
+WHERE chunk_id = (
+    SELECT chunk_id FROM broadcast_chunks
+    WHERE status = ? OR (status = ? AND lease_until < ?)
+    ORDER BY chunk_id
+    LIMIT 1
+)
+RETURNING chunk_id, broadcast_id, first_user_id, last_user_id, size, attempts
+'''
+
+# Задание готово, когда все его порции обработаны (или ожидающих получателей нет вовсе).
+# RETURNING достаётся только одному воркеру — он и отправляет отчёт админу
+FINISH_JOBS = '''
+UPDATE broadcasts
+SET status = ?, finished_at = ?
+WHERE status IN (?, ?)
+  AND NOT EXISTS (SELECT 1 FROM broadcast_chunks c WHERE c.broadcast_id = broadcasts.broadcast_id AND c.status != ?)
+  AND (
+      EXISTS (SELECT 1 FROM broadcast_chunks c WHERE c.broadcast_id = broadcasts.broadcast_id)
+      OR NOT EXISTS (SELECT 1 FROM broadcast_deliveries d WHERE d.broadcast_id = broadcasts.broadcast_id AND d.status = ?)
+  )
+RETURNING *
+'''
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class SQLiteChunkQueue:
+    def __init__(self, db, chunk_size=CHUNK_SIZE, lease_seconds=LEASE_SECONDS):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+
+    # Разбивает новые задания на порции, возвращает число созданных порций
+    async def split_jobs(self):
+        return await self.db.execute(
+            SPLIT_JOBS, (CHUNK_OPEN, self.chunk_size, PENDING, JOB_PENDING, JOB_RUNNING)
+        )
+
+    # Берёт порцию в аренду; None — брать нечего
+    async def claim(self, worker):
+        now = time.time()
+
+        def claim(conn):
+            with conn:
+                return conn.execute(
+                    CLAIM, (CHUNK_LEASED, worker, now + self.lease_seconds, CHUNK_OPEN, CHUNK_LEASED, now)
+                ).fetchone()
+        return await self.db.run(claim)
+
+    # Продлевает аренду. False — аренда истекла и порцию уже забрал другой воркер
+    async def heartbeat(self, chunk_id, worker):
+        return await self.db.execute(
+            'UPDATE broadcast_chunks SET lease_until = ? WHERE chunk_id = ? AND worker = ? AND status = ?',
+            (time.time() + self.lease_seconds, chunk_id, worker, CHUNK_LEASED)
+        ) > 0
+
+    async def complete(self, chunk_id, worker):
+        return await self.db.execute(
+            'UPDATE broadcast_chunks SET status = ?, lease_until = NULL WHERE chunk_id = ? AND worker = ? AND status = ?',
+            (CHUNK_DONE, chunk_id, worker, CHUNK_LEASED)
+        ) > 0
+
+    # Возвращает порцию в очередь при остановке воркера, не дожидаясь конца аренды
+    async def release(self, chunk_id, worker):
+        await self.db.execute(
+            'UPDATE broadcast_chunks SET status = ?, worker = NULL, lease_until = NULL '
+            'WHERE chunk_id = ? AND worker = ? AND status = ?',
+            (CHUNK_OPEN, chunk_id, worker, CHUNK_LEASED)
+        )
+
+    # Отмечает завершёнными задания, у которых обработаны все порции, и возвращает их
+    async def finish_jobs(self):
+        def finish(conn):
+            with conn:
+                return conn.execute(
+                    FINISH_JOBS, (JOB_DONE, now_str(), JOB_PENDING, JOB_RUNNING, CHUNK_DONE, PENDING)
+                ).fetchall()
+        return await self.db.run(finish)
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+# Даты в базе хранятся строками в локальном времени, в этом формате
+def now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def days_ago(days, now=None):
+    return ((now or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# Доступ к базе: одно долгоживущее соединение в WAL-режиме,
+# все запросы выполняются в отдельном потоке и не блокируют event loop.
+# sqlite3 кэширует подготовленные запросы по тексту SQL, поэтому
+# повторяющиеся запросы компилируются один раз на всё время работы бота.
+class Database:
+    def __init__(self, path, cached_statements=256):
+        self.path = path
+        self.cached_statements = cached_statements
+        self._conn = None
+        # observer(operation, waited, elapsed) — замер ожидания потока базы и выполнения запроса
+        self.observer = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                check_same_thread=False,
+                cached_statements=self.cached_statements
+            )
+            conn.row_factory = sqlite3.Row
+            # Для новой базы: освободившиеся страницы возвращаются через incremental_vacuum (retention.py).
+            # На существующую базу действует только после VACUUM
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('PRAGMA journal_mode = WAL')
+            # В WAL-режиме NORMAL безопасен и не делает fsync на каждый коммит
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            conn.execute('PRAGMA foreign_keys = ON')
+            self._conn = conn
+        return self._conn
+
+    def _invoke(self, fn, args):
+        return fn(self._connection(), *args)
+
+    # fn(conn, *args) в потоке базы. Транзакцию открывает сама функция через `with conn:`
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        if self.observer is None:
+            return await loop.run_in_executor(self._executor, self._invoke, fn, args)
+        submitted = time.perf_counter()
+        started = None
+
+        def invoke():
+            nonlocal started
+            started = time.perf_counter()
+            return self._invoke(fn, args)
+        try:
+            return await loop.run_in_executor(self._executor, invoke)
+        finally:
+            if started is not None:
+                self.observer(fn.__name__, started - submitted, time.perf_counter() - started)
+
+    # Синхронный вариант для кода вне event loop (инициализация схемы, отдельные потоки)
+    def call(self, fn, *args):
+        return self._executor.submit(self._invoke, fn, args).result()
+
+    async def execute(self, sql, params=()):
+        def execute(conn):
+            with conn:
+                return conn.execute(sql, params).rowcount
+        return await self.run(execute)
+
+    async def executemany(self, sql, seq_of_params):
+        def executemany(conn):
+            with conn:
+                return conn.executemany(sql, seq_of_params).rowcount
+        return await self.run(executemany)
+
+    async def fetchone(self, sql, params=()):
+        def fetchone(conn):
+            return conn.execute(sql, params).fetchone()
+        return await self.run(fetchone)
+
+    async def fetchall(self, sql, params=()):
+        def fetchall(conn):
+            return conn.execute(sql, params).fetchall()
+        return await self.run(fetchall)
+
+    async def fetchval(self, sql, params=(), default=None):
+        row = await self.fetchone(sql, params)
+        return default if row is None else row[0]
+
+    def close(self):
+        def close(conn):
+            conn.close()
+            self._conn = None
+        if self._conn is not None:
+            self.call(close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,180 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+
+# Сколько строк читаем из базы за раз
+FETCH_SIZE = 1000
+
+EXPORT_QUERY = '''
+SELECT user_id, username, first_name, last_name, phone, company, request,
+       registration_date, is_active, last_activity
+FROM users
+'''
+
+# Новые и изменённые записи за полуинтервал [с, по) по last_activity. Читается по индексу
+# idx_users_activity, поэтому стоимость выгрузки зависит от числа изменений, а не от размера базы
+DELTA_QUERY = EXPORT_QUERY + '''WHERE last_activity >= ? AND last_activity < ?
+ORDER BY last_activity
+'''
+
+EXPORT_HEADERS = [
+    "ID", "Username", "Имя", "Фамилия", "Телефон",
+    "Компания", "Запрос", "Дата регистрации", "Активен", "Последняя активность"
+]
+
+# Формат выгрузки -> расширение файла
+EXPORT_FORMATS = {
+    'xlsx': '.xlsx',
+    'csv': '.csv',
+    'csv.gz': '.csv.gz',
+}
+
+
+# Отметка админа: exported_until — до какого момента (не включительно) он уже получил
+# изменения, NULL — выгрузок новых ещё не было; daily_format — формат ежедневной выгрузки
+def load_export_mark(conn, admin_id):
+    return conn.execute(
+        'SELECT exported_until, daily_format FROM export_marks WHERE admin_id = ?', (admin_id,)
+    ).fetchone()
+
+
+# Отметка только растёт: ежедневная и ручная выгрузки могут завершиться в любом порядке
+def save_export_mark(conn, admin_id, exported_until):
+    with conn:
+        conn.execute(
+            'INSERT INTO export_marks (admin_id, exported_until) VALUES (?, ?) '
+            'ON CONFLICT(admin_id) DO UPDATE SET '
+            "exported_until = MAX(COALESCE(exported_until, ''), excluded.exported_until)",
+            (admin_id, exported_until)
+        )
+
+
+# fmt=None отключает ежедневную выгрузку
+def set_daily_export(conn, admin_id, fmt):
+    with conn:
+        conn.execute(
+            'INSERT INTO export_marks (admin_id, daily_format) VALUES (?, ?) '
+            'ON CONFLICT(admin_id) DO UPDATE SET daily_format = excluded.daily_format',
+            (admin_id, fmt)
+        )
+
+
+def daily_export_admins(conn):
+    return conn.execute(
+        'SELECT admin_id, daily_format FROM export_marks WHERE daily_format IS NOT NULL'
+    ).fetchall()
+
+
+# «01.09.2024 - 30.09.2024» или один день «01.09.2024» -> границы [с, по) для DELTA_QUERY
+def parse_date_range(text):
+    parts = [part.strip() for part in text.replace('—', '-').split('-')]
+    if not 1 <= len(parts) <= 2:
+        raise ValueError(text)
+    start = datetime.strptime(parts[0], '%d.%m.%Y')
+    end = datetime.strptime(parts[-1], '%d.%m.%Y')
+    if end < start:
+        raise ValueError(text)
+    return start.strftime('%Y-%m-%d %H:%M:%S'), (end + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def format_date_range(start, end):
+    first = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+    last = datetime.strptime(end, '%Y-%m-%d %H:%M:%S') - timedelta(days=1)
+    if first == last:
+        return first.strftime('%d.%m.%Y')
+    return f"{first.strftime('%d.%m.%Y')} – {last.strftime('%d.%m.%Y')}"
+
+
+def _rows(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def _write_xlsx(path, rows):
+    # write-only режим openpyxl не держит всю таблицу в памяти
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Пользователи")
+    ws.append(EXPORT_HEADERS)
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+    wb.save(path)
+    return count
+
+
+def _write_csv(file, rows):
+    writer = csv.writer(file)
+    writer.writerow(EXPORT_HEADERS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+# Потоковая выгрузка пользователей во временный файл. Блокирующая — из бота запускается
+# в отдельном процессе (export_users_in_process).
+# Читает через собственное соединение только для чтения: в WAL-режиме оно не мешает
+# основному потоку базы. Возвращает (путь к файлу, число строк); файл удаляет вызывающий.
+def export_users(db_path, fmt='xlsx', query=EXPORT_QUERY, params=()):
+    suffix = EXPORT_FORMATS[fmt]
+    fd, path = tempfile.mkstemp(prefix='users_export_', suffix=suffix)
+    os.close(fd)
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        rows = _rows(conn.execute(query, params))
+        if fmt == 'xlsx':
+            count = _write_xlsx(path, rows)
+        elif fmt == 'csv.gz':
+            with gzip.open(path, 'wt', encoding='utf-8-sig', newline='') as file:
+                count = _write_csv(file, rows)
+        else:
+            # utf-8-sig, чтобы Excel правильно открывал кириллицу
+            with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+                count = _write_csv(file, rows)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        conn.close()
+    return path, count
+
+
+# Выгрузка в отдельном процессе: openpyxl и csv — чистый Python, в потоке они
+# отнимают GIL у цикла событий и задерживают ответы всем клиентам бота
+async def export_users_in_process(db_path, fmt='xlsx', query=EXPORT_QUERY, params=()):
+    task = json.dumps({'db_path': os.path.abspath(db_path), 'fmt': fmt, 'query': query, 'params': list(params)})
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate(task.encode())
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"Выгрузка завершилась с ошибкой: {stderr.decode(errors='replace').strip()}")
+    result = json.loads(stdout)
+    return result['path'], result['count']
+
+
+if __name__ == '__main__':
+    # Уступаем процессор боту
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    task = json.load(sys.stdin)
+    path, count = export_users(task['db_path'], task['fmt'], task['query'], task['params'])
+    json.dump({'path': path, 'count': count}, sys.stdout)
@@ -0,0 +1,47 @@
+import textwrap
+
+# История заявок: таблица leads только дополняется (activity.py пишет строку
+# на каждую завершённую анкету), анкета в users хранит лишь последнюю заявку.
+# Просмотр в чате листается по lead_id (keyset), а не через OFFSET:
+# любая страница — один проход по первичному ключу на PAGE_SIZE строк,
+# как бы далеко в историю ни ушёл админ.
+
+PAGE_SIZE = 5
+
+_LEAD = '''
+SELECT l.*, (SELECT COUNT(*) FROM leads p WHERE p.user_id = l.user_id AND p.lead_id <= l.lead_id) AS number
+FROM leads l
+'''
+
+NEWEST = _LEAD + 'ORDER BY l.lead_id DESC LIMIT ?'
+OLDER = _LEAD + 'WHERE l.lead_id < ? ORDER BY l.lead_id DESC LIMIT ?'
+NEWER = _LEAD + 'WHERE l.lead_id > ? ORDER BY l.lead_id ASC LIMIT ?'
+
+
+# Страница заявок от новых к старым и есть ли заявки новее и старее неё.
+# older_than / newer_than — lead_id крайней заявки предыдущей страницы
+def page_leads(conn, older_than=None, newer_than=None, limit=PAGE_SIZE):
+    if newer_than is not None:
+        rows = conn.execute(NEWER, (newer_than, limit + 1)).fetchall()
+        has_newer = len(rows) > limit
+        return list(reversed(rows[:limit])), has_newer, True
+    if older_than is not None:
+        rows = conn.execute(OLDER, (older_than, limit + 1)).fetchall()
+        return rows[:limit], True, len(rows) > limit
+    rows = conn.execute(NEWEST, (limit + 1,)).fetchall()
+    return rows[:limit], False, len(rows) > limit
+
+
+def format_lead_history(rows):
+    if not rows:
+        return "🗂 Заявок пока нет."
+    lines = ["🗂 Заявки, сначала новые:\n"]
+    for row in rows:
+        name = ' '.join(part for part in (row['first_name'], row['last_name']) if part) or '—'
+        username = f" @{row['username']}" if row['username'] else ''
+        repeat = f" · 🔁 {row['number']}-я от клиента" if row['number'] > 1 else ''
+        lines.append(f"#{row['lead_id']} · {row['created_at']}{repeat}")
+        lines.append(f"👤 {name}{username} · 🆔 {row['user_id']}")
+        lines.append(f"📱 {row['phone'] or '—'} · 🏢 {row['company'] or '—'}")
+        lines.append(f"📝 {textwrap.shorten(row['request'] or '—', 300, placeholder='…')}\n")
+    return '\n'.join(lines).rstrip()
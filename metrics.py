@@ -0,0 +1,309 @@
+import bisect
+import functools
+import logging
+import time
+
+from aiohttp import web
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунд
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Как у ApplicationBuilder по умолчанию
+CONNECTION_POOL_SIZE = 256
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Счётчик, только растёт
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self, **match):
+        return sum(value for labels, value in self.values.items() if _matches(self.labelnames, labels, match))
+
+    def render(self):
+        for labels, value in self.values.items():
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+# Гистограмма в формате Prometheus: число наблюдений по корзинам, сумма и количество
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self.series = {}
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def _merged(self, match):
+        counts = [0] * (len(self.buckets) + 1)
+        for labels, (series_counts, _) in self.series.items():
+            if _matches(self.labelnames, labels, match):
+                counts = [a + b for a, b in zip(counts, series_counts)]
+        return counts
+
+    def count(self, **match):
+        return sum(self._merged(match))
+
+    # Квантиль с линейной интерполяцией внутри корзины, секунд
+    def quantile(self, q, **match):
+        counts = self._merged(match)
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self):
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", le)])} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total!r}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+# Значение, которое считывается в момент запроса: fn() -> число или {метка: число}
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn, labelname=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelname = labelname
+
+    def render(self):
+        value = self.fn()
+        if self.labelname is None:
+            yield f'{self.name} {_number(value)}'
+            return
+        for label, item in value.items():
+            yield f'{self.name}{_labels((self.labelname,), (label,))} {_number(item)}'
+
+
+def _matches(names, labels, match):
+    return all(labels[names.index(name)] == value for name, value in match.items())
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error(f"Ошибка чтения метрики {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+# Запросы к Bot API с замером времени и кодов ответа (в том числе 429)
+class InstrumentedRequest(HTTPXRequest):
+    def __init__(self, metrics, **kwargs):
+        super().__init__(**kwargs)
+        self._metrics = metrics
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        code = 'error'
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            return code, payload
+        finally:
+            self._metrics.api_seconds.observe(time.perf_counter() - start, api_method)
+            self._metrics.api_responses.inc(api_method, str(code))
+
+
+# Метрики бота. Выключенные ничего не оборачивают: обработчики, база и запросы
+# к Telegram работают как без них, остаются только счётчики-словари
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.monotonic()
+        self.registry = Registry()
+        self.handler_seconds = self.registry.add(Histogram(
+            'bot_handler_seconds', 'Время работы обработчика обновления', ('handler', 'outcome')))
+        self.db_seconds = self.registry.add(Histogram(
+            'bot_db_query_seconds', 'Время выполнения запроса в потоке базы', ('operation',)))
+        self.db_wait_seconds = self.registry.add(Histogram(
+            'bot_db_wait_seconds', 'Ожидание очереди потока базы'))
+        self.api_seconds = self.registry.add(Histogram(
+            'bot_telegram_request_seconds', 'Время запроса к Bot API', ('method',)))
+        self.api_responses = self.registry.add(Counter(
+            'bot_telegram_responses_total', 'Ответы Bot API по кодам', ('method', 'code')))
+        self.broadcast_messages = self.registry.add(Counter(
+            'bot_broadcast_messages_total', 'Сообщения рассылок по результату', ('result',)))
+
+    def gauge(self, name, help, fn, labelname=None):
+        return self.registry.add(Gauge(name, help, fn, labelname))
+
+    def wrap_handler(self, callback):
+        if not self.enabled:
+            return callback
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = await callback(update, context)
+                outcome = 'ok'
+                return result
+            finally:
+                self.handler_seconds.observe(time.perf_counter() - start, name, outcome)
+        return wrapper
+
+    # Оборачивает все обработчики приложения, включая шаги ConversationHandler
+    def instrument_handlers(self, application):
+        if not self.enabled:
+            return
+
+        def instrument(handler):
+            if isinstance(handler, ConversationHandler):
+                for child in handler.entry_points + handler.fallbacks:
+                    instrument(child)
+                for handlers in handler.states.values():
+                    for child in handlers:
+                        instrument(child)
+            else:
+                handler.callback = self.wrap_handler(handler.callback)
+
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                instrument(handler)
+
+    def instrument_db(self, db):
+        if self.enabled:
+            db.observer = self.observe_db
+
+    def observe_db(self, operation, waited, elapsed):
+        self.db_wait_seconds.observe(waited)
+        self.db_seconds.observe(elapsed, operation)
+
+    def request(self):
+        if not self.enabled:
+            return None
+        return InstrumentedRequest(self, connection_pool_size=CONNECTION_POOL_SIZE)
+
+    def render(self):
+        return self.registry.render()
+
+    # Короткая сводка для админ-панели
+    def summary(self, activity=None):
+        ms = 1000
+        uptime = int(time.monotonic() - self.started)
+        handlers = self.handler_seconds
+        lines = [
+            f"📈 Метрики за {uptime // 3600} ч {uptime % 3600 // 60} мин:\n",
+            f"⚙️ Обработчики: {handlers.count()} вызовов, p50 {handlers.quantile(0.5) * ms:.0f} мс, "
+            f"p95 {handlers.quantile(0.95) * ms:.0f} мс, ошибок {handlers.count(outcome='error')}",
+        ]
+        slowest = sorted(
+            {labels[0] for labels in handlers.series},
+            key=lambda name: handlers.quantile(0.95, handler=name), reverse=True
+        )[:3]
+        for name in slowest:
+            lines.append(f"• {name}: p95 {handlers.quantile(0.95, handler=name) * ms:.0f} мс")
+        lines.append(
+            f"🗄 База: {self.db_seconds.count()} запросов, p95 {self.db_seconds.quantile(0.95) * ms:.1f} мс, "
+            f"ожидание p95 {self.db_wait_seconds.quantile(0.95) * ms:.1f} мс"
+        )
+        lines.append(
+            f"🌐 Telegram API: {self.api_seconds.count()} запросов, p95 {self.api_seconds.quantile(0.95) * ms:.0f} мс, "
+            f"429: {self.api_responses.total(code='429')}"
+        )
+        lines.append(
+            f"📩 Рассылки: доставлено {self.broadcast_messages.total(result='sent')}, "
+            f"не доставлено {self.broadcast_messages.total(result='failed') + self.broadcast_messages.total(result='blocked')}"
+        )
+        if activity is not None:
+            stats = activity.metrics()
+            lines.append(
+                f"👣 Активность: в очереди {stats['queue_depth']}, сбросов {stats['flushes']}, "
+                f"сброс в среднем {stats['avg_flush_ms']:.1f} мс, максимум {stats['max_flush_ms']:.1f} мс"
+            )
+        return '\n'.join(lines)
+
+
+# Локальный HTTP-эндпоинт /metrics для Prometheus
+class MetricsServer:
+    def __init__(self, metrics, listen='127.0.0.1', port=9101, path='/metrics'):
+        self.metrics = metrics
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self._runner = None
+
+    async def handle(self, request):
+        return web.Response(text=self.metrics.render(), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Метрики доступны на http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
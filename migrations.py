@@ -0,0 +1,304 @@
+import logging
+import sqlite3
+
+from stats import STATS_SCHEMA, BACKFILL
+from search import SEARCH_SCHEMA, SEARCH_PHONE, SEARCH_BACKFILL
+
+logger = logging.getLogger(__name__)
+
+# Миграции схемы. Текущая версия хранится в PRAGMA user_version,
+# каждая миграция выполняется один раз в своей транзакции.
+# Новые изменения схемы добавляются только новой функцией в конец MIGRATIONS.
+
+
+# Выполняет SQL-скрипт по одному оператору внутри текущей транзакции
+# (executescript сам делает COMMIT, поэтому в миграциях не используется)
+def execute_script(conn, script):
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+    if statement.strip():
+        conn.execute(statement)
+
+
+def add_column_if_missing(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+# 1. Исходная схема. IF NOT EXISTS — чтобы базы, созданные до миграций, приняли версию 1
+def initial_schema(conn):
+    execute_script(conn, '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        phone TEXT,
+        company TEXT,
+        request TEXT,
+        registration_date TEXT,
+        is_active INTEGER DEFAULT 1,
+        last_activity TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS admins (
+        admin_id INTEGER PRIMARY KEY,
+        username TEXT,
+        full_name TEXT,
+        is_superadmin INTEGER DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_chat_id INTEGER,
+        audience TEXT,
+        text TEXT,
+        photo TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at TEXT,
+        scheduled_at TEXT,
+        finished_at TEXT,
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        blocked INTEGER DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        broadcast_id INTEGER,
+        user_id INTEGER,
+        status TEXT DEFAULT 'pending',
+        error TEXT,
+        updated_at TEXT,
+        PRIMARY KEY (broadcast_id, user_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_deliveries_status
+    ON broadcast_deliveries (broadcast_id, status);
+    ''')
+
+    # Базы, созданные до появления отложенных рассылок
+    add_column_if_missing(conn, 'broadcasts', 'scheduled_at', 'TEXT')
+
+    # Индекс расписания: ближайшие рассылки берутся без сканирования таблицы
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_schedule ON broadcasts (status, scheduled_at)')
+
+    # Счётчики статистики и дневные срезы, которые ведут триггеры
+    execute_script(conn, STATS_SCHEMA)
+    if conn.execute('SELECT COUNT(*) FROM stats_counters').fetchone()[0] == 0:
+        execute_script(conn, BACKFILL)
+
+
+# 2. Индексы под выборку получателей рассылки и проверки ролей.
+# Даты хранятся как 'YYYY-MM-DD HH:MM:SS' и сравниваются как строки,
+# поэтому условия вида registration_date >= ? идут по индексу диапазоном.
+def users_admins_indexes(conn):
+    execute_script(conn, '''
+    CREATE INDEX IF NOT EXISTS idx_users_active_registration
+    ON users (is_active, registration_date);
+
+    CREATE INDEX IF NOT EXISTS idx_users_registration
+    ON users (registration_date);
+
+    CREATE INDEX IF NOT EXISTS idx_admins_superadmin
+    ON admins (is_superadmin);
+    ''')
+    conn.execute('ANALYZE')
+
+
+# 3. Очередь уведомлений менеджерам о новых заявках
+def manager_notifications(conn):
+    execute_script(conn, '''
+    CREATE TABLE IF NOT EXISTS notifications (
+        notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        reply_markup TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TEXT,
+        next_attempt_at TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_notifications_pending
+    ON notifications (status, next_attempt_at);
+    ''')
+
+
+# 4. Состояние диалогов и user_data, переживающее перезапуск (persistence.py)
+def conversation_persistence(conn):
+    execute_script(conn, '''
+    CREATE TABLE IF NOT EXISTS persistence_user_data (
+        user_id INTEGER PRIMARY KEY,
+        data BLOB NOT NULL,
+        updated_at TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS persistence_conversations (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        state BLOB NOT NULL,
+        updated_at TEXT,
+        PRIMARY KEY (name, key)
+    );
+    ''')
+
+
+# 5. Содержимое рассылки целиком (payload.py): форматирование, вложения, альбомы
+def broadcast_payload(conn):
+    add_column_if_missing(conn, 'broadcasts', 'payload', 'TEXT')
+
+
+# 6. Индексы под условия сегментов (segments.py) и потоковое чтение получателей:
+# ожидающие доставки выбираются по (broadcast_id, status) в порядке user_id,
+# поэтому старый индекс (broadcast_id, status) становится лишним
+def segment_indexes(conn):
+    execute_script(conn, '''
+    CREATE INDEX IF NOT EXISTS idx_users_active_activity
+    ON users (is_active, last_activity);
+
+    CREATE INDEX IF NOT EXISTS idx_users_company
+    ON users (company COLLATE NOCASE);
+
+    CREATE INDEX IF NOT EXISTS idx_deliveries_user_sent
+    ON broadcast_deliveries (user_id, updated_at) WHERE status = 'sent';
+
+    CREATE INDEX IF NOT EXISTS idx_deliveries_pending
+    ON broadcast_deliveries (broadcast_id, status, user_id);
+
+    DROP INDEX IF EXISTS idx_deliveries_status;
+    ''')
+    conn.execute('ANALYZE')
+
+
+# 7. Полнотекстовый поиск заявок (search.py): телефон в нормализованном виде —
+# виртуальный столбец, он не занимает места и всегда совпадает с phone
+def lead_search(conn):
+    add_column_if_missing(conn, 'users', 'search_phone', f'TEXT GENERATED ALWAYS AS ({SEARCH_PHONE}) VIRTUAL')
+    execute_script(conn, SEARCH_SCHEMA)
+    execute_script(conn, SEARCH_BACKFILL)
+
+
+# 8. История заявок (leads.py): одна строка на каждую завершённую анкету.
+# В существующих базах известна только последняя заявка — переносим её,
+# датой считаем последнюю активность
+def lead_history(conn):
+    execute_script(conn, '''
+    CREATE TABLE IF NOT EXISTS leads (
+        lead_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users (user_id),
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        phone TEXT,
+        company TEXT,
+        request TEXT,
+        created_at TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_leads_user
+    ON leads (user_id, lead_id);
+
+    INSERT INTO leads (user_id, username, first_name, last_name, phone, company, request, created_at)
+    SELECT user_id, username, first_name, last_name, phone, company, request,
+           COALESCE(last_activity, registration_date, datetime('now', 'localtime'))
+    FROM users
+    WHERE request IS NOT NULL
+    ORDER BY COALESCE(last_activity, registration_date), user_id;
+    ''')
+
+
+# 9. Порции рассылок для воркеров (chunks.py): аренда порции до lease_until (unix-время)
+def broadcast_chunks(conn):
+    execute_script(conn, '''
+    CREATE TABLE IF NOT EXISTS broadcast_chunks (
+        chunk_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        broadcast_id INTEGER NOT NULL REFERENCES broadcasts (broadcast_id),
+        first_user_id INTEGER NOT NULL,
+        last_user_id INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',
+        worker TEXT,
+        lease_until REAL,
+        attempts INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_chunks_claim
+    ON broadcast_chunks (status, lease_until);
+
+    CREATE INDEX IF NOT EXISTS idx_chunks_broadcast
+    ON broadcast_chunks (broadcast_id, status);
+    ''')
+
+
+# 10. Выгрузки изменений (export.py): отметка каждого админа и индекс по last_activity,
+# чтобы выгрузка читала только изменившиеся строки
+def delta_exports(conn):
+    execute_script(conn, '''
+    CREATE TABLE IF NOT EXISTS export_marks (
+        admin_id INTEGER PRIMARY KEY,
+        exported_until TEXT,
+        daily_format TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_users_activity
+    ON users (last_activity);
+    ''')
+
+
+MIGRATIONS = [
+    initial_schema,
+    users_admins_indexes,
+    manager_notifications,
+    conversation_persistence,
+    broadcast_payload,
+    segment_indexes,
+    lead_search,
+    lead_history,
+    broadcast_chunks,
+    delta_exports,
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+# Доводит схему до последней версии (или до target).
+# Бот, воркеры рассылок и retention.py мигрируют базу при старте и могут стартовать
+# одновременно. Каждый шаг идёт в BEGIN IMMEDIATE, а версия перечитывается уже внутри
+# транзакции: второй процесс ждёт первого и не применяет тот же шаг повторно
+# (lead_history копирует историю заявок и при повторе задвоил бы её).
+# Ожидание блокировки на время миграции дольше обычного — перестройка индекса
+# поиска на большой базе идёт дольше busy_timeout соединения
+MIGRATION_BUSY_TIMEOUT = 600_000
+
+
+def migrate(conn, target=None):
+    target = len(MIGRATIONS) if target is None else target
+    busy_timeout = conn.execute('PRAGMA busy_timeout').fetchone()[0]
+    conn.execute(f'PRAGMA busy_timeout = {MIGRATION_BUSY_TIMEOUT}')
+    try:
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = schema_version(conn)
+                if version >= target:
+                    conn.rollback()
+                    return version
+                number, migration = version + 1, MIGRATIONS[version]
+                logger.info(f"Миграция базы {number}: {migration.__name__}")
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        conn.execute(f'PRAGMA busy_timeout = {busy_timeout}')
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import RetryAfter
+
+from broadcast import classify_error, TRANSIENT
+from database import now_str
+
+logger = logging.getLogger(__name__)
+
+PENDING, SENT, FAILED = 'pending', 'sent', 'failed'
+
+# Повторы с экспоненциальной задержкой: 2, 4, 8, 16 ... секунд. Повторяются только временные
+# ошибки (сеть, таймаут); заблокировавший бота менеджер или отклонённое сообщение — сразу failed
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 2
+BACKOFF_MAX = 300
+
+
+def backoff(attempts):
+    return min(BACKOFF_MAX, BACKOFF_BASE ** attempts)
+
+
+# Уведомления менеджерам: сначала сохраняются в базу, затем рассылаются в фоне
+# всем менеджерам параллельно через общий ограничитель скорости.
+# Неотправленные после перезапуска подхватываются из таблицы notifications.
+class ManagerNotifier:
+    def __init__(self, db, limiter):
+        self.db = db
+        self.limiter = limiter
+
+    async def enqueue(self, chat_ids, text, reply_markup=None):
+        markup = json.dumps(reply_markup.to_dict()) if reply_markup else None
+        created_at = now_str()
+
+        def enqueue(conn):
+            with conn:
+                return [
+                    conn.execute(
+                        'INSERT INTO notifications (chat_id, text, reply_markup, status, created_at, next_attempt_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?) RETURNING notification_id',
+                        (chat_id, text, markup, PENDING, created_at, created_at)
+                    ).fetchone()[0]
+                    for chat_id in chat_ids
+                ]
+        return await self.db.run(enqueue)
+
+    async def dispatch(self, bot, notification_ids):
+        if not notification_ids:
+            return
+        placeholders = ', '.join('?' * len(notification_ids))
+        rows = await self.db.fetchall(
+            f'SELECT * FROM notifications WHERE notification_id IN ({placeholders}) AND status = ?',
+            (*notification_ids, PENDING)
+        )
+        await asyncio.gather(*(self._deliver(bot, row) for row in rows))
+
+    async def _deliver(self, bot, row):
+        notification_id = row['notification_id']
+        attempts = row['attempts']
+        reply_markup = InlineKeyboardMarkup.de_json(json.loads(row['reply_markup']), bot) if row['reply_markup'] else None
+
+        # Если уведомление уже ждало повтора до перезапуска — выдерживаем оставшуюся паузу
+        delay = (datetime.strptime(row['next_attempt_at'], '%Y-%m-%d %H:%M:%S') - datetime.now()).total_seconds()
+        while True:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.limiter.acquire(row['chat_id'])
+            try:
+                await bot.send_message(chat_id=row['chat_id'], text=row['text'], reply_markup=reply_markup)
+            except RetryAfter as e:
+                # Флуд-контроль — не ошибка менеджера, попытку не засчитываем
+                self.limiter.on_retry_after(e.retry_after)
+                delay = 0
+                continue
+            except Exception as e:
+                attempts += 1
+                logger.error(f"Ошибка отправки уведомления менеджеру {row['chat_id']} (попытка {attempts}): {e}")
+                if classify_error(e) != TRANSIENT or attempts >= MAX_ATTEMPTS:
+                    await self._update(notification_id, FAILED, attempts, str(e))
+                    return
+                delay = backoff(attempts)
+                await self._update(notification_id, PENDING, attempts, str(e), delay)
+                continue
+            self.limiter.on_success()
+            await self._update(notification_id, SENT, attempts + 1)
+            return
+
+    async def _update(self, notification_id, status, attempts, error=None, delay=0):
+        next_attempt_at = (datetime.now() + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S')
+        await self.db.execute(
+            'UPDATE notifications SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ? '
+            'WHERE notification_id = ?',
+            (status, attempts, error, next_attempt_at, notification_id)
+        )
+
+    # Подхватываем уведомления, не доставленные до перезапуска
+    async def resume(self, bot):
+        rows = await self.db.fetchall(
+            'SELECT notification_id FROM notifications WHERE status = ? ORDER BY next_attempt_at',
+            (PENDING,)
+        )
+        if rows:
+            logger.info(f"Возобновляем отправку уведомлений менеджерам: {len(rows)}")
+            await self.dispatch(bot, [row[0] for row in rows])
@@ -0,0 +1,159 @@
+import html
+import json
+import re
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+from telegram.constants import ParseMode
+
+# Содержимое рассылки хранится в broadcasts.payload как JSON:
+# {'kind': 'text' | 'photo' | 'video' | 'document' | 'animation' | 'album',
+#  'text': текст или подпись, 'parse_mode': 'HTML' или None,
+#  'media': [{'type': ..., 'file_id': ...}, ...]}
+# Файлы не перезакачиваются: в рассылке используется file_id,
+# который Telegram выдал, когда админ прислал сообщение боту.
+
+TEXT, PHOTO, VIDEO, DOCUMENT, ANIMATION, ALBUM = 'text', 'photo', 'video', 'document', 'animation', 'album'
+
+# Ограничения Telegram
+MAX_TEXT = 4096
+MAX_CAPTION = 1024
+MAX_ALBUM = 10
+
+# Кнопка под каждым сообщением рассылки
+BROADCAST_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Написать Александру", url="https://t.me/username")]
+])
+
+ALBUM_MEDIA = {
+    PHOTO: InputMediaPhoto,
+    VIDEO: InputMediaVideo,
+    DOCUMENT: InputMediaDocument,
+}
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def text_payload(text, parse_mode=None):
+    return validate({'kind': TEXT, 'text': text, 'parse_mode': parse_mode, 'media': []})
+
+
+# Вложение из сообщения админа: самое большое фото, видео, документ или GIF
+def media_item(message):
+    if message.photo:
+        return {'type': PHOTO, 'file_id': message.photo[-1].file_id}
+    if message.animation:
+        return {'type': ANIMATION, 'file_id': message.animation.file_id}
+    if message.video:
+        return {'type': VIDEO, 'file_id': message.video.file_id}
+    if message.document:
+        return {'type': DOCUMENT, 'file_id': message.document.file_id}
+    return None
+
+
+# Одиночное сообщение. Форматирование (жирный, ссылки и т.д.) сохраняется через HTML
+def compile_message(message):
+    item = media_item(message)
+    if item is None:
+        return validate({'kind': TEXT, 'text': message.text_html, 'parse_mode': ParseMode.HTML, 'media': []})
+    caption = message.caption_html if message.caption else ''
+    return validate({'kind': item['type'], 'text': caption, 'parse_mode': ParseMode.HTML, 'media': [item]})
+
+
+# Альбом приходит несколькими сообщениями с общим media_group_id — копим их части
+def album_part(message):
+    return {
+        'message_id': message.message_id,
+        'media': media_item(message),
+        'caption': message.caption_html if message.caption else '',
+    }
+
+
+# Подпись альбома — первая непустая подпись его частей
+def compile_album(parts):
+    parts = sorted(parts, key=lambda part: part['message_id'])
+    caption = next((part['caption'] for part in parts if part['caption']), '')
+    media = [part['media'] for part in parts]
+    return validate({'kind': ALBUM, 'text': caption, 'parse_mode': ParseMode.HTML, 'media': media})
+
+
+_TAG = re.compile(r'<[^>]*>')
+
+
+# Длина текста так, как её считает Telegram: после разбора разметки.
+# Теги и экранирование HTML в лимиты MAX_TEXT и MAX_CAPTION не входят
+def visible_length(text, parse_mode):
+    if parse_mode == ParseMode.HTML:
+        return len(html.unescape(_TAG.sub('', text)))
+    return len(text)
+
+
+def validate(payload):
+    kind, text, media = payload['kind'], payload['text'] or '', payload['media']
+    length = visible_length(text, payload['parse_mode'])
+    if kind == TEXT:
+        if not text.strip():
+            raise PayloadError("Сообщение пустое")
+        if length > MAX_TEXT:
+            raise PayloadError(f"Текст длиннее {MAX_TEXT} символов")
+        return payload
+    if length > MAX_CAPTION:
+        raise PayloadError(f"Подпись к вложению длиннее {MAX_CAPTION} символов")
+    if kind != ALBUM:
+        return payload
+    if not 2 <= len(media) <= MAX_ALBUM:
+        raise PayloadError(f"В альбоме должно быть от 2 до {MAX_ALBUM} вложений")
+    types = {item['type'] if item else None for item in media}
+    if not types <= set(ALBUM_MEDIA):
+        raise PayloadError("В альбом можно добавить только фото, видео и документы")
+    if DOCUMENT in types and len(types) > 1:
+        raise PayloadError("Документы нельзя смешивать в альбоме с фото и видео")
+    return payload
+
+
+def dumps(payload):
+    return json.dumps(payload, ensure_ascii=False)
+
+
+# Содержимое задания рассылки; задания, созданные до появления payload, хранят text и photo
+def load(job):
+    if job['payload']:
+        return json.loads(job['payload'])
+    if job['photo']:
+        return {'kind': PHOTO, 'text': job['text'], 'parse_mode': None,
+                'media': [{'type': PHOTO, 'file_id': job['photo']}]}
+    return {'kind': TEXT, 'text': job['text'], 'parse_mode': None, 'media': []}
+
+
+# Сообщение, собранное один раз на всю рассылку: метод и все параметры готовы,
+# для каждого получателя подставляется только chat_id.
+# У альбомов Telegram не поддерживает кнопки, reply_markup к ним не добавляется
+class CompiledPayload:
+    def __init__(self, payload, bot, reply_markup=None):
+        self.payload = payload
+        kind, text, parse_mode = payload['kind'], payload['text'], payload['parse_mode']
+        if kind == TEXT:
+            self._send = bot.send_message
+            self._kwargs = {'text': text, 'parse_mode': parse_mode, 'reply_markup': reply_markup}
+        elif kind == ALBUM:
+            self._send = bot.send_media_group
+            self._kwargs = {'media': [
+                ALBUM_MEDIA[item['type']](
+                    item['file_id'],
+                    caption=text if index == 0 and text else None,
+                    parse_mode=parse_mode if index == 0 and text else None,
+                )
+                for index, item in enumerate(payload['media'])
+            ]}
+        else:
+            self._send = getattr(bot, f'send_{kind}')
+            self._kwargs = {
+                kind: payload['media'][0]['file_id'],
+                'caption': text or None,
+                'parse_mode': parse_mode if text else None,
+                'reply_markup': reply_markup,
+            }
+
+    async def send(self, chat_id):
+        return await self._send(chat_id=chat_id, **self._kwargs)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import now_str
+
+logger = logging.getLogger(__name__)
+
+# Как часто приложение передаёт изменения user_data и состояний диалогов, секунд
+UPDATE_INTERVAL = 5
+
+
+def dump(value):
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# Хранение user_data и состояний ConversationHandler в SQLite, чтобы незаконченные
+# заявки и черновики рассылок переживали перезапуск бота.
+# Запись отложенная: изменения копятся в памяти и пишутся пачкой в одной транзакции.
+# Для каждой записи помним последний сохранённый снимок — неизменившиеся данные не пишем.
+class SQLitePersistence(BasePersistence):
+    def __init__(self, db, update_interval=UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self._user_snapshots = {}
+        self._conversation_snapshots = {}
+        self._dirty_users = {}
+        self._dirty_conversations = {}
+        self._flushing = None
+        # Метрики
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.skipped = 0
+
+    async def get_user_data(self):
+        rows = await self.db.fetchall('SELECT user_id, data FROM persistence_user_data')
+        user_data = {}
+        for row in rows:
+            self._user_snapshots[row['user_id']] = row['data']
+            user_data[row['user_id']] = pickle.loads(row['data'])
+        return user_data
+
+    async def get_conversations(self, name):
+        rows = await self.db.fetchall(
+            'SELECT key, state FROM persistence_conversations WHERE name = ?', (name,)
+        )
+        conversations = {}
+        for row in rows:
+            key = tuple(json.loads(row['key']))
+            self._conversation_snapshots[(name, key)] = row['state']
+            conversations[key] = pickle.loads(row['state'])
+        return conversations
+
+    async def update_user_data(self, user_id, data):
+        snapshot = dump(data)
+        if self._user_snapshots.get(user_id) == snapshot:
+            self.skipped += 1
+            return
+        self._user_snapshots[user_id] = snapshot
+        self._dirty_users[user_id] = snapshot
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        if self._user_snapshots.pop(user_id, None) is None and user_id not in self._dirty_users:
+            return
+        self._dirty_users[user_id] = None
+        self._schedule_flush()
+
+    async def update_conversation(self, name, key, new_state):
+        snapshot = None if new_state is None else dump(new_state)
+        if self._conversation_snapshots.get((name, key)) == snapshot:
+            self.skipped += 1
+            return
+        if snapshot is None:
+            self._conversation_snapshots.pop((name, key), None)
+        else:
+            self._conversation_snapshots[(name, key)] = snapshot
+        self._dirty_conversations[(name, key)] = snapshot
+        self._schedule_flush()
+
+    # Приложение вызывает update_* для всех изменений разом — собираем их
+    # и пишем одной транзакцией на следующей итерации цикла
+    def _schedule_flush(self):
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        try:
+            await self._write()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния диалогов: {e}")
+
+    async def _write(self):
+        if not self._dirty_users and not self._dirty_conversations:
+            return
+        users, self._dirty_users = self._dirty_users, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        updated_at = now_str()
+
+        def write(conn):
+            with conn:
+                conn.executemany(
+                    'INSERT INTO persistence_user_data (user_id, data, updated_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                    [(user_id, data, updated_at) for user_id, data in users.items() if data is not None]
+                )
+                conn.executemany(
+                    'DELETE FROM persistence_user_data WHERE user_id = ?',
+                    [(user_id,) for user_id, data in users.items() if data is None]
+                )
+                conn.executemany(
+                    'INSERT INTO persistence_conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at',
+                    [(name, json.dumps(key), state, updated_at)
+                     for (name, key), state in conversations.items() if state is not None]
+                )
+                conn.executemany(
+                    'DELETE FROM persistence_conversations WHERE name = ? AND key = ?',
+                    [(name, json.dumps(key)) for (name, key), state in conversations.items() if state is None]
+                )
+
+        try:
+            await self.db.run(write)
+        except Exception:
+            # Не теряем изменения: вернём в очередь всё, что не перезаписано более свежим
+            for user_id, data in users.items():
+                self._dirty_users.setdefault(user_id, data)
+            for key, state in conversations.items():
+                self._dirty_conversations.setdefault(key, state)
+            raise
+        self.flushes += 1
+        self.rows_flushed += len(users) + len(conversations)
+
+    # Вызывается при остановке приложения: дописываем всё, что осталось
+    async def flush(self):
+        if self._flushing and not self._flushing.done():
+            await asyncio.wait([self._flushing])
+        await self._write()
+        logger.info(f"Состояние диалогов сохранено: записей {self.rows_flushed}, "
+                    f"без изменений пропущено {self.skipped}")
+
+    # chat_data, bot_data и callback_data бот не использует
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
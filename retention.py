@@ -0,0 +1,389 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from broadcast_queue import JOB_DONE
+from database import Database, now_str, days_ago
+from migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+# Хранение данных: рабочая база содержит только то, с чем бот работает каждый день.
+# В архивную базу переезжают:
+#   * пользователи, заблокировавшие бота (is_active = 0, broadcast_queue.py) и не появлявшиеся
+#     USERS_DAYS дней, — вместе с историей заявок (leads ссылается на users);
+#   * результаты доставки рассылок, завершённых больше DELIVERIES_DAYS дней назад.
+#     Сама рассылка со счётчиками остаётся в рабочей базе, её порции (chunks.py) удаляются.
+# Рассылки, поиск и выгрузки архивных не видят. Вернувшийся в бота пользователь
+# регистрируется заново, прежняя анкета остаётся в архиве.
+#
+# Перенос идёт пачками по BATCH_SIZE строк. Каждая пачка берёт запись в рабочую базу
+# (BEGIN IMMEDIATE), сначала коммитит копию в архив и только потом удаляет строки:
+# после сбоя между коммитами повторный запуск перезапишет ту же копию (INSERT OR REPLACE),
+# строки не теряются. Бот ждёт базу не дольше одной пачки.
+#
+# После переноса освободившиеся страницы возвращаются системе через incremental_vacuum
+# небольшими шагами, затем PRAGMA optimize. В отчёте — размер базы и время типовых
+# запросов до и после.
+#
+# База, созданная до включения auto_vacuum = INCREMENTAL, переводится на него только
+# полным VACUUM. Он держит базу всё время работы и требует свободного места на диске
+# размером с базу, поэтому выполняется только вручную, при остановленном боте (--full-vacuum).
+# До этого освободившиеся страницы переиспользуются, но файл не уменьшается.
+#
+#   python retention.py --db consultations.db --archive consultations_archive.db [--full-vacuum]
+
+USERS_DAYS = 180
+# Должно быть больше самого длинного окна сегментов рассылки (segments.py, received_days)
+DELIVERIES_DAYS = 60
+BATCH_SIZE = 1000
+# Страниц за один шаг incremental_vacuum
+VACUUM_PAGES = 2000
+
+USER_COLUMNS = (
+    'user_id', 'username', 'first_name', 'last_name', 'phone', 'company', 'request',
+    'registration_date', 'is_active', 'last_activity',
+)
+LEAD_COLUMNS = (
+    'lead_id', 'user_id', 'username', 'first_name', 'last_name', 'phone', 'company', 'request', 'created_at',
+)
+BROADCAST_COLUMNS = (
+    'broadcast_id', 'admin_chat_id', 'audience', 'text', 'photo', 'payload', 'status',
+    'created_at', 'scheduled_at', 'finished_at', 'total', 'sent', 'failed', 'blocked',
+)
+DELIVERY_COLUMNS = ('broadcast_id', 'user_id', 'status', 'error', 'updated_at')
+
+ARCHIVE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    phone TEXT,
+    company TEXT,
+    request TEXT,
+    registration_date TEXT,
+    is_active INTEGER,
+    last_activity TEXT,
+    archived_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS leads (
+    lead_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    phone TEXT,
+    company TEXT,
+    request TEXT,
+    created_at TEXT NOT NULL,
+    archived_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_leads_user ON leads (user_id, lead_id);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    broadcast_id INTEGER PRIMARY KEY,
+    admin_chat_id INTEGER,
+    audience TEXT,
+    text TEXT,
+    photo TEXT,
+    payload TEXT,
+    status TEXT,
+    created_at TEXT,
+    scheduled_at TEXT,
+    finished_at TEXT,
+    total INTEGER,
+    sent INTEGER,
+    failed INTEGER,
+    blocked INTEGER,
+    archived_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+    broadcast_id INTEGER,
+    user_id INTEGER,
+    status TEXT,
+    error TEXT,
+    updated_at TEXT,
+    archived_at TEXT NOT NULL,
+    PRIMARY KEY (broadcast_id, user_id)
+);
+'''
+
+# Типовые запросы для отчёта: проход по users, как у выгрузки, аудитория рассылки
+# и проход по результатам доставки
+PROBES = (
+    ('выгрузка (проход по users)', "SELECT COUNT(*), SUM(LENGTH(COALESCE(request, ''))) FROM users"),
+    ('аудитория рассылки', 'SELECT COUNT(*) FROM users WHERE is_active = 1'),
+    ('результаты рассылок', "SELECT COUNT(*), SUM(status = 'sent') FROM broadcast_deliveries"),
+)
+PROBE_RUNS = 3
+
+
+def format_size(size):
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+def _file_size(path):
+    return sum(os.path.getsize(name) for name in (path, f'{path}-wal') if os.path.exists(name))
+
+
+def _copy(archive, table, columns, rows, archived_at):
+    archive.executemany(
+        f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}, archived_at) '
+        f'VALUES ({", ".join("?" * (len(columns) + 1))})',
+        [tuple(row) + (archived_at,) for row in rows]
+    )
+
+
+class Retention:
+    def __init__(self, db, archive_path, users_days=USERS_DAYS, deliveries_days=DELIVERIES_DAYS,
+                 batch_size=BATCH_SIZE, full_vacuum=False):
+        self.db = db
+        self.archive_path = archive_path
+        self.users_days = users_days
+        self.deliveries_days = deliveries_days
+        self.batch_size = batch_size
+        self.full_vacuum = full_vacuum
+        # Соединение с архивом живёт в потоке базы только на время run()
+        self._archive = None
+
+    async def run(self):
+        started = time.perf_counter()
+        before = await self.db.run(self._measure)
+        await self.db.run(self._open_archive)
+        try:
+            users, leads = await self._archive_users()
+            deliveries = await self._archive_deliveries()
+        finally:
+            await self.db.run(self._close_archive)
+        incremental = await self.vacuum()
+        after = await self.db.run(self._measure)
+        report = {
+            'users': users,
+            'leads': leads,
+            'deliveries': deliveries,
+            'before': before,
+            'after': after,
+            'archive_size': _file_size(self.archive_path),
+            'incremental': incremental,
+            'elapsed': time.perf_counter() - started,
+        }
+        logger.info(f"Обслуживание базы: в архив перенесено пользователей {users}, заявок {leads}, "
+                    f"результатов рассылок {deliveries}; размер {format_size(before['size'])} -> "
+                    f"{format_size(after['size'])}")
+        return report
+
+    async def _archive_users(self):
+        cutoff = days_ago(self.users_days)
+        users = leads = 0
+        while True:
+            moved_users, moved_leads = await self.db.run(self._move_users, cutoff)
+            users += moved_users
+            leads += moved_leads
+            if moved_users < self.batch_size:
+                return users, leads
+
+    async def _archive_deliveries(self):
+        moved = 0
+        for broadcast_id in await self.db.run(self._stale_broadcasts, days_ago(self.deliveries_days)):
+            while True:
+                count = await self.db.run(self._move_deliveries, broadcast_id)
+                moved += count
+                if count < self.batch_size:
+                    break
+        return moved
+
+    # Возвращает системе освободившиеся страницы. False — база ещё без auto_vacuum = INCREMENTAL
+    # и полный VACUUM не разрешён: incremental_vacuum на ней ничего не делает
+    async def vacuum(self):
+        incremental = await self.db.fetchval('PRAGMA auto_vacuum') == 2
+        if not incremental and self.full_vacuum:
+            logger.warning("База без auto_vacuum = INCREMENTAL: выполняется однократный полный VACUUM")
+            await self.db.run(self._full_vacuum)
+            incremental = True
+        if incremental:
+            while await self.db.run(self._vacuum_step):
+                pass
+        else:
+            logger.warning("База без auto_vacuum = INCREMENTAL: файл не уменьшится до "
+                           "python retention.py --full-vacuum при остановленном боте")
+        await self.db.run(self._optimize)
+        return incremental
+
+    def _open_archive(self, conn):
+        archive = sqlite3.connect(self.archive_path)
+        archive.execute('PRAGMA journal_mode = WAL')
+        archive.executescript(ARCHIVE_SCHEMA)
+        self._archive = archive
+
+    def _close_archive(self, conn):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def _move_users(self, conn, cutoff):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # По индексу (is_active, last_activity)
+            users = conn.execute(
+                f'SELECT {", ".join(USER_COLUMNS)} FROM users '
+                'WHERE is_active = 0 AND last_activity < ? LIMIT ?',
+                (cutoff, self.batch_size)
+            ).fetchall()
+            leads = []
+            if users:
+                ids = json.dumps([row['user_id'] for row in users])
+                leads = conn.execute(
+                    f'SELECT {", ".join(LEAD_COLUMNS)} FROM leads WHERE user_id IN (SELECT value FROM json_each(?))',
+                    (ids,)
+                ).fetchall()
+                archived_at = now_str()
+                with self._archive:
+                    _copy(self._archive, 'users', USER_COLUMNS, users, archived_at)
+                    _copy(self._archive, 'leads', LEAD_COLUMNS, leads, archived_at)
+                conn.execute('DELETE FROM leads WHERE user_id IN (SELECT value FROM json_each(?))', (ids,))
+                # Триггеры сами уберут строки из счётчиков статистики и поискового индекса
+                conn.execute('DELETE FROM users WHERE user_id IN (SELECT value FROM json_each(?))', (ids,))
+                conn.execute(
+                    "INSERT INTO stats_counters (name, value) VALUES ('users_archived', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    (len(users),)
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(users), len(leads)
+
+    # Старые завершённые рассылки, у которых ещё остались результаты доставки или порции
+    def _stale_broadcasts(self, conn, cutoff):
+        return [row[0] for row in conn.execute(
+            'SELECT broadcast_id FROM broadcasts b WHERE status = ? AND finished_at < ? '
+            'AND (EXISTS (SELECT 1 FROM broadcast_deliveries d WHERE d.broadcast_id = b.broadcast_id) '
+            'OR EXISTS (SELECT 1 FROM broadcast_chunks c WHERE c.broadcast_id = b.broadcast_id)) '
+            'ORDER BY broadcast_id',
+            (JOB_DONE, cutoff)
+        )]
+
+    def _move_deliveries(self, conn, broadcast_id):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # По первичному ключу (broadcast_id, user_id)
+            rows = conn.execute(
+                f'SELECT {", ".join(DELIVERY_COLUMNS)} FROM broadcast_deliveries '
+                'WHERE broadcast_id = ? ORDER BY user_id LIMIT ?',
+                (broadcast_id, self.batch_size)
+            ).fetchall()
+            if rows:
+                broadcast = conn.execute(
+                    f'SELECT {", ".join(BROADCAST_COLUMNS)} FROM broadcasts WHERE broadcast_id = ?', (broadcast_id,)
+                ).fetchall()
+                archived_at = now_str()
+                with self._archive:
+                    _copy(self._archive, 'broadcasts', BROADCAST_COLUMNS, broadcast, archived_at)
+                    _copy(self._archive, 'broadcast_deliveries', DELIVERY_COLUMNS, rows, archived_at)
+                conn.execute(
+                    'DELETE FROM broadcast_deliveries WHERE broadcast_id = ? AND user_id <= ?',
+                    (broadcast_id, rows[-1]['user_id'])
+                )
+            # Последняя пачка: порции рассылки больше не нужны
+            if len(rows) < self.batch_size:
+                conn.execute('DELETE FROM broadcast_chunks WHERE broadcast_id = ?', (broadcast_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(rows)
+
+    def _full_vacuum(self, conn):
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+    # Один шаг: True, пока остаются свободные страницы
+    def _vacuum_step(self, conn):
+        # fetchall обязателен: без него sqlite3 освобождает только одну страницу
+        conn.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES})').fetchall()
+        return conn.execute('PRAGMA freelist_count').fetchone()[0] > 0
+
+    def _optimize(self, conn):
+        conn.execute('PRAGMA optimize')
+        # Возвращаем место, занятое журналом WAL
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+
+    def _measure(self, conn):
+        timings = {}
+        for name, sql in PROBES:
+            best = None
+            for _ in range(PROBE_RUNS):
+                started = time.perf_counter()
+                conn.execute(sql).fetchall()
+                elapsed = (time.perf_counter() - started) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        return {
+            'size': _file_size(self.db.path),
+            'users': conn.execute('SELECT COUNT(*) FROM users').fetchone()[0],
+            'deliveries': conn.execute('SELECT COUNT(*) FROM broadcast_deliveries').fetchone()[0],
+            'timings': timings,
+        }
+
+
+def format_report(report):
+    before, after = report['before'], report['after']
+    lines = [
+        "🗄 Обслуживание базы\n",
+        f"В архив перенесено: пользователей {report['users']}, заявок {report['leads']}, "
+        f"результатов рассылок {report['deliveries']}",
+        f"Пользователей в базе: {before['users']} → {after['users']}",
+        f"Результатов рассылок: {before['deliveries']} → {after['deliveries']}",
+        f"Размер базы: {format_size(before['size'])} → {format_size(after['size'])} "
+        f"(архив {format_size(report['archive_size'])})\n",
+        "Время запросов, мс:",
+    ]
+    for name, _ in PROBES:
+        lines.append(f"• {name}: {before['timings'][name]:.1f} → {after['timings'][name]:.1f}")
+    if not report['incremental']:
+        lines.append("\n⚠️ База создана без auto_vacuum, поэтому файл не уменьшился. Один раз выполните "
+                     "python retention.py --full-vacuum при остановленном боте (нужно свободное место "
+                     "на диске размером с базу)")
+    lines.append(f"\nЗаняло {report['elapsed']:.1f} с")
+    return '\n'.join(lines)
+
+
+async def main(args):
+    db = Database(args.db)
+    db.call(migrate)
+    try:
+        report = await Retention(db, args.archive, args.users_days, args.deliveries_days,
+                                 full_vacuum=args.full_vacuum).run()
+        print(format_report(report))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', 'consultations.db'))
+    parser.add_argument('--archive', default=os.environ.get('ARCHIVE_PATH', 'consultations_archive.db'))
+    parser.add_argument('--users-days', type=int, default=USERS_DAYS,
+                        help="через сколько дней без активности переносить заблокировавших бота")
+    parser.add_argument('--deliveries-days', type=int, default=DELIVERIES_DAYS,
+                        help="через сколько дней после рассылки переносить результаты доставки")
+    parser.add_argument('--full-vacuum', action='store_true',
+                        help="однократно перевести старую базу на auto_vacuum = INCREMENTAL (только при остановленном боте)")
+    asyncio.run(main(parser.parse_args()))
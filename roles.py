@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд кэш перечитывается из базы (на случай правок таблицы admins вручную)
+ROLES_TTL = 300
+
+
+# Кэш ролей: проверка прав и список менеджеров — поиск по словарю без обращения к базе.
+# Загружается при старте, обновляется при добавлении админа через бота,
+# а по истечении TTL перечитывается в фоне, не задерживая проверку.
+class RoleCache:
+    def __init__(self, db, ttl=ROLES_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._admins = {}
+        self._managers = ()
+        self._superadmins = ()
+        self._loaded_at = 0.0
+        self._refresh_task = None
+
+    async def load(self):
+        rows = await self.db.fetchall('SELECT admin_id, is_superadmin FROM admins')
+        self._set({row[0]: row[1] == 1 for row in rows})
+        logger.info(f"Загружено администраторов: {len(self._admins)}")
+
+    def _set(self, admins):
+        self._admins = admins
+        self._managers = tuple(admin_id for admin_id, superadmin in admins.items() if not superadmin)
+        self._superadmins = tuple(admin_id for admin_id, superadmin in admins.items() if superadmin)
+        self._loaded_at = time.monotonic()
+
+    async def _refresh(self):
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Не удалось обновить кэш администраторов: {e}")
+
+    def _check_ttl(self):
+        if time.monotonic() - self._loaded_at < self.ttl:
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+
+    def is_admin(self, user_id):
+        self._check_ttl()
+        return user_id in self._admins
+
+    def is_superadmin(self, user_id):
+        self._check_ttl()
+        return self._admins.get(user_id, False)
+
+    def managers(self):
+        self._check_ttl()
+        return self._managers
+
+    def superadmins(self):
+        self._check_ttl()
+        return self._superadmins
+
+    # Добавляет админа в базу и сразу в кэш. Права суперадмина у существующей записи сохраняются.
+    # Права added_by проверяются по базе в том же запросе, а не по кэшу:
+    # без прав суперадмина ничего не пишется и возвращается False
+    async def add_admin(self, admin_id, username, full_name, added_by):
+        added = await self.db.execute('''
+        INSERT INTO admins (admin_id, username, full_name)
+        SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM admins WHERE admin_id = ? AND is_superadmin = 1)
+        ON CONFLICT(admin_id) DO UPDATE SET username = excluded.username, full_name = excluded.full_name
+        ''', (admin_id, username, full_name, added_by))
+        if not added:
+            logger.warning(f"Отказано в добавлении админа {admin_id}: у {added_by} нет прав суперадмина")
+            return False
+        admins = dict(self._admins)
+        admins.setdefault(admin_id, False)
+        self._set(admins)
+        return True
@@ -0,0 +1,149 @@
+import re
+
+# Поиск заявок: полнотекстовый индекс FTS5 по имени, фамилии, компании, запросу и телефону.
+# Индекс ссылается на таблицу users (external content) и хранит только словарь,
+# сами строки читаются из users. Синхронизацию держат триггеры, так что поиск
+# никогда не сканирует таблицу целиком.
+#
+# Телефон индексируется только цифрами, российские номера — в двух вариантах:
+# с кодом страны (79991234567, 8 заменяется на 7) и без него (9991234567),
+# чтобы находились любые варианты записи: +7 (999) 123-45-67, 8 999 ..., 999 ...
+
+PAGE_SIZE = 10
+
+# Веса столбцов в ранжировании bm25: совпадение по телефону и компании важнее, чем в тексте запроса
+WEIGHTS = (2.0, 2.0, 3.0, 1.0, 5.0)
+
+_DIGITS = "replace(replace(replace(replace(replace(replace(phone, ' ', ''), '-', ''), '(', ''), ')', ''), '+', ''), '.', '')"
+SEARCH_PHONE = (
+    f"CASE WHEN length({_DIGITS}) = 11 AND substr({_DIGITS}, 1, 1) IN ('7', '8') "
+    f"THEN '7' || substr({_DIGITS}, 2) || ' ' || substr({_DIGITS}, 2) ELSE {_DIGITS} END"
+)
+
+_COLUMNS = 'first_name, last_name, company, request, search_phone'
+
+SEARCH_SCHEMA = f'''
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    {_COLUMNS},
+    content = 'users',
+    content_rowid = 'user_id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS search_users_insert AFTER INSERT ON users
+BEGIN
+    INSERT INTO users_fts (rowid, {_COLUMNS})
+        VALUES (new.user_id, new.first_name, new.last_name, new.company, new.request, new.search_phone);
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_users_update AFTER UPDATE OF first_name, last_name, company, request, phone ON users
+WHEN old.first_name IS NOT new.first_name OR old.last_name IS NOT new.last_name
+    OR old.company IS NOT new.company OR old.request IS NOT new.request OR old.phone IS NOT new.phone
+BEGIN
+    INSERT INTO users_fts (users_fts, rowid, {_COLUMNS})
+        VALUES ('delete', old.user_id, old.first_name, old.last_name, old.company, old.request, old.search_phone);
+    INSERT INTO users_fts (rowid, {_COLUMNS})
+        VALUES (new.user_id, new.first_name, new.last_name, new.company, new.request, new.search_phone);
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_users_delete AFTER DELETE ON users
+BEGIN
+    INSERT INTO users_fts (users_fts, rowid, {_COLUMNS})
+        VALUES ('delete', old.user_id, old.first_name, old.last_name, old.company, old.request, old.search_phone);
+END;
+'''
+
+# Индекс по уже существующим пользователям. Выполняется миграцией вместе с SEARCH_SCHEMA
+SEARCH_BACKFILL = "INSERT INTO users_fts (users_fts) VALUES ('rebuild');"
+
+# Ранжируются только MAX_CANDIDATES последних по дате регистрации совпадений.
+# rowid в индексе — это user_id из Telegram, а не время, поэтому кандидаты отбираются
+# по users.registration_date. bm25 считается только для отобранных строк (фильтр по rowid
+# стоит до сортировки), так что частое слово («ООО», «консультация») не заставляет
+# ранжировать сотни тысяч строк. Унарный плюс в +f.rowid не даёт передать IN в FTS5:
+# иначе индекс заново выполняет MATCH для каждого кандидата (секунды вместо десятков мс).
+# Если совпадений больше, поиск сообщает об этом админу
+MAX_CANDIDATES = 1000
+
+SEARCH_LEADS = f'''
+WITH candidates AS (
+    SELECT f.rowid
+    FROM users_fts f
+    JOIN users u ON u.user_id = f.rowid
+    WHERE users_fts MATCH :query
+    ORDER BY u.registration_date DESC
+    LIMIT {MAX_CANDIDATES}
+)
+SELECT u.user_id, u.username, u.first_name, u.last_name, u.phone, u.company, u.request, u.registration_date
+FROM users_fts f
+JOIN users u ON u.user_id = f.rowid
+WHERE users_fts MATCH :query AND +f.rowid IN candidates
+ORDER BY bm25(users_fts, {', '.join(map(str, WEIGHTS))}), u.registration_date DESC
+LIMIT :limit OFFSET :offset
+'''
+
+# Совпадений больше, чем ранжируется: проход по списку rowid без чтения users
+COUNT_CAPPED = f'''
+SELECT COUNT(*) > {MAX_CANDIDATES}
+FROM (SELECT 1 FROM users_fts WHERE users_fts MATCH ? LIMIT {MAX_CANDIDATES + 1})
+'''
+
+PHONE_RE = re.compile(r'[\d\s+\-().]+')
+
+
+def _quote(token):
+    return '"' + token.replace('"', '""') + '"'
+
+
+# Запрос FTS5 из того, что ввёл админ: номер телефона ищется по столбцу телефона,
+# остальное — как слова (каждое по префиксу, все слова должны совпасть)
+def build_query(text):
+    text = (text or '').strip()
+    digits = re.sub(r'\D', '', text)
+    if PHONE_RE.fullmatch(text) and len(digits) >= 3:
+        variants = [digits]
+        if digits[0] == '8':
+            variants.append('7' + digits[1:])
+        return 'search_phone : (' + ' OR '.join(f'{_quote(variant)}*' for variant in variants) + ')'
+    tokens = re.findall(r'\w+', text)
+    if not tokens:
+        return None
+    return ' '.join(f'{_quote(token)}*' for token in tokens)
+
+
+# Страница результатов, признак, что есть следующая, и признак, что совпадений
+# больше MAX_CANDIDATES и показаны только последние из них
+def search_leads(conn, text, offset=0, limit=PAGE_SIZE):
+    query = build_query(text)
+    if query is None:
+        return [], False, False
+    rows = conn.execute(SEARCH_LEADS, {'query': query, 'limit': limit + 1, 'offset': offset}).fetchall()
+    capped = bool(conn.execute(COUNT_CAPPED, (query,)).fetchone()[0])
+    return rows[:limit], len(rows) > limit, capped
+
+
+def _shorten(text, length=120):
+    text = ' '.join((text or '').split())
+    return text if len(text) <= length else text[:length - 1] + '…'
+
+
+def format_leads(text, rows, offset, elapsed_ms, capped=False):
+    if not rows:
+        if capped:
+            return f"🔎 По запросу «{text}» больше результатов нет. Уточните запрос, чтобы найти более старые заявки."
+        return f"🔎 По запросу «{text}» ничего не найдено."
+    lines = [f"🔎 «{text}»: результаты {offset + 1}–{offset + len(rows)} ({elapsed_ms:.0f} мс)\n"]
+    for number, row in enumerate(rows, start=offset + 1):
+        name = ' '.join(part for part in (row['first_name'], row['last_name']) if part) or '—'
+        username = f" @{row['username']}" if row['username'] else ''
+        lines.append(f"{number}. {name}{username}")
+        lines.append(f"   📱 {row['phone'] or '—'} · 🏢 {row['company'] or '—'}")
+        if row['request']:
+            lines.append(f"   📝 {_shorten(row['request'])}")
+        registered = f" · {row['registration_date']}" if row['registration_date'] else ''
+        lines.append(f"   🆔 {row['user_id']}{registered}")
+    if capped:
+        lines.append(f"\n⚠️ Совпадений больше {MAX_CANDIDATES}: показаны {MAX_CANDIDATES} последних "
+                     "по дате регистрации. Уточните запрос, чтобы найти более старые.")
+    return '\n'.join(lines)
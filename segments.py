@@ -0,0 +1,147 @@
+import json
+
+from database import days_ago
+
+# Сегмент получателей рассылки — словарь условий, которые объединяются через И:
+#   registered_days    — зарегистрировались за последние N дней
+#   active_days        — проявляли активность за последние N дней
+#   inactive_days      — не проявляли активности N дней и больше
+#   completed          — True: заявка заполнена, False: не заполнена
+#   company            — компания (без учёта регистра латиницы)
+#   received_days      — получили хотя бы одну рассылку за N дней
+#   not_received_days  — не получали рассылок N дней (чтобы не надоедать)
+# В broadcasts.audience сегмент хранится как JSON; старые значения 'all' и 'new' тоже понимаются.
+# Каждое условие ложится на свой индекс (миграции 2 и 6), даты сравниваются как строки.
+
+# Варианты для кнопок конструктора: кнопка переключает условие по кругу
+REGISTRATION_OPTIONS = [{}, {'registered_days': 7}, {'registered_days': 30}, {'registered_days': 90}]
+ACTIVITY_OPTIONS = [{}, {'active_days': 7}, {'active_days': 30}, {'inactive_days': 30}, {'inactive_days': 90}]
+REQUEST_OPTIONS = [{}, {'completed': True}, {'completed': False}]
+ENGAGEMENT_OPTIONS = [{}, {'received_days': 30}, {'not_received_days': 7}]
+
+OPTIONS = {
+    'reg': REGISTRATION_OPTIONS,
+    'act': ACTIVITY_OPTIONS,
+    'req': REQUEST_OPTIONS,
+    'bc': ENGAGEMENT_OPTIONS,
+}
+
+
+def load_segment(audience):
+    if audience == 'new':
+        return {'registered_days': 7}
+    if not audience or audience == 'all':
+        return {}
+    return json.loads(audience)
+
+
+def dump_segment(segment):
+    return json.dumps(segment, ensure_ascii=False, sort_keys=True)
+
+
+# Переключает условие группы на следующий вариант
+def cycle_segment(segment, group):
+    options = OPTIONS[group]
+    keys = {key for option in options for key in option}
+    current = {key: segment[key] for key in keys if key in segment}
+    index = options.index(current) if current in options else 0
+    segment = {key: value for key, value in segment.items() if key not in keys}
+    segment.update(options[(index + 1) % len(options)])
+    return segment
+
+
+def set_segment_company(segment, company):
+    segment = dict(segment)
+    company = (company or '').strip()
+    if company and company not in ('-', '—'):
+        segment['company'] = company
+    else:
+        segment.pop('company', None)
+    return segment
+
+
+# WHERE-условие по таблице users и его параметры
+def compile_segment(segment, now=None):
+    conditions = ['is_active = 1']
+    params = []
+    if segment.get('registered_days'):
+        conditions.append('registration_date >= ?')
+        params.append(days_ago(segment['registered_days'], now))
+    if segment.get('active_days'):
+        conditions.append('last_activity >= ?')
+        params.append(days_ago(segment['active_days'], now))
+    if segment.get('inactive_days'):
+        conditions.append('last_activity < ?')
+        params.append(days_ago(segment['inactive_days'], now))
+    if segment.get('completed') is True:
+        conditions.append('request IS NOT NULL')
+    elif segment.get('completed') is False:
+        conditions.append('request IS NULL')
+    if segment.get('company'):
+        conditions.append('company = ? COLLATE NOCASE')
+        params.append(segment['company'])
+    # status = 'sent' — литералом, иначе не используется частичный индекс idx_deliveries_user_sent
+    if segment.get('received_days'):
+        conditions.append(
+            "EXISTS (SELECT 1 FROM broadcast_deliveries d WHERE d.user_id = users.user_id "
+            "AND d.status = 'sent' AND d.updated_at >= ?)"
+        )
+        params.append(days_ago(segment['received_days'], now))
+    if segment.get('not_received_days'):
+        conditions.append(
+            "NOT EXISTS (SELECT 1 FROM broadcast_deliveries d WHERE d.user_id = users.user_id "
+            "AND d.status = 'sent' AND d.updated_at >= ?)"
+        )
+        params.append(days_ago(segment['not_received_days'], now))
+    return ' AND '.join(conditions), tuple(params)
+
+
+# Число получателей для предпросмотра — один COUNT по индексам
+def count_segment(conn, segment):
+    where, params = compile_segment(segment)
+    return conn.execute(f'SELECT COUNT(*) FROM users WHERE {where}', params).fetchone()[0]
+
+
+def describe_segment(segment):
+    parts = []
+    if segment.get('registered_days'):
+        parts.append(f"зарегистрировались за {segment['registered_days']} дн.")
+    if segment.get('active_days'):
+        parts.append(f"активны за {segment['active_days']} дн.")
+    if segment.get('inactive_days'):
+        parts.append(f"неактивны {segment['inactive_days']}+ дн.")
+    if segment.get('completed') is True:
+        parts.append("заявка заполнена")
+    elif segment.get('completed') is False:
+        parts.append("заявка не заполнена")
+    if segment.get('company'):
+        parts.append(f"компания «{segment['company']}»")
+    if segment.get('received_days'):
+        parts.append(f"получали рассылки за {segment['received_days']} дн.")
+    if segment.get('not_received_days'):
+        parts.append(f"без рассылок {segment['not_received_days']}+ дн.")
+    return ', '.join(parts) if parts else "все пользователи"
+
+
+# Подписи кнопок конструктора с текущим значением условия
+def segment_buttons(segment):
+    registration = f"за {segment['registered_days']} дн." if segment.get('registered_days') else "любая"
+    if segment.get('active_days'):
+        activity = f"за {segment['active_days']} дн."
+    elif segment.get('inactive_days'):
+        activity = f"нет {segment['inactive_days']}+ дн."
+    else:
+        activity = "любая"
+    request = {True: "заполнена", False: "не заполнена"}.get(segment.get('completed'), "любая")
+    if segment.get('received_days'):
+        engagement = f"получали за {segment['received_days']} дн."
+    elif segment.get('not_received_days'):
+        engagement = f"не получали {segment['not_received_days']} дн."
+    else:
+        engagement = "любые"
+    return {
+        'reg': f"📅 Регистрация: {registration}",
+        'act': f"⚡ Активность: {activity}",
+        'req': f"📝 Заявка: {request}",
+        'bc': f"📩 Рассылки: {engagement}",
+    }
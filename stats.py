@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+
+# Счётчики статистики обновляются триггерами при каждой записи в users и broadcasts,
+# поэтому панель статистики читает готовые числа, а не считает COUNT(*) по всей таблице.
+STATS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stats_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS stats_daily (
+    day TEXT PRIMARY KEY,
+    registrations INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+BEGIN
+    UPDATE stats_counters SET value = value + 1 WHERE name = 'users_total';
+    UPDATE stats_counters SET value = value + 1
+        WHERE name = CASE WHEN new.is_active = 1 THEN 'users_active' ELSE 'users_inactive' END;
+    UPDATE stats_counters SET value = value + 1
+        WHERE name = 'users_completed' AND new.request IS NOT NULL;
+    INSERT INTO stats_daily (day, registrations, completed)
+        VALUES (substr(new.registration_date, 1, 10), 1, new.request IS NOT NULL)
+        ON CONFLICT(day) DO UPDATE SET
+            registrations = registrations + 1,
+            completed = completed + excluded.completed;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_users_active AFTER UPDATE OF is_active ON users
+WHEN old.is_active IS NOT new.is_active
+BEGIN
+    UPDATE stats_counters SET value = value + (CASE WHEN new.is_active = 1 THEN 1 ELSE -1 END)
+        WHERE name = 'users_active';
+    UPDATE stats_counters SET value = value + (CASE WHEN new.is_active = 1 THEN -1 ELSE 1 END)
+        WHERE name = 'users_inactive';
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_users_completed AFTER UPDATE OF request ON users
+WHEN old.request IS NULL AND new.request IS NOT NULL
+BEGIN
+    UPDATE stats_counters SET value = value + 1 WHERE name = 'users_completed';
+    INSERT INTO stats_daily (day, completed)
+        VALUES (substr(coalesce(new.last_activity, datetime('now', 'localtime')), 1, 10), 1)
+        ON CONFLICT(day) DO UPDATE SET completed = completed + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users
+BEGIN
+    UPDATE stats_counters SET value = value - 1 WHERE name = 'users_total';
+    UPDATE stats_counters SET value = value - 1
+        WHERE name = CASE WHEN old.is_active = 1 THEN 'users_active' ELSE 'users_inactive' END;
+    UPDATE stats_counters SET value = value - 1
+        WHERE name = 'users_completed' AND old.request IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_broadcasts_progress AFTER UPDATE OF sent, failed, blocked ON broadcasts
+BEGIN
+    UPDATE stats_counters SET value = value + new.sent - old.sent WHERE name = 'broadcast_sent';
+    UPDATE stats_counters SET value = value + (new.failed + new.blocked) - (old.failed + old.blocked)
+        WHERE name = 'broadcast_failed';
+END;
+'''
+
+COUNTERS = (
+    'users_total', 'users_active', 'users_inactive', 'users_completed',
+    'broadcast_sent', 'broadcast_failed', 'users_archived',
+)
+
+# Начальные значения для базы, в которой уже есть пользователи — единственный полный проход.
+# Выполняется миграцией вместе с STATS_SCHEMA
+BACKFILL = '''
+INSERT INTO stats_counters (name, value)
+SELECT 'users_total', COUNT(*) FROM users
+UNION ALL SELECT 'users_active', COUNT(*) FROM users WHERE is_active = 1
+UNION ALL SELECT 'users_inactive', COUNT(*) FROM users WHERE is_active IS NOT 1
+UNION ALL SELECT 'users_completed', COUNT(*) FROM users WHERE request IS NOT NULL
+UNION ALL SELECT 'broadcast_sent', COALESCE(SUM(sent), 0) FROM broadcasts
+UNION ALL SELECT 'broadcast_failed', COALESCE(SUM(failed + blocked), 0) FROM broadcasts;
+
+INSERT INTO stats_daily (day, registrations, completed)
+SELECT substr(registration_date, 1, 10), COUNT(*), SUM(request IS NOT NULL)
+FROM users WHERE registration_date IS NOT NULL
+GROUP BY 1;
+'''
+
+
+def _percent(part, whole):
+    return f"{part / whole:.0%}" if whole else "—"
+
+
+def _trend(current, previous):
+    if not previous:
+        return ""
+    change = (current - previous) / previous
+    return f" ({'📈' if change >= 0 else '📉'} {change:+.0%} к прошлой неделе)"
+
+
+# Данные панели статистики: несколько чтений по первичным ключам, без сканирования users
+def load_dashboard(conn):
+    counters = dict(conn.execute('SELECT name, value FROM stats_counters').fetchall())
+    today = datetime.now().date()
+    since = (today - timedelta(days=29)).isoformat()
+    daily = dict(
+        (row[0], (row[1], row[2]))
+        for row in conn.execute(
+            'SELECT day, registrations, completed FROM stats_daily WHERE day >= ?', (since,)
+        )
+    )
+
+    def window(days, offset=0):
+        registrations = completed = 0
+        for i in range(offset, offset + days):
+            day_registrations, day_completed = daily.get((today - timedelta(days=i)).isoformat(), (0, 0))
+            registrations += day_registrations
+            completed += day_completed
+        return registrations, completed
+
+    last_broadcast = conn.execute(
+        'SELECT broadcast_id, total, sent FROM broadcasts WHERE status = ? ORDER BY broadcast_id DESC LIMIT 1',
+        ('done',)
+    ).fetchone()
+
+    return {
+        'counters': {name: counters.get(name, 0) for name in COUNTERS},
+        'today': window(1),
+        'week': window(7),
+        'prev_week': window(7, 7),
+        'month': window(30),
+        'last_broadcast': tuple(last_broadcast) if last_broadcast else None,
+    }
+
+
+def format_dashboard(data):
+    counters = data['counters']
+    week_registrations, week_completed = data['week']
+    month_registrations, month_completed = data['month']
+    delivered = counters['broadcast_sent']
+    attempted = delivered + counters['broadcast_failed']
+    # Перенесённые в архивную базу (retention.py) не входят в остальные счётчики
+    archived = f"🗄 В архиве: {counters['users_archived']}\n" if counters['users_archived'] else ""
+
+    text = (
+        "📊 Статистика пользователей:\n\n"
+        f"👥 Всего пользователей: {counters['users_total']}\n"
+        f"🆕 Сегодня: {data['today'][0]}\n"
+        f"✅ Активные: {counters['users_active']}\n"
+        f"❌ Неактивные: {counters['users_inactive']}\n"
+        f"{archived}\n"
+        f"📅 За 7 дней: {week_registrations} новых, {week_completed} заявок"
+        f"{_trend(week_registrations, data['prev_week'][0])}\n"
+        f"📅 За 30 дней: {month_registrations} новых, {month_completed} заявок\n\n"
+        "🎯 Конверсия /start → заявка:\n"
+        f"• за всё время: {_percent(counters['users_completed'], counters['users_total'])}\n"
+        f"• за 7 дней: {_percent(week_completed, week_registrations)}\n"
+        f"• за 30 дней: {_percent(month_completed, month_registrations)}\n\n"
+        f"📩 Рассылки: доставлено {delivered} из {attempted} ({_percent(delivered, attempted)})"
+    )
+    if data['last_broadcast']:
+        broadcast_id, total, sent = data['last_broadcast']
+        text += f"\n• последняя #{broadcast_id}: {sent} из {total} ({_percent(sent, total)})"
+    return text
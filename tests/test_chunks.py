@@ -0,0 +1,241 @@
+import asyncio
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcast import RateLimiter
+from broadcast_queue import BroadcastQueue, JOB_DONE, JOB_PENDING
+from broadcast_worker import BroadcastWorker
+from chunks import SQLiteChunkQueue, CHUNK_LEASED, CHUNK_OPEN, CHUNK_DONE
+from database import Database
+from migrations import migrate
+from payload import text_payload
+
+# Аренда порций рассылки (chunks.py) на временной базе. Каждый воркер — отдельный
+# Database со своим соединением и потоком, как у отдельных процессов broadcast_worker.py
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'bot.db')
+
+
+def seed(path, users):
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    with conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, first_name, registration_date, is_active, last_activity) '
+            "VALUES (?, 'Иван', '2024-01-01 00:00:00', 1, '2024-01-01 00:00:00')",
+            [(user_id,) for user_id in range(1, users + 1)]
+        )
+    conn.close()
+
+
+def chunk_row(db, chunk_id):
+    return db.call(lambda conn: conn.execute(
+        'SELECT status, worker, attempts FROM broadcast_chunks WHERE chunk_id = ?', (chunk_id,)
+    ).fetchone())
+
+
+async def create_job(db):
+    return await BroadcastQueue(db).create(1, {}, text_payload('Рассылка'))
+
+
+# Сообщение, отправка которого не заканчивается, пока её не отменят
+class BlockingMessage:
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def send(self, chat_id):
+        self.started.set()
+        await asyncio.Event().wait()
+
+
+def test_concurrent_claims_take_each_chunk_once(path):
+    seed(path, 100)
+    first, second = Database(path), Database(path)
+
+    async def drain(queue, worker):
+        claimed = []
+        while (chunk := await queue.claim(worker)) is not None:
+            claimed.append(chunk['chunk_id'])
+        return claimed
+
+    async def scenario():
+        await create_job(first)
+        queue_a = SQLiteChunkQueue(first, chunk_size=5)
+        queue_b = SQLiteChunkQueue(second, chunk_size=5)
+        # Оба воркера разбивают задание одновременно — порции создаются один раз
+        created = await asyncio.gather(queue_a.split_jobs(), queue_b.split_jobs())
+        assert sorted(created) == [0, 20]
+        return await asyncio.gather(drain(queue_a, 'a'), drain(queue_b, 'b'))
+
+    try:
+        claimed_a, claimed_b = asyncio.run(scenario())
+    finally:
+        first.close()
+        second.close()
+    assert not set(claimed_a) & set(claimed_b)
+    assert sorted(claimed_a + claimed_b) == list(range(1, 21))
+
+
+def test_expired_lease_is_reclaimed(path):
+    seed(path, 10)
+    first, second = Database(path), Database(path)
+
+    async def scenario():
+        await create_job(first)
+        queue_a = SQLiteChunkQueue(first, lease_seconds=0.05)
+        queue_b = SQLiteChunkQueue(second, lease_seconds=0.05)
+        await queue_a.split_jobs()
+        chunk = await queue_a.claim('a')
+        # Пока аренда действует, порцию не забрать
+        assert await queue_b.claim('b') is None
+        await asyncio.sleep(0.1)
+        reclaimed = await queue_b.claim('b')
+        assert reclaimed['chunk_id'] == chunk['chunk_id']
+        assert reclaimed['attempts'] == 2
+        # Прежний воркер потерял аренду: ни продлить, ни завершить порцию он не может
+        assert not await queue_a.heartbeat(chunk['chunk_id'], 'a')
+        assert not await queue_a.complete(chunk['chunk_id'], 'a')
+        assert await queue_b.complete(chunk['chunk_id'], 'b')
+        return chunk['chunk_id']
+
+    try:
+        chunk_id = asyncio.run(scenario())
+        assert tuple(chunk_row(first, chunk_id)) == (CHUNK_DONE, 'b', 2)
+    finally:
+        first.close()
+        second.close()
+
+
+def test_released_chunk_is_claimed_without_waiting_for_lease(path):
+    seed(path, 10)
+    first, second = Database(path), Database(path)
+
+    async def scenario():
+        await create_job(first)
+        queue_a = SQLiteChunkQueue(first, lease_seconds=3600)
+        queue_b = SQLiteChunkQueue(second, lease_seconds=3600)
+        await queue_a.split_jobs()
+        chunk = await queue_a.claim('a')
+        await queue_a.release(chunk['chunk_id'], 'a')
+        reclaimed = await queue_b.claim('b')
+        assert reclaimed['chunk_id'] == chunk['chunk_id']
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        first.close()
+        second.close()
+
+
+def test_job_without_recipients_finishes(path):
+    seed(path, 0)
+    db = Database(path)
+
+    async def scenario():
+        broadcast_id = await create_job(db)
+        queue = SQLiteChunkQueue(db)
+        assert await queue.split_jobs() == 0
+        assert await queue.claim('a') is None
+        finished = await queue.finish_jobs()
+        assert [job['broadcast_id'] for job in finished] == [broadcast_id]
+        assert await queue.finish_jobs() == []
+        return broadcast_id
+
+    try:
+        broadcast_id = asyncio.run(scenario())
+        assert db.call(lambda conn: conn.execute(
+            'SELECT status FROM broadcasts WHERE broadcast_id = ?', (broadcast_id,)
+        ).fetchone()[0]) == JOB_DONE
+    finally:
+        db.close()
+
+
+def test_finished_job_is_reported_exactly_once(path):
+    seed(path, 10)
+    first, second = Database(path), Database(path)
+
+    async def scenario():
+        await create_job(first)
+        queue_a = SQLiteChunkQueue(first, chunk_size=5)
+        queue_b = SQLiteChunkQueue(second, chunk_size=5)
+        await queue_a.split_jobs()
+        chunk = await queue_a.claim('a')
+        await queue_a.complete(chunk['chunk_id'], 'a')
+        last = await queue_b.claim('b')
+        # Одна порция ещё в работе — задание не завершено
+        assert await queue_a.finish_jobs() == []
+        await queue_b.complete(last['chunk_id'], 'b')
+        return await asyncio.gather(queue_a.finish_jobs(), queue_b.finish_jobs())
+
+    try:
+        reported = asyncio.run(scenario())
+    finally:
+        first.close()
+        second.close()
+    assert sum(len(jobs) for jobs in reported) == 1
+
+
+def test_lost_heartbeat_cancels_sending(path):
+    seed(path, 10)
+    first, second = Database(path), Database(path)
+
+    async def scenario():
+        broadcast_id = await create_job(first)
+        queue_a = SQLiteChunkQueue(first, lease_seconds=0.3)
+        queue_b = SQLiteChunkQueue(second, lease_seconds=0.3)
+        worker = BroadcastWorker(first, None, queue_a, RateLimiter(rate=1000), name='a')
+        message = worker._messages[broadcast_id] = BlockingMessage()
+        await queue_a.split_jobs()
+        chunk = await queue_a.claim('a')
+        processing = asyncio.create_task(worker.process(chunk))
+        await message.started.wait()
+        # Воркер завис: аренда истекла, порцию забрал другой воркер
+        await second.execute('UPDATE broadcast_chunks SET lease_until = 0 WHERE chunk_id = ?', (chunk['chunk_id'],))
+        assert (await queue_b.claim('b'))['chunk_id'] == chunk['chunk_id']
+        # Следующее продление аренды не удаётся, и отправка останавливается
+        await asyncio.wait_for(processing, 2)
+        assert worker.chunks_done == 0
+        return chunk['chunk_id']
+
+    try:
+        chunk_id = asyncio.run(scenario())
+        assert tuple(chunk_row(first, chunk_id))[:2] == (CHUNK_LEASED, 'b')
+    finally:
+        first.close()
+        second.close()
+
+
+def test_stopping_worker_releases_chunk(path):
+    seed(path, 10)
+    db = Database(path)
+
+    async def scenario():
+        broadcast_id = await create_job(db)
+        queue = SQLiteChunkQueue(db, lease_seconds=3600)
+        worker = BroadcastWorker(db, None, queue, RateLimiter(rate=1000), name='a')
+        message = worker._messages[broadcast_id] = BlockingMessage()
+        await queue.split_jobs()
+        chunk = await queue.claim('a')
+        processing = asyncio.create_task(worker.process(chunk))
+        await message.started.wait()
+        worker.stop()
+        await asyncio.wait_for(processing, 2)
+        return broadcast_id, chunk['chunk_id']
+
+    try:
+        broadcast_id, chunk_id = asyncio.run(scenario())
+        assert tuple(chunk_row(db, chunk_id))[:2] == (CHUNK_OPEN, None)
+        # Задание не завершено: получатели порции ждут следующего воркера
+        assert db.call(lambda conn: conn.execute(
+            'SELECT status FROM broadcasts WHERE broadcast_id = ?', (broadcast_id,)
+        ).fetchone()[0]) == JOB_PENDING
+    finally:
+        db.close()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений разных пользователей обрабатывается одновременно
+UPDATE_CONCURRENCY = 64
+# Сколько тяжёлых админских задач выполняется одновременно
+TASKS_LIMIT = 4
+
+
+# Ключ очереди: обновления одного пользователя (или чата, если пользователя нет)
+# обрабатываются строго по порядку, остальные — без упорядочивания
+def ordering_key(update):
+    if isinstance(update, Update):
+        if update.effective_user:
+            return ('user', update.effective_user.id)
+        if update.effective_chat:
+            return ('chat', update.effective_chat.id)
+    return None
+
+
+# Приложение, обрабатывающее обновления разных пользователей параллельно.
+# Обновления из update_queue забираются по одному (concurrent_updates выключен),
+# поэтому раскладываются по очередям пользователей в порядке поступления;
+# у каждой очереди один обработчик, так что диалог пользователя идёт строго по шагам.
+class OrderedUpdateApplication(Application):
+    def __init__(self, update_concurrency=UPDATE_CONCURRENCY, **kwargs):
+        super().__init__(**kwargs)
+        self.update_slots = asyncio.Semaphore(update_concurrency)
+        self.stopping = False
+        self._queues = {}
+        self._cancel_on_stop = set()
+
+    @property
+    def queued_updates(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    # Задача, которую остановка бота отменяет, а не ждёт. Application.stop() ждёт все задачи
+    # create_task, и рассылка на десятки тысяч получателей задерживала бы остановку на полчаса.
+    # Такие задачи хранят свой прогресс в базе и подхватываются после перезапуска,
+    # поэтому во время остановки новые не запускаются
+    def create_cancellable_task(self, coroutine, update=None):
+        if self.stopping:
+            coroutine.close()
+            return None
+        task = self.create_task(coroutine, update=update)
+        self._cancel_on_stop.add(task)
+        task.add_done_callback(self._cancel_on_stop.discard)
+        return task
+
+    async def stop(self):
+        self.stopping = True
+        if self._cancel_on_stop:
+            logger.info(f"Остановка: прерываем фоновых задач — {len(self._cancel_on_stop)}")
+        for task in list(self._cancel_on_stop):
+            task.cancel()
+        try:
+            await super().stop()
+        finally:
+            self.stopping = False
+
+    async def process_update(self, update):
+        key = ordering_key(update)
+        if key is None:
+            self.create_task(self._process(update), update=update)
+            return
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(update)
+            return
+        self._queues[key] = deque([update])
+        self.create_task(self._drain(key), update=update)
+
+    async def _process(self, update):
+        async with self.update_slots:
+            await super().process_update(update)
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                try:
+                    await self._process(queue[0])
+                finally:
+                    queue.popleft()
+        finally:
+            del self._queues[key]
+
+
+# Ограниченная группа фоновых задач: тяжёлые операции админов не занимают
+# обработчики обновлений и не выполняются больше limit одновременно.
+# Задачи группы resumable при остановке бота отменяются: они сохраняют прогресс
+# в базе и продолжаются после перезапуска (рассылки)
+class BoundedTaskGroup:
+    def __init__(self, name, limit=TASKS_LIMIT, resumable=False):
+        self.name = name
+        self.resumable = resumable
+        self._slots = asyncio.Semaphore(limit)
+        self.running = 0
+        self.waiting = 0
+
+    def start(self, application, coroutine, update=None):
+        if not self.resumable:
+            return application.create_task(self._run(coroutine), update=update)
+        if application.stopping:
+            coroutine.close()
+            logger.info(f"{self.name}: бот останавливается, задача продолжится после перезапуска")
+            return None
+        return application.create_cancellable_task(self._run(coroutine), update=update)
+
+    async def _run(self, coroutine):
+        self.waiting += 1
+        if self._slots.locked():
+            logger.info(f"{self.name}: задача ждёт своей очереди, выполняется {self.running}")
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            coroutine.close()
+            raise
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            return await coroutine
+        finally:
+            self.running -= 1
+            self._slots.release()
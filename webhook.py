@@ -0,0 +1,90 @@
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+# Приём обновлений через вебхук: Telegram сам присылает POST на наш адрес,
+# обновление кладётся в update_queue приложения и обрабатывается как при polling.
+# Запросы без секретного токена отклоняются всегда: иначе любой, кто знает адрес,
+# может прислать поддельное обновление от имени суперадмина. Если токен не задан,
+# он генерируется при запуске и передаётся Telegram в set_webhook.
+class WebhookServer:
+    def __init__(self, application, listen='127.0.0.1', port=8080, path='/webhook', secret_token=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self._runner = None
+
+    async def handle(self, request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            logger.warning(f"Вебхук: неверный секретный токен от {request.remote}")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400)
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        # Порт 0 — выбирается свободный; запоминаем фактический
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Запуск бота в режиме вебхука — аналог application.run_polling():
+# те же post_init/post_shutdown, остановка по SIGINT/SIGTERM
+async def run_webhook(application, url, listen='127.0.0.1', port=8080, path='/webhook',
+                      secret_token=None, max_connections=40):
+    server = WebhookServer(application, listen, port, path, secret_token)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            url=f"{url.rstrip('/')}{path}",
+            secret_token=server.secret_token,
+            max_connections=max_connections,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await stop_event.wait()
+    finally:
+        logger.info("Останавливаем вебхук")
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)